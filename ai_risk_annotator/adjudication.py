@@ -0,0 +1,88 @@
+import threading
+
+import pandas as pd
+import streamlit as st
+from analytics import (
+    changed_incidents,
+    field_disagreement,
+    incident_hashes,
+)
+from profiling import span
+
+FIELDS = ["stakeholders", "harm_category", "harm_subcategory", "harm_type"]
+
+
+class DisagreementTable:
+    """Per-incident and per-field disagreement, ranked, updated incrementally.
+
+    It is updated from the latest annotations, see `LatestAnnotations`,
+    and only scores again the incidents whose annotations changed.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hashes = pd.Series(dtype="uint64", index=pd.Index([], dtype=object))
+        self.scores = pd.DataFrame(
+            columns=["annotators", *FIELDS, "disagreement"],
+            index=pd.Index([], name="incident_ID"),
+        )
+        self.source_version = None
+        # The scores sorted, until the next change
+        self._ranked = None
+
+    def update(self, df_latest: pd.DataFrame) -> int:
+        """Takes the new annotations into account, returns the number of changed incidents."""
+        # `LatestAnnotations.frame` stores its version, unchanged without new submissions
+        source_version = df_latest.attrs.get("version")
+        if source_version is not None and source_version == self.source_version:
+            return 0
+        df = df_latest.dropna(subset=["incident_ID", "annotator"])
+        hashes = incident_hashes(df, ["annotator", "incident_ID", "timestamp", *FIELDS])
+        with self._lock:
+            self.source_version = source_version
+            changed = changed_incidents(self.hashes, hashes)
+            if not changed:
+                return 0
+            with span("adjudication.update"):
+                df_scores = field_disagreement(df[df.incident_ID.isin(changed)], FIELDS)
+                # Only the rows of the changed incidents are replaced, the
+                # table is sorted when it is read
+                self.scores = pd.concat(
+                    [
+                        self.scores.drop(index=list(changed), errors="ignore"),
+                        df_scores,
+                    ]
+                    if not self.scores.empty
+                    else [df_scores]
+                )
+                self._ranked = None
+            self.hashes = hashes
+        return len(changed)
+
+    def ranked(self) -> pd.DataFrame:
+        """The scores, the most disagreed incidents first."""
+        with self._lock:
+            if self._ranked is None:
+                self._ranked = self.scores.sort_values("disagreement", ascending=False)
+            return self._ranked.copy()
+
+
+def candidate_labels(df_incident: pd.DataFrame) -> pd.DataFrame:
+    """The distinct label rows of the annotators of one incident, with their votes.
+
+    A row is kept by default when at least half of the annotators gave it.
+    """
+    n_annotators = df_incident.annotator.nunique()
+    df_candidates = (
+        df_incident.fillna({field: "" for field in FIELDS})
+        .groupby(FIELDS)
+        .annotator.agg(annotators=lambda s: ", ".join(sorted(set(s))), votes="nunique")
+        .reset_index()
+    )
+    df_candidates.insert(0, "keep", 2 * df_candidates.votes >= n_annotators)
+    return df_candidates.sort_values("votes", ascending=False, ignore_index=True)
+
+
+@st.cache_resource
+def get_disagreement_table() -> DisagreementTable:
+    return DisagreementTable()
@@ -0,0 +1,273 @@
+import pandas as pd
+from nltk import agreement
+
+# Analytics behind the results page, kept free of streamlit calls
+# so that they can be cached by the page and benchmarked offline
+
+# Below this many rows, the disagreement is computed without pandas
+SMALL_FRAME_ROWS = 5000
+
+
+def counts_figure(df: pd.DataFrame, column: str):
+    df_counts = (
+        df[column].value_counts(sort=True, ascending=True).to_frame(name="count")
+    )
+    return df_counts.plot(kind="barh", backend="plotly").update_layout(
+        showlegend=False,
+        xaxis={"title": "", "visible": True, "showticklabels": True},
+        yaxis={"title": "", "visible": True, "showticklabels": True},
+    )
+
+
+def sankey_counts(df: pd.DataFrame, sankey_vars: list) -> pd.DataFrame:
+    return df.groupby(sankey_vars).size().to_frame(name="counts").reset_index()
+
+
+def gen_sankey(df, cat_cols=[], value_cols="", title="Sankey Diagram"):
+    color_palette = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b"]
+
+    label_list = []
+    color_num_list = []
+    for cat_col in cat_cols:
+        label_list_temp = list(set(df[cat_col].values))
+        color_num_list.append(len(label_list_temp))
+        label_list = label_list + label_list_temp
+
+    # remove duplicates from label_list
+    label_list = list(dict.fromkeys(label_list))
+
+    # define colors based on number of levels
+    color_list = []
+    for idx, color_num in enumerate(color_num_list):
+        color_list = color_list + [color_palette[idx]] * color_num
+
+    # transform df into a source-target pair
+    for i in range(len(cat_cols) - 1):
+        if i == 0:
+            source_target_df = df[[cat_cols[i], cat_cols[i + 1], value_cols]]
+            source_target_df.columns = ["source", "target", "count"]
+        else:
+            temp_df = df[[cat_cols[i], cat_cols[i + 1], value_cols]]
+            temp_df.columns = ["source", "target", "count"]
+            source_target_df = pd.concat([source_target_df, temp_df])
+        source_target_df = (
+            source_target_df.groupby(["source", "target"])
+            .agg({"count": "sum"})
+            .reset_index()
+        )
+
+    # add index for source-target pair
+    source_target_df["sourceID"] = source_target_df["source"].apply(
+        lambda x: label_list.index(x)
+    )
+    source_target_df["targetID"] = source_target_df["target"].apply(
+        lambda x: label_list.index(x)
+    )
+
+    # creating the sankey diagram
+    data = dict(
+        type="sankey",
+        node=dict(
+            pad=15,
+            thickness=20,
+            line=dict(color="black", width=0.5),
+            label=label_list,
+            # color=color_list,
+        ),
+        link=dict(
+            source=source_target_df["sourceID"],
+            target=source_target_df["targetID"],
+            value=source_target_df["count"],
+        ),
+    )
+
+    layout = dict(title=title, font=dict(size=10), height=1200)
+
+    fig = dict(data=[data], layout=layout)
+    return fig
+
+
+def preprocess_data(df):
+    data_dict = {}
+    for _, r in df.iterrows():
+        i = (
+            r.incident_ID + "-" + r.annotator + "-" + str(r.timestamp)
+        )  # find same incidents annotated by same person at same time (repeat annotations will be included as separate items)
+        if i not in data_dict:
+            data_dict[i] = {"stakeholder": r.stakeholders, "harm": r.harm_subcategory}
+        else:
+            data_dict[i]["stakeholder"] = (
+                data_dict[i]["stakeholder"] + "|" + r.stakeholders
+            )  # multiple annotations of same incident separated by pipe
+            data_dict[i]["harm"] = data_dict[i]["harm"] + "|" + r.harm_subcategory
+    return data_dict
+
+
+def get_df(data_dict, field):
+    # dictionary of labels for the chosen field (stakeholder/harm):
+    # {'AIAAIC0554': {'DB': 'Vulnerable groups', 'GA': 'General public', 'CP': 'Business'}, ...}
+    labels = {}
+    for k, v in data_dict.items():
+        incident = k.split("-")[0]  # incident id
+        annotator = k.split("-")[
+            1
+        ]  # annotator initials (should give each annotator a uniquie id)
+        label = v[field]
+        if incident not in labels:
+            labels[incident] = {annotator: label}
+        else:
+            labels[incident][annotator] = label
+
+    # create dataframe
+    #      Incident                 DB              GA              CP
+    # 0  AIAAIC0554  Vulnerable groups  General public        Business
+    labels_list = [[v for v in val.values()] for val in labels.values()]
+    df = pd.DataFrame(
+        [[key] + [v for v in val.values()] for key, val in labels.items()],
+        columns=[["Incident"] + [ann for ann in val] for val in labels.values()][0],
+    )
+    return df
+
+
+# the rest is based on https://stackoverflow.com/questions/45741934/
+def create_annot(an):
+    """
+    Create frozensets with the unique label
+    or with both labels splitting on pipe.
+    Unique label has to go in a list so that
+    frozenset does not split it into characters.
+    """
+    if "|" in str(an):
+        an = frozenset(an.split("|"))
+    else:
+        an = frozenset([an])  # single label has to go in a list as well
+    return an
+
+
+def format_annots(df):
+    annots = []
+    for idx, row in df.iterrows():
+        incident = row[0]
+        for ann in row.index[1:]:
+            annot_coder = [ann, incident, create_annot(row[ann])]
+            annots.append(annot_coder)
+    return annots
+
+
+def agreement_alphas(df: pd.DataFrame) -> tuple[float, float]:
+    """Krippendorf's alpha on the stakeholders and on the harm subcategories."""
+    data_dict = preprocess_data(df)
+
+    df_stakeholder = get_df(data_dict, "stakeholder")
+    annots_stakeholder = format_annots(df_stakeholder)
+    task_stakeholder = agreement.AnnotationTask()
+    task_stakeholder.load_array(annots_stakeholder)
+    alpha_stakeholder = task_stakeholder.alpha()
+
+    df_harm = get_df(data_dict, "harm")
+    annots_harm = format_annots(df_harm)
+    task_harm = agreement.AnnotationTask()
+    task_harm.load_array(annots_harm)
+    alpha_harm = task_harm.alpha()
+    return alpha_stakeholder, alpha_harm
+
+
+def incident_hashes(df: pd.DataFrame, columns: list) -> pd.Series:
+    """A hash of the annotation rows of each incident, whatever their order."""
+    return (
+        pd.util.hash_pandas_object(df[columns], index=False)
+        .groupby(df.incident_ID.to_numpy())
+        .sum()
+    )
+
+
+def changed_incidents(previous: pd.Series, hashes: pd.Series) -> set:
+    """The incidents added, removed or modified between two `incident_hashes`."""
+    common = hashes.index.intersection(previous.index)
+    changed = set(hashes.index.difference(common))
+    changed |= set(previous.index.difference(common))
+    changed |= set(common[(hashes.loc[common] != previous.loc[common]).to_numpy()])
+    return changed
+
+
+def latest_submissions(df: pd.DataFrame) -> pd.DataFrame:
+    """The rows of the last submission of each annotator on each incident."""
+    # The rows without a timestamp belong to the same, oldest, submission
+    timestamps = pd.to_numeric(df.timestamp, errors="coerce").fillna(0)
+    last_timestamp = timestamps.groupby([df.annotator, df.incident_ID]).transform("max")
+    return df[timestamps == last_timestamp]
+
+
+def _small_field_disagreement(df: pd.DataFrame, fields: list) -> pd.DataFrame:
+    """`field_disagreement` with the annotators' sets of values in dicts."""
+    annotators, chosen = {}, {}
+    for incident, annotator, *values in zip(
+        df.incident_ID.to_numpy(),
+        df.annotator.to_numpy(),
+        *(df[field].to_numpy() for field in fields),
+    ):
+        annotators.setdefault(incident, set()).add(annotator)
+        for field, value in zip(fields, values):
+            # None or NaN
+            if value is None or value != value:
+                continue
+            chosen.setdefault((incident, field), {}).setdefault(value, set()).add(
+                annotator
+            )
+    rows = {}
+    for incident, incident_annotators in annotators.items():
+        n_annotators = len(incident_annotators)
+        if n_annotators < 2:
+            continue
+        rows[incident] = [n_annotators]
+        for field in fields:
+            by_value = chosen.get((incident, field), {})
+            chosen_by_all = sum(len(a) == n_annotators for a in by_value.values())
+            rows[incident].append(
+                1 - chosen_by_all / len(by_value) if by_value else 0.0
+            )
+    scores = pd.DataFrame.from_dict(
+        rows, orient="index", columns=["annotators", *fields]
+    ).sort_index()
+    scores.index.name = "incident_ID"
+    scores["disagreement"] = scores[fields].mean(axis=1)
+    return scores
+
+
+def field_disagreement(df: pd.DataFrame, fields: list) -> pd.DataFrame:
+    """Per incident annotated by several annotators, and per field, the share
+    of the chosen values that were not chosen by all the annotators.
+
+    It is 1 minus the size of the intersection of the annotators' sets of
+    values over the size of their union, computed for all the incidents at
+    once from the counts of annotators per value. The `disagreement` column
+    is the mean over the fields.
+
+    The frames of a few incidents, as in the incremental updates, are scored
+    in plain Python, where the fixed cost of the pandas operations dominates.
+    """
+    if len(df) < SMALL_FRAME_ROWS:
+        return _small_field_disagreement(df, fields)
+    n_annotators = df.groupby("incident_ID").annotator.nunique()
+    n_annotators = n_annotators[n_annotators > 1]
+    df = df[df.incident_ID.isin(n_annotators.index)]
+    scores = pd.DataFrame(index=n_annotators.index)
+    for field in fields:
+        counts = (
+            df.dropna(subset=[field])
+            .drop_duplicates(["incident_ID", "annotator", field])
+            .groupby(["incident_ID", field])
+            .size()
+        )
+        incidents = counts.index.get_level_values("incident_ID")
+        chosen_by_all = counts.to_numpy() == n_annotators.reindex(incidents).to_numpy()
+        sets = (
+            pd.DataFrame({"intersection": chosen_by_all, "union": 1}, index=incidents)
+            .groupby(level=0)
+            .sum()
+        )
+        scores[field] = 1 - sets.intersection / sets.union
+    scores = scores.fillna(0)
+    scores.insert(0, "annotators", n_annotators)
+    scores["disagreement"] = scores[fields].mean(axis=1)
+    return scores
@@ -1,8 +1,8 @@
 import streamlit as st
 import streamlit.components.v1 as components
-from streamlit_gsheets import GSheetsConnection
 from streamlit_markmap import markmap
-from utils import check_password, create_side_menu, get_harm_descriptions
+from form import Harms
+from utils import check_password, create_side_menu, get_connection
 
 st.set_page_config(page_title="AI and Algorithmic Harm Annotator", layout="centered")
 
@@ -67,29 +67,17 @@ st.page_link(
 )
 
 try:
-    conn = st.connection("gsheets", type=GSheetsConnection)
+    conn = get_connection()
 except Exception as e:
     st.error("Cannot connect to Google Sheets. Error: " + str(e))
     raise
 
-harm_categories, harm_categories_descriptions = get_harm_descriptions(conn)
-
-taxonomy_mindmap = """
----
-markmap:
-    colorFreezeLevel: 2
----
-# AI Harm Taxonomy
-"""
-for k, v in harm_categories.items():
-    taxonomy_mindmap += f"## {k}\n"
-    for i in v:
-        taxonomy_mindmap += f"### {i}\n"
+harms = Harms.download(conn)
 
 
 st.divider()
 st.markdown("#### Harms taxonomy overview")
-markmap(taxonomy_mindmap)
+markmap(harms.mindmap())
 # st.divider()
 # st.markdown("#### Training slides")
 # components.iframe(
@@ -0,0 +1,78 @@
+import math
+import re
+
+# Words and punctuation marks, a rough stand-in for the models' tokenizers
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# Subword tokenizers split the rarer words, hence a bit more than one token per word
+TOKENS_PER_WORD = 1.3
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of tokens of the text, without any model's tokenizer."""
+    return math.ceil(len(TOKEN_PATTERN.findall(text)) * TOKENS_PER_WORD)
+
+
+def _split_words(text: str, max_tokens: int) -> list[str]:
+    words = text.split()
+    # Words glued to punctuation count as several tokens, hence the margin
+    words_per_chunk = max(int(max_tokens / TOKENS_PER_WORD / 2), 1)
+    return [
+        " ".join(words[i : i + words_per_chunk])
+        for i in range(0, len(words), words_per_chunk)
+    ]
+
+
+def _pieces(text: str, max_tokens: int) -> list[str]:
+    """Paragraphs, or the sentences (or words) of the paragraphs above the budget."""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n|\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in SENTENCE_END.split(paragraph):
+            if estimate_tokens(sentence) <= max_tokens:
+                pieces.append(sentence)
+            else:
+                pieces.extend(_split_words(sentence, max_tokens))
+    return pieces
+
+
+def split_into_chunks(text: str, max_tokens: int) -> list[str]:
+    """Splits the text into chunks of at most `max_tokens`, along the
+    paragraphs when possible, so that no part of the text is dropped."""
+    chunks, current, current_tokens = [], [], 0
+    for piece in _pieces(text, max_tokens):
+        piece_tokens = estimate_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def group_by_budget(texts: list[str], max_tokens: int) -> list[list[str]]:
+    """Consecutive groups of texts, each within `max_tokens` (unless a text alone exceeds it)."""
+    groups, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The beginning of the text, within `max_tokens`."""
+    chunks = split_into_chunks(text, max_tokens)
+    return chunks[0] if chunks else ""
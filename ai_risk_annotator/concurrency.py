@@ -0,0 +1,315 @@
+import collections
+import functools
+import inspect
+import pickle
+import threading
+import time
+from concurrent.futures import Future
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Seconds to wait before retrying a failed background refresh
+REFRESH_RETRY_DELAY = 60
+
+
+class SingleFlight:
+    """Deduplicates concurrent computations of the same key.
+
+    The first caller for a key runs the computation, the callers arriving
+    while it is in flight wait for its result (or its exception) instead of
+    running it again.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def do(self, key, func) -> tuple:
+        """Returns `(value, shared)`, where `shared` is True for the waiting callers."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            value = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value, False
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+class SharedCache:
+    """Process-wide TTL cache shared by all the sessions, with single-flight misses.
+
+    Unlike `st.cache_data`, values are returned as is, without copies,
+    so they must be treated as read-only by the callers.
+
+    With `stale_while_revalidate`, an expired entry is still served right
+    away while a background thread refreshes it. If the refresh fails, the
+    last good value keeps being served and the refresh is retried later.
+    Only keys that were never computed (or were invalidated) block the caller.
+
+    With `max_entries`, the least recently used entries are evicted beyond
+    that number, together with their error and their counts.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        stale_while_revalidate: bool = True,
+        max_entries: int = None,
+    ) -> None:
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (value, updated_at as a timestamp, expires_at as a monotonic time),
+        # the least recently used first
+        self._entries = collections.OrderedDict()
+        self._single_flight = SingleFlight()
+        self._refreshing = set()
+        # key -> (error, failed_at as a timestamp, retry_at as a monotonic time)
+        self._errors = {}
+        # Per key: served from the cache (fresh or stale), computed,
+        # or coalesced with the computation of another caller
+        self._stats = collections.defaultdict(collections.Counter)
+
+    def lookup(self, key) -> tuple:
+        """Returns `(True, value)` for a fresh entry, `(False, None)` otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            fresh = entry is not None and time.monotonic() < entry[2]
+            if fresh:
+                self._entries.move_to_end(key)
+                self._stats[key]["hit"] += 1
+        return (True, entry[0]) if fresh else (False, None)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def _count(self, key, outcome: str):
+        with self._lock:
+            self._stats[key][outcome] += 1
+
+    def stats(self) -> dict:
+        """Returns the hit, stale, miss and coalesce counts per key."""
+        with self._lock:
+            return {key: dict(counter) for key, counter in self._stats.items()}
+
+    def freshness(self, key) -> dict:
+        """Metadata on the cached value of a key, for display."""
+        with self._lock:
+            entry = self._entries.get(key)
+            error = self._errors.get(key)
+            refreshing = key in self._refreshing
+        if entry is None:
+            return dict(cached=False, refreshing=refreshing)
+        return dict(
+            cached=True,
+            updated_at=entry[1],
+            age=time.time() - entry[1],
+            stale=time.monotonic() >= entry[2],
+            refreshing=refreshing,
+            last_error=None if error is None else str(error[0]),
+            failed_at=None if error is None else error[1],
+        )
+
+    def _compute_and_store(self, key, compute):
+        # The previous leader may have stored it since the caller's lookup
+        fresh, value = self.lookup(key)
+        if fresh:
+            return value
+        self._count(key, "miss")
+        value = compute()
+        with self._lock:
+            self._entries[key] = (value, time.time(), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            self._errors.pop(key, None)
+            self._evict()
+        return value
+
+    def _evict(self):
+        if self.max_entries is None:
+            return
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            self._errors.pop(key, None)
+            self._stats.pop(key, None)
+        # The keys whose computation failed have counts but no entry
+        if len(self._stats) > self.max_entries:
+            for key in [key for key in self._stats if key not in self._entries]:
+                del self._stats[key]
+
+    def _refresh(self, key, compute):
+        try:
+            self._single_flight.do(key, lambda: self._compute_and_store(key, compute))
+        except Exception as e:
+            retry_in = min(self.ttl, REFRESH_RETRY_DELAY)
+            with self._lock:
+                self._errors[key] = (e, time.time(), time.monotonic() + retry_in)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_in_background(self, key, compute):
+        with self._lock:
+            error = self._errors.get(key)
+            if key in self._refreshing or (error and time.monotonic() < error[2]):
+                return
+            self._refreshing.add(key)
+        threading.Thread(
+            target=self._refresh, args=(key, compute), name="cache-refresh", daemon=True
+        ).start()
+
+    def get(self, key, compute):
+        fresh, value = self.lookup(key)
+        if fresh:
+            return value
+
+        if self.stale_while_revalidate:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self._stats[key]["stale"] += 1
+            if entry is not None:
+                self._refresh_in_background(key, compute)
+                return entry[0]
+
+        value, shared = self._single_flight.do(
+            key, lambda: self._compute_and_store(key, compute)
+        )
+        if shared:
+            self._count(key, "coalesced")
+        return value
+
+    def expire(self, key):
+        """Marks an entry as stale: it is still served, while it is refreshed."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (entry[0], entry[1], time.monotonic())
+            self._errors.pop(key, None)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._errors.clear()
+            else:
+                self._entries.pop(key, None)
+                self._errors.pop(key, None)
+
+
+_shared_caches = {}
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return pickle.dumps(value)
+    return value
+
+
+def shared_cache(
+    ttl: float,
+    show_spinner: str = None,
+    stale_while_revalidate: bool = True,
+    max_entries: int = None,
+):
+    """Caches the decorated loader in a `SharedCache`.
+
+    As with `st.cache_data`, the parameters starting with an underscore
+    (e.g. `_conn`) are not part of the cache key, and `max_entries` bounds
+    the number of cached arguments, e.g. for the per-incident loaders. The decorated function
+    gets `clear()`, `invalidate(*args, **kwargs)`, `expire(*args, **kwargs)`
+    and `freshness(*args, **kwargs)` methods. The spinner is only shown
+    when the caller has to wait for the value.
+    """
+
+    def decorator(func):
+        cache = SharedCache(ttl, stale_while_revalidate, max_entries)
+        _shared_caches[f"{func.__module__}.{func.__qualname__}"] = cache
+        signature = inspect.signature(func)
+
+        def make_key(args, kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return tuple(
+                (name, _hashable(value))
+                for name, value in bound.arguments.items()
+                if not name.startswith("_")
+            )
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            compute = functools.partial(func, *args, **kwargs)
+            if (
+                show_spinner
+                and key not in cache
+                and get_script_run_ctx(suppress_warning=True)
+            ):
+                with st.spinner(show_spinner):
+                    return cache.get(key, compute)
+            return cache.get(key, compute)
+
+        wrapper.cache = cache
+        wrapper.clear = cache.invalidate
+        wrapper.invalidate = lambda *args, **kwargs: cache.invalidate(
+            make_key(args, kwargs)
+        )
+        wrapper.expire = lambda *args, **kwargs: cache.expire(make_key(args, kwargs))
+        wrapper.freshness = lambda *args, **kwargs: cache.freshness(
+            make_key(args, kwargs)
+        )
+        return wrapper
+
+    return decorator
+
+
+def clear_shared_caches():
+    for cache in _shared_caches.values():
+        cache.invalidate()
+
+
+def shared_cache_stats() -> list[dict]:
+    """Flattens the per-key counts of every shared cache, for reporting."""
+    return [
+        {
+            "function": name,
+            "key": ", ".join(f"{k}={v!r}" for k, v in key),
+            "hit": counts.get("hit", 0),
+            "stale": counts.get("stale", 0),
+            "miss": counts.get("miss", 0),
+            "coalesced": counts.get("coalesced", 0),
+        }
+        for name, cache in _shared_caches.items()
+        for key, counts in cache.stats().items()
+    ]
+
+
+def describe_freshness(freshness: dict) -> str:
+    """Short caption telling how old a cached value is."""
+    if not freshness["cached"]:
+        return "Loading..."
+    minutes = int(freshness["age"] // 60)
+    caption = "Updated just now" if minutes == 0 else f"Updated {minutes} min ago"
+    if freshness["refreshing"]:
+        caption += ", refreshing in the background"
+    elif freshness["last_error"]:
+        caption += " (the last refresh failed, showing the previous version)"
+    return caption
@@ -0,0 +1,127 @@
+import re
+import zlib
+
+import numpy as np
+
+# Articles sharing at least this fraction of their shingles are near-duplicates
+SIMILARITY_THRESHOLD = 0.7
+# Words per shingle
+SHINGLE_SIZE = 5
+SHINGLE_BASE = np.uint64(1_000_003)
+# 32 bands of 4 rows: the pairs above the threshold share a band with
+# a probability above 99.9%, and only the texts sharing a band are compared
+BANDS = 32
+ROWS = 4
+N_PERMUTATIONS = BANDS * ROWS
+# The permutations are random multiply-shift hash functions
+_rng = np.random.default_rng(0)
+_A = _rng.integers(1, 1 << 63, N_PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 1 << 63, N_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingles(text: str) -> np.ndarray:
+    """The hashes of the overlapping word n-grams of the text."""
+    words = np.fromiter(
+        (zlib.crc32(word.encode("utf-8")) for word in re.findall(r"\w+", text.lower())),
+        dtype=np.uint64,
+    )
+    n_grams = max(len(words) - SHINGLE_SIZE + 1, 1)
+    # Polynomial hash of the words of each n-gram, modulo 2^32
+    hashes = np.zeros(n_grams, dtype=np.uint64)
+    for i in range(min(SHINGLE_SIZE, len(words))):
+        hashes = (hashes * SHINGLE_BASE + words[i : i + n_grams]) & 0xFFFFFFFF
+    return np.unique(hashes)
+
+
+def minhash(text: str) -> np.ndarray:
+    """The MinHash signature of the text: the fraction of equal values
+    between two signatures estimates the Jaccard similarity of their shingles."""
+    hashes = shingles(text)
+    # The products wrap around modulo 2^64, of which the high bits are kept
+    return ((np.outer(hashes, _A) + _B) >> np.uint64(32)).min(axis=0)
+
+
+def similarity(signature, other_signature) -> float:
+    return float(np.mean(signature == other_signature))
+
+
+class NearDuplicates:
+    """Clusters near-duplicate texts with MinHash and locality-sensitive hashing.
+
+    The signatures are split into bands: only the texts sharing a band
+    are compared, and the pairs above `threshold` are merged into the
+    same cluster.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.signatures = []
+        self.buckets = {}
+        self.parents = []
+
+    def _root(self, i: int) -> int:
+        while self.parents[i] != i:
+            self.parents[i] = self.parents[self.parents[i]]
+            i = self.parents[i]
+        return i
+
+    def add(self, text: str) -> int:
+        """Adds a text, returns its position."""
+        position = len(self.signatures)
+        signature = minhash(text)
+        self.signatures.append(signature)
+        self.parents.append(position)
+        candidates = set()
+        for band in range(BANDS):
+            bucket = (band, signature[band * ROWS : (band + 1) * ROWS].tobytes())
+            candidates.update(self.buckets.setdefault(bucket, []))
+            self.buckets[bucket].append(position)
+        for candidate in candidates:
+            if similarity(signature, self.signatures[candidate]) >= self.threshold:
+                self.parents[self._root(candidate)] = self._root(position)
+        return position
+
+    def clusters(self) -> list:
+        """The positions of the texts of each cluster."""
+        clusters = {}
+        for position in range(len(self.parents)):
+            clusters.setdefault(self._root(position), []).append(position)
+        return list(clusters.values())
+
+
+def deduplicate(articles: list[str]) -> list[str]:
+    """The articles without their near-duplicates, keeping the first of each cluster."""
+    near_duplicates = NearDuplicates()
+    for article in articles:
+        near_duplicates.add(article)
+    kept = sorted(cluster[0] for cluster in near_duplicates.clusters())
+    return [articles[i] for i in kept]
+
+
+def canonical_articles(incidents_articles: list) -> tuple[list, int]:
+    """Replaces the near-duplicate articles of each incident by the longest
+    article of their cluster.
+
+    Only the articles of the same incident are compared, so that a summary
+    is never built from an article scraped for another incident. The
+    identical articles of several incidents still give identical prompts,
+    which the LLM client generates once. Returns the articles of each
+    incident and the number of articles the LLM does not have to process.
+    """
+    deduplicated = []
+    n_duplicates = 0
+    for articles in incidents_articles:
+        near_duplicates = NearDuplicates()
+        for article in articles:
+            near_duplicates.add(article)
+        clusters = near_duplicates.clusters()
+        # In the order of the articles, as `deduplicate` keeps them
+        clusters.sort(key=min)
+        kept = []
+        for cluster in clusters:
+            longest = articles[max(cluster, key=lambda i: len(articles[i]))]
+            if longest not in kept:
+                kept.append(longest)
+        deduplicated.append(kept)
+        n_duplicates += len(articles) - len(kept)
+    return deduplicated, n_duplicates
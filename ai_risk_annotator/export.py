@@ -0,0 +1,338 @@
+import datetime
+import json
+import os
+import shutil
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+from profiling import span
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+EXPORT_DIR = "exports"
+CHUNK_ROWS = 5000
+FORMATS = ["jsonl", "parquet"] if pq is not None else ["jsonl"]
+# The partition of the rows without a value, as named by Hive and Spark
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# The columns of each dataset and their types, the same in every export
+# whatever the content, so that the downstream code can rely on them
+SCHEMAS = {
+    "annotations": {
+        "datetime": "string",
+        "annotator": "string",
+        "incident_ID": "string",
+        "stakeholders": "string",
+        "harm_category": "string",
+        "harm_subcategory": "string",
+        "harm_type": "string",
+        "notes": "string",
+        "timestamp": "int64",
+    },
+    "repository": {
+        "incident_ID": "string",
+        "title": "string",
+        "links": "string",
+    },
+    "descriptions": {
+        "incident_ID": "string",
+        "description": "string",
+        "links": "list<string>",
+    },
+    "summaries": {
+        "incident_ID": "string",
+        "summary": "string",
+        "articles": "list<string>",
+    },
+    "suggestions": {
+        "incident_ID": "string",
+        "model": "string",
+        "taxonomy_version": "string",
+        "created_at": "float64",
+        "harms": "string",
+    },
+}
+# The column whose values split a dataset in directories, Hive style
+PARTITIONS = {"annotations": "datetime", "suggestions": "model"}
+
+
+def arrow_schema(schema: dict):
+    types = {
+        "string": pa.string(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "list<string>": pa.list_(pa.string()),
+    }
+    return pa.schema([(column, types[kind]) for column, kind in schema.items()])
+
+
+def conform(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """The columns of the schema, in its order and with its types."""
+    df = df.reindex(columns=list(schema))
+    for column, kind in schema.items():
+        if kind == "string":
+            df[column] = df[column].astype("string")
+        elif kind == "int64":
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype("Int64")
+        elif kind == "float64":
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(float)
+        else:
+            df[column] = [
+                (
+                    [str(item) for item in value]
+                    if isinstance(value, (list, tuple, np.ndarray))
+                    else None
+                )
+                for value in df[column]
+            ]
+    return df
+
+
+def partition_directory(column: str, value) -> str:
+    if pd.isna(value) or not str(value).strip():
+        return f"{column}={NULL_PARTITION}"
+    # Escaped like Hive does, the readers unescape the values
+    return f"{column}=" + quote(str(value), safe="")
+
+
+class DatasetWriter:
+    """Writes the chunks of a dataset as they come, one file per partition.
+
+    The Parquet files get a row group per chunk, and the JSONL ones are
+    appended to, so that only one chunk is in memory at a time.
+    """
+
+    def __init__(self, directory: str, schema: dict, fmt: str, partition=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown or unavailable export format: {fmt}")
+        self.directory = directory
+        self.schema = schema
+        self.fmt = fmt
+        self.partition = partition
+        self.files = {}
+        self.rows = 0
+        if fmt == "parquet":
+            # The partition column is in the directory names, not in the files
+            self.arrow_schema = arrow_schema(
+                {c: kind for c, kind in schema.items() if c != partition}
+            )
+
+    def _file(self, partition_value):
+        directory = self.directory
+        if self.partition:
+            directory = os.path.join(
+                directory, partition_directory(self.partition, partition_value)
+            )
+        if directory not in self.files:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-0.{self.fmt}")
+            if self.fmt == "parquet":
+                self.files[directory] = pq.ParquetWriter(path, self.arrow_schema)
+            else:
+                self.files[directory] = open(path, "w", encoding="utf-8")
+        return self.files[directory]
+
+    def write(self, df: pd.DataFrame):
+        df = conform(df, self.schema)
+        self.rows += len(df)
+        if not self.partition:
+            self._write(self._file(None), df)
+            return
+        for value, df_partition in df.groupby(
+            df[self.partition].fillna(""), sort=False
+        ):
+            self._write(self._file(value), df_partition)
+
+    def _write(self, file, df: pd.DataFrame):
+        if self.fmt == "parquet":
+            file.write_table(
+                pa.Table.from_pandas(
+                    df.drop(columns=[self.partition] if self.partition else []),
+                    schema=self.arrow_schema,
+                    preserve_index=False,
+                )
+            )
+        else:
+            file.write(df.to_json(orient="records", lines=True, force_ascii=False))
+
+    def close(self) -> list:
+        for file in self.files.values():
+            file.close()
+        return sorted(self.files)
+
+
+def frame_chunks(df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start : start + chunk_rows]
+
+
+def record_chunks(records, chunk_rows: int = CHUNK_ROWS):
+    """Groups an iterable of dicts in frames of `chunk_rows` rows."""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_rows:
+            yield pd.DataFrame(chunk)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk)
+
+
+def repository_chunks(repository: pd.DataFrame, chunk_rows: int = CHUNK_ROWS):
+    return frame_chunks(repository.rename_axis("incident_ID").reset_index(), chunk_rows)
+
+
+def description_chunks(descriptions: dict, links: dict, chunk_rows: int = CHUNK_ROWS):
+    return record_chunks(
+        (
+            dict(
+                incident_ID=incident_id,
+                description=descriptions.get(incident_id),
+                links=links.get(incident_id),
+            )
+            for incident_id in sorted(descriptions.keys() | links.keys())
+        ),
+        chunk_rows,
+    )
+
+
+def _read_json(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def summary_chunks(
+    summaries_dir: str = "summaries",
+    media_dir: str = "media",
+    chunk_rows: int = CHUNK_ROWS,
+):
+    """The summaries and media articles saved by the LLM page, read file by file."""
+
+    def incident_ids(directory):
+        if not os.path.isdir(directory):
+            return set()
+        return {
+            entry.name.removesuffix(".txt")
+            for entry in os.scandir(directory)
+            if entry.name.endswith(".txt") and not entry.name.endswith(".partial.txt")
+        }
+
+    return record_chunks(
+        (
+            dict(
+                incident_ID=incident_id,
+                summary=_read_json(os.path.join(summaries_dir, f"{incident_id}.txt")),
+                articles=_read_json(os.path.join(media_dir, f"{incident_id}.txt")),
+            )
+            for incident_id in sorted(
+                incident_ids(summaries_dir) | incident_ids(media_dir)
+            )
+        ),
+        chunk_rows,
+    )
+
+
+def export_datasets(
+    sources: dict, fmt: str, export_dir: str = EXPORT_DIR, on_progress=None
+) -> dict:
+    """Writes the datasets of `sources` to a new directory of `export_dir`.
+
+    `sources` maps the names of `SCHEMAS` to iterables of frames. The
+    export is written to a temporary directory renamed at the end, so
+    that the readers never see a partial export. Returns its manifest,
+    also written to `manifest.json`.
+    """
+    now = datetime.datetime.now()
+    name = now.strftime("%Y%m%d-%H%M%S")
+    # Several exports in the same second get a suffix
+    suffix = 1
+    while os.path.exists(os.path.join(export_dir, name)) or os.path.exists(
+        os.path.join(export_dir, name + ".partial")
+    ):
+        suffix += 1
+        name = now.strftime("%Y%m%d-%H%M%S") + f"-{suffix}"
+    directory = os.path.join(export_dir, name)
+    tmp_directory = directory + ".partial"
+    os.makedirs(tmp_directory)
+    manifest = dict(name=name, format=fmt, created_at=now.isoformat(), datasets={})
+    try:
+        for dataset, chunks in sources.items():
+            writer = DatasetWriter(
+                os.path.join(tmp_directory, dataset),
+                SCHEMAS[dataset],
+                fmt,
+                PARTITIONS.get(dataset),
+            )
+            try:
+                with span(f"export.{dataset}"):
+                    for chunk in chunks:
+                        writer.write(chunk)
+                        if on_progress:
+                            on_progress(dataset, writer.rows)
+            finally:
+                files = writer.close()
+            manifest["datasets"][dataset] = dict(
+                rows=writer.rows,
+                partition=PARTITIONS.get(dataset),
+                files=len(files),
+                schema=SCHEMAS[dataset],
+            )
+        with open(os.path.join(tmp_directory, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        raise
+    os.replace(tmp_directory, directory)
+    manifest["path"] = directory
+    return manifest
+
+
+def read_export(directory: str, dataset: str) -> pd.DataFrame:
+    """Loads a dataset of an export, with its partition column."""
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    path = os.path.join(directory, dataset)
+    schema = manifest["datasets"][dataset]["schema"]
+    partition = manifest["datasets"][dataset]["partition"]
+    if not os.path.isdir(path):
+        # Nothing to export, no file was written
+        return conform(pd.DataFrame(), schema)
+    if manifest["format"] == "parquet":
+        df = pq.read_table(
+            path,
+            partitioning=(
+                ds.partitioning(pa.schema([(partition, pa.string())]), flavor="hive")
+                if partition
+                else None
+            ),
+        ).to_pandas()
+    else:
+        files = [
+            os.path.join(root, file)
+            for root, _, names in sorted(os.walk(path))
+            for file in sorted(names)
+        ]
+        df = (
+            pd.concat(
+                [
+                    pd.read_json(file, lines=True, dtype=False, convert_dates=False)
+                    for file in files
+                ],
+                ignore_index=True,
+            )
+            if files
+            else pd.DataFrame()
+        )
+    df = conform(df, schema)
+    if partition:
+        df[partition] = df[partition].replace(NULL_PARTITION, pd.NA)
+    return df
@@ -0,0 +1,83 @@
+import pandas as pd
+from chunking import estimate_tokens, truncate_to_tokens
+from search_index import SearchIndex
+
+# Token budget of the description of one example, so that a long
+# description does not crowd out the other examples
+EXAMPLE_DESCRIPTION_TOKENS = 250
+
+
+def annotation_labels(df_annotations: pd.DataFrame) -> dict:
+    """The human labels of each annotated incident, rendered as a few lines.
+
+    The rows of all the annotators are merged: a harm is listed once,
+    with the union of the stakeholders impacted by it.
+    """
+    if df_annotations.empty:
+        return {}
+    df_harms = (
+        df_annotations.dropna(subset=["incident_ID", "harm_category"])
+        .fillna({"harm_subcategory": "", "harm_type": "", "stakeholders": ""})
+        .astype({"stakeholders": str})
+        .groupby(["incident_ID", "harm_category", "harm_subcategory", "harm_type"])[
+            "stakeholders"
+        ]
+        .agg(lambda s: ", ".join(sorted(set(s) - {""})))
+        .reset_index()
+    )
+    df_harms["line"] = (
+        "- "
+        + df_harms.harm_category
+        + " / "
+        + df_harms.harm_subcategory
+        + " ("
+        + df_harms.harm_type
+        + "), impacting: "
+        + df_harms.stakeholders
+    )
+    return df_harms.groupby("incident_ID")["line"].agg("\n".join).to_dict()
+
+
+class FewShotRetriever:
+    """Picks annotated incidents similar to a new one, as examples for the LLM.
+
+    The neighbours come from the search index, restricted to the incidents
+    with human labels, and the examples are added from the closest one
+    until `max_tokens` is reached.
+    """
+
+    def __init__(self, index: SearchIndex, documents: dict, labels: dict) -> None:
+        self.index = index
+        self.documents = documents
+        self.labels = labels
+
+    def examples(self, incident_id: str, k: int = 3, max_tokens: int = 1200) -> list:
+        """Up to `k` examples as `(incident_id, text)` pairs, within `max_tokens`."""
+        examples, used_tokens = [], 0
+        for neighbour, _ in self.index.similar(incident_id, k=k, among=self.labels):
+            text = (
+                truncate_to_tokens(
+                    self.documents.get(neighbour, ""), EXAMPLE_DESCRIPTION_TOKENS
+                )
+                + "\nHarms and impacted stakeholders:\n"
+                + self.labels[neighbour]
+            )
+            tokens = estimate_tokens(text)
+            if used_tokens + tokens > max_tokens:
+                break
+            examples.append((neighbour, text))
+            used_tokens += tokens
+        return examples
+
+    def prompt(self, incident_id: str, k: int = 3, max_tokens: int = 1200) -> str:
+        """The examples to put in the prompt, an empty string without any."""
+        examples = self.examples(incident_id, k, max_tokens)
+        if not examples:
+            return ""
+        return (
+            "Here are similar incidents, as annotated by human experts:\n\n"
+            + "\n\n".join(
+                f"(example {n})\n{text}" for n, (_, text) in enumerate(examples, 1)
+            )
+            + "\n\n"
+        )
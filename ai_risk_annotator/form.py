@@ -1,9 +1,32 @@
+import functools
+import hashlib
+import json
+from types import MappingProxyType
 from typing import Any
 import streamlit as st
+from concurrency import shared_cache
+from profiling import cache_miss, timed
+from taxonomy_versions import get_taxonomy_store
 
 TTL = 30 * 60
 
+HARM_TYPE_DESCRIPTION = """
+            - **Actual harm**: _a negative impact recorded as having occurred_ in media reports, research papers, legal dockets, assessments/audits, etc, regarding or mentioning an incident (see below). Ideally, an actual harm will have been corroborated through public statements by the deployer or developer of the technology system, though this is not always the case.
+            - **Potential harm**: _a negative impact mentioned as being possible or likely but which is not recorded as having occurred_ in media reports, research papers, etc. A potential harm is sometimes referred to as a ‘risk’ or ‘hazard’ by journalists, risk managers, and others.
+            """
+
+
+def taxonomy_version(*parts) -> str:
+    """Returns a short content hash of the given JSON-serializable parts."""
+    payload = json.dumps(parts, default=str).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+def render_definitions(definitions: dict) -> str:
+    return "".join(f"- **{k}**: {v}\n" for k, v in definitions.items())
 
+
+@timed
 def display_question(
     *,
     question: str,
@@ -14,6 +37,7 @@ def display_question(
     container: st.delta_generator.DeltaGenerator = None,
     help_text=None,
     show_descriptions=True,
+    suggestion=None,
 ) -> list | str:
     container = container or st.container(border=False)
     with container:
@@ -30,6 +54,9 @@ def display_question(
 
         if key in st.session_state:
             st.session_state[key] = st.session_state[key]
+        elif suggestion:
+            # Pre-filled with the model's suggestion, the annotator can change it
+            st.session_state[key] = suggestion
 
         widget_kwargs = widget_kwargs or {}
         result = widget_cls(
@@ -52,63 +79,79 @@ def stop_condition(condition: bool, submit_message: str) -> None:
         st.stop()
 
 
-class Stakeholders:
-    def __init__(self) -> None:
-        self.stakeholders = None
+class TaxonomySnapshot:
+    """Immutable snapshot of a taxonomy sheet, identified by its content hash.
 
-    @st.cache_data(
-        ttl=TTL, show_spinner="Reading the annotators' list from Google Sheets..."
-    )
-    def download(_self, _conn) -> None:
-        df_stakeholders = (
-            _conn.read(
-                worksheet="Stakeholders",
-                ttl=0,
-                usecols=[0, 1],
-            )
-            .dropna(how="all", axis=0)
-            .dropna(how="all", axis=1)
+    Snapshots are shared by all sessions through `st.cache_resource`,
+    so they cannot be modified once built. Equality and hashing only
+    depend on the version, which lets the rendering methods be cached
+    with `functools.lru_cache`.
+    """
+
+    __slots__ = ("version",)
+
+    def _freeze(self, **fields) -> None:
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and self.version == other.version
+
+    def __hash__(self) -> int:
+        return hash((type(self).__name__, self.version))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(version={self.version!r})"
+
+
+class Stakeholders(TaxonomySnapshot):
+    __slots__ = ("stakeholders",)
+    kind = "stakeholders"
+
+    def __init__(self, stakeholders: dict) -> None:
+        self._freeze(
+            stakeholders=MappingProxyType(dict(stakeholders)),
+            version=taxonomy_version(stakeholders),
         )
-        _self.stakeholders = {
-            d["Stakeholder"]: d["Definition"]
-            for d in df_stakeholders.to_dict(orient="records")
-        }
-        return _self
 
+    @classmethod
+    def download(cls, conn) -> "Stakeholders":
+        return download_stakeholders(conn)
+
+    @functools.lru_cache(maxsize=8)
     def description(self) -> str:
-        stakeholders_description = ""
-        for k, v in self.stakeholders.items():
-            stakeholders_description += f"- **{k}**: {v}\n"
-        return stakeholders_description
+        return render_definitions(self.stakeholders)
 
     def values(self) -> list:
-        return self.stakeholders.keys()
+        return list(self.stakeholders.keys())
 
+    def to_dict(self) -> dict:
+        return dict(stakeholders=dict(self.stakeholders))
 
-class Harms:
-    def __init__(self) -> None:
-        self.harm_descriptions = None
-        self.harm_categories = None
 
-    @st.cache_data(
-        ttl=TTL, show_spinner="Reading the AI harm taxonomy from Google Sheets..."
-    )
-    def download(_self, _conn):
-        try:
-            df_harms = (
-                _conn.read(
-                    worksheet="Taxonomy",
-                    ttl=0,
-                )
-                .dropna(how="all", axis=0)
-                .dropna(how="all", axis=1)
-            )
+class Harms(TaxonomySnapshot):
+    __slots__ = ("harm_categories", "harm_descriptions")
+    kind = "harms"
 
-            df_harm_descriptions = (
-                _conn.read(worksheet="Descriptions", ttl=0)
-                .dropna(how="all", axis=0)
-                .dropna(how="all", axis=1)
-            )
+    def __init__(self, harm_categories: dict, harm_descriptions: dict) -> None:
+        self._freeze(
+            harm_categories=MappingProxyType(
+                {k: tuple(v) for k, v in harm_categories.items()}
+            ),
+            harm_descriptions=MappingProxyType(dict(harm_descriptions)),
+            version=taxonomy_version(harm_categories, harm_descriptions),
+        )
+
+    @classmethod
+    def download(cls, conn) -> "Harms":
+        try:
+            return download_harms(conn)
         except Exception as e:
             st.error("Cannot connect to Google Sheets. Error: " + str(e))
             st.info(
@@ -116,50 +159,101 @@ class Harms:
             )
             st.stop()
 
-        _self.harm_categories = {
-            col_name: series.dropna().to_list() for col_name, series in df_harms.items()
-        }
-        _self.harm_descriptions = df_harm_descriptions.set_index("Harm").squeeze()
-        return _self
-
     def values(self, category=None) -> list:
         if category is None:
             return list(self.harm_categories.keys()) + ["Other"]
         else:
-            return self.harm_categories[category]
+            return list(self.harm_categories[category])
 
+    @functools.lru_cache(maxsize=128)
     def description(self, category=None) -> str:
         if category == "type":
-            harm_type_help_text = """
-            - **Actual harm**: _a negative impact recorded as having occurred_ in media reports, research papers, legal dockets, assessments/audits, etc, regarding or mentioning an incident (see below). Ideally, an actual harm will have been corroborated through public statements by the deployer or developer of the technology system, though this is not always the case.
-            - **Potential harm**: _a negative impact mentioned as being possible or likely but which is not recorded as having occurred_ in media reports, research papers, etc. A potential harm is sometimes referred to as a ‘risk’ or ‘hazard’ by journalists, risk managers, and others.
-            """
-            return harm_type_help_text
+            return HARM_TYPE_DESCRIPTION
 
-        harm_categories_description = ""
         if category is None:
-            subset_harm_categories = self.harm_descriptions.loc[
-                self.harm_categories.keys()
-            ].to_dict()
+            harms = self.harm_categories.keys()
         else:
-            subset_harm_categories = self.harm_descriptions.loc[
-                self.harm_categories[category]
-            ].to_dict()
-        for k, v in subset_harm_categories.items():
-            harm_categories_description += f"- **{k}**: {v}\n"
-        return harm_categories_description
+            harms = self.harm_categories[category]
+        return render_definitions({h: self.harm_descriptions[h] for h in harms})
 
+    @functools.lru_cache(maxsize=8)
     def mindmap(self) -> str:
-        taxonomy_mindmap = """
----
-markmap:
-    colorFreezeLevel: 2
----
-# AI Harm Taxonomy
-"""
-
-        for k, v in self.harm_categories.items():
-            taxonomy_mindmap += f"## {k}\n"
-            for i in v:
-                taxonomy_mindmap += f"### {i}\n"
-        return taxonomy_mindmap
+        return build_mindmap(self.harm_categories)
+
+    def to_dict(self) -> dict:
+        return dict(
+            harm_categories={k: list(v) for k, v in self.harm_categories.items()},
+            harm_descriptions=dict(self.harm_descriptions),
+        )
+
+
+def build_mindmap(harm_categories: dict) -> str:
+    lines = [
+        "---",
+        "markmap:",
+        "    colorFreezeLevel: 2",
+        "---",
+        "# AI Harm Taxonomy",
+    ]
+    for k, v in harm_categories.items():
+        lines.append(f"## {k}")
+        lines.extend(f"### {i}" for i in v)
+    return "\n" + "\n".join(lines) + "\n"
+
+
+# The snapshots are immutable, so they are shared by all the sessions
+# rather than pickled and copied on every cache hit, and concurrent
+# cache misses trigger a single read of the sheets
+@timed
+@shared_cache(
+    ttl=TTL, show_spinner="Reading the stakeholders' list from Google Sheets..."
+)
+@cache_miss
+def download_stakeholders(_conn) -> Stakeholders:
+    df_stakeholders = (
+        _conn.read(
+            worksheet="Stakeholders",
+            ttl=0,
+            usecols=[0, 1],
+        )
+        .dropna(how="all", axis=0)
+        .dropna(how="all", axis=1)
+    )
+    stakeholders = Stakeholders(
+        {
+            d["Stakeholder"]: d["Definition"]
+            for d in df_stakeholders.to_dict(orient="records")
+        }
+    )
+    # Kept to translate the annotations made with it, see `TaxonomyStore`
+    get_taxonomy_store().record(stakeholders)
+    return stakeholders
+
+
+@timed
+@shared_cache(
+    ttl=TTL, show_spinner="Reading the AI harm taxonomy from Google Sheets..."
+)
+@cache_miss
+def download_harms(_conn) -> Harms:
+    df_harms = (
+        _conn.read(
+            worksheet="Taxonomy",
+            ttl=0,
+        )
+        .dropna(how="all", axis=0)
+        .dropna(how="all", axis=1)
+    )
+
+    df_harm_descriptions = (
+        _conn.read(worksheet="Descriptions", ttl=0)
+        .dropna(how="all", axis=0)
+        .dropna(how="all", axis=1)
+    )
+
+    harms = Harms(
+        {col_name: series.dropna().to_list() for col_name, series in df_harms.items()},
+        df_harm_descriptions.set_index("Harm").squeeze().to_dict(),
+    )
+    get_taxonomy_store().record(harms)
+    return harms
@@ -0,0 +1,91 @@
+import threading
+import uuid
+
+import pandas as pd
+import streamlit as st
+from analytics import changed_incidents, incident_hashes, latest_submissions
+from profiling import span
+
+KEY = ["annotator", "incident_ID", "timestamp"]
+
+
+class LatestAnnotations:
+    """The last submission of each annotator on each incident.
+
+    A view of the Annotations worksheet, which keeps every submission,
+    maintained across the reruns: `update` only deduplicates again the
+    incidents which got new submissions, and `apply` adds a new submission
+    without waiting for the sheet to be read again.
+
+    The sheet is only appended to, so a submission is identified by its
+    annotator, incident and timestamp, which are cheaper to hash than
+    the whole rows.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.hashes = pd.Series(dtype="uint64", index=pd.Index([], dtype=object))
+        self.source_version = None
+        self.rows = pd.DataFrame(columns=KEY)
+        # Changed at each update, to key the caches of the derived tables
+        self._instance = uuid.uuid4().hex[:8]
+        self._updates = 0
+
+    def _replace(self, df: pd.DataFrame, incidents: set):
+        df_latest = latest_submissions(df)
+        kept = self.rows[~self.rows.incident_ID.isin(incidents)]
+        self.rows = (
+            pd.concat([kept, df_latest], ignore_index=True)
+            if not kept.empty
+            else df_latest.reset_index(drop=True)
+        )
+        self._updates += 1
+
+    def update(self, df_annotations: pd.DataFrame) -> int:
+        """Takes the whole history into account, returns the number of changed incidents."""
+        # The loaders store the version of their snapshot, see `snapshot_version`
+        source_version = df_annotations.attrs.get("version")
+        if source_version is not None and source_version == self.source_version:
+            return 0
+        df_keys = df_annotations[KEY]
+        df_keys = df_keys[df_keys.incident_ID.notna() & df_keys.annotator.notna()]
+        hashes = incident_hashes(df_keys, KEY)
+        with self._lock:
+            self.source_version = source_version
+            changed = changed_incidents(self.hashes, hashes)
+            if not changed:
+                return 0
+            with span("latest_annotations.update"):
+                rows = df_keys.index[df_keys.incident_ID.isin(changed)]
+                self._replace(df_annotations.loc[rows], changed)
+            self.hashes = hashes
+        return len(changed)
+
+    def apply(self, df_submission: pd.DataFrame):
+        """Adds the rows of a new submission, replacing the annotator's previous one."""
+        incidents = set(df_submission.incident_ID)
+        with self._lock:
+            if self.hashes.empty:
+                # Not loaded yet, the first `update` will read it from the sheet
+                return
+            df = pd.concat(
+                [self.rows[self.rows.incident_ID.isin(incidents)], df_submission],
+                ignore_index=True,
+            )
+            self._replace(df, incidents)
+
+    @property
+    def version(self) -> str:
+        return f"{self._instance}-{self._updates}"
+
+    def frame(self) -> pd.DataFrame:
+        """A copy of the rows, with `version` in its `attrs` for the derived tables."""
+        with self._lock:
+            df = self.rows.copy()
+            df.attrs["version"] = self.version
+        return df
+
+
+@st.cache_resource
+def get_latest_annotations() -> LatestAnnotations:
+    return LatestAnnotations()
@@ -1,9 +1,15 @@
-import ollama
-import pandas as pd
 import streamlit as st
+from concurrency import shared_cache
+from dedup import deduplicate
+from llm_backends import LLMError
+from llm_client import LLMBusyError, get_llm_client
+from profiling import cache_miss, span, timed
 from trafilatura import extract, fetch_url
 
 TTL = 30 * 60 * 24
+DEFAULT_LLM = "llama3.1:latest"
+# Incidents whose extracted articles stay cached, they are the largest entries
+MAX_CACHED_ARTICLES = 200
 
 
 def build_llm_selection():
@@ -11,7 +17,7 @@ def build_llm_selection():
         models_info = get_available_local_llms()
     except Exception as e:
         st.error(
-            "Cannot connect to your local LLM. Please check that Ollama is running in the background"
+            "Cannot connect to your local LLM. Please check that Ollama (or the configured LLM server) is running in the background"
         )
         st.stop()
     available_llms = models_info.LLM.to_list()
@@ -29,49 +35,26 @@ def build_llm_selection():
         selected_llm = st.selectbox(
             "Choose an LLM",
             available_llms,
-            index=available_llms.index("llama3.1:latest"),
+            # Other backends name their models differently
+            index=(
+                available_llms.index(DEFAULT_LLM)
+                if DEFAULT_LLM in available_llms
+                else 0
+            ),
             label_visibility="collapsed",
             key="selected_llm",
         )
     return selected_llm
 
 
+@timed
 def get_available_local_llms():
-    return (
-        pd.json_normalize(ollama.list()["models"])
-        .drop(
-            [
-                "digest",
-                "details.format",
-                "details.families",
-                "details.parent_model",
-                "modified_at",
-                "model",
-            ],
-            axis=1,
-        )
-        .rename(
-            columns={
-                "name": "LLM",
-                "size": "Size",
-                "details.family": "Family",
-                "details.parameter_size": "Parameters",
-                "details.quantization_level": "Quantization",
-            },
-        )
-    )
+    return get_llm_client().models()
 
 
 # deprecated
 def stream_chat(model, messages):
-    response_generator = (
-        chunk["message"]["content"]
-        for chunk in ollama.chat(
-            model=model,
-            messages=messages,
-            stream=True,
-        )
-    )
+    response_generator = get_llm_client().stream_chat(model=model, messages=messages)
     with st.chat_message("assistant"):
         response = st.write_stream(response_generator)
         # response += r
@@ -79,53 +62,68 @@ def stream_chat(model, messages):
     return response
 
 
-@st.cache_data(ttl=TTL, show_spinner="Parsing the downlaoded web page...")
-def extract_content(links_list, WORD_LIMIT):
-    pages = [fetch_url(link) for link in links_list]
-    results = [extract(page, include_comments=False) for page in pages]
-    results = [
-        result for result in results if result is not None and len(result) <= WORD_LIMIT
-    ]
+@timed
+@shared_cache(
+    ttl=TTL,
+    show_spinner="Parsing the downlaoded web page...",
+    max_entries=MAX_CACHED_ARTICLES,
+)
+@cache_miss
+def extract_content(links_list):
+    with span("llm.extract_content.fetch"):
+        pages = [fetch_url(link) for link in links_list]
+    with span("llm.extract_content.extract"):
+        results = [extract(page, include_comments=False) for page in pages]
+    # The long articles are kept, the summarizer splits them in chunks
+    results = [result for result in results if result is not None]
     results = sorted(results, reverse=True, key=lambda x: len(x))
+    # Syndicated copies of the same story: the longest one is kept
+    with span("llm.extract_content.deduplicate"):
+        results = deduplicate(results)
 
     return results
 
 
-def call_ollama_chat(selected_llm, prompt, store_prompt=True, write_answer=True):
+@timed
+def call_ollama_chat(
+    selected_llm, prompt, store_prompt=True, write_answer=True, use_cache=True
+):
     if store_prompt:
         st.chat_message("user").write(prompt)
     st.session_state.chat_history[selected_llm].append(
         {"role": "user", "content": prompt, "show": store_prompt}
     )
+    client = get_llm_client()
     try:
         if write_answer:
-            response_generator = (
-                chunk["message"]["content"]
-                for chunk in ollama.chat(
-                    model=selected_llm,
-                    messages=st.session_state.chat_history[selected_llm],
-                    stream=True,
-                )
+            response_generator = client.stream_chat(
+                model=selected_llm,
+                messages=st.session_state.chat_history[selected_llm],
+                use_cache=use_cache,
+                replay_delay=0.01,
             )
             with st.chat_message("assistant"):
                 response = st.write_stream(response_generator)
         else:
-            response = ollama.chat(
+            response = client.chat(
                 model=selected_llm,
                 messages=st.session_state.chat_history[selected_llm],
-                stream=False,
-            )["message"]["content"]
+                use_cache=use_cache,
+            )
         st.session_state.chat_history[selected_llm].append(
             {"role": "assistant", "content": response, "show": store_prompt}
         )
-    except ollama.ResponseError as e:
+    except LLMBusyError as e:
+        st.warning(f"The local LLM is busy, please retry in a moment ({e}).")
+        st.stop()
+    except LLMError as e:
         st.error(
-            "Cannot connect to your local LLM. Please check that Ollama is running in the background"
+            "Cannot connect to your local LLM. Please check that Ollama (or the configured LLM server) is running in the background"
         )
-        st.error(e.error)
+        st.error(str(e))
         if e.status_code == 404:
             with st.spinner("Downloading the model weights..."):
-                ollama.pull(selected_llm)
+                client.pull(selected_llm)
         else:
             st.stop()
     return response
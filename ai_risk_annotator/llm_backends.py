@@ -0,0 +1,268 @@
+import ollama
+import openai
+import pandas as pd
+
+
+class LLMError(RuntimeError):
+    """Failure of an LLM server, whatever its backend."""
+
+    def __init__(self, message: str, status_code: int = None) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMBackend:
+    """Raw calls to an LLM server, returning the text of the answers.
+
+    A backend sends up to `batch_size` prompts in a single request to
+    `agenerate_batch`. The concurrency limits are left to `LLMClient`.
+    """
+
+    batch_size = 1
+    # The endpoint of `agenerate_batch`, part of the cache keys of its answers
+    batch_endpoint = "generate"
+
+    def list_models(self) -> pd.DataFrame:
+        """One model per row, with at least an `LLM` column of the model names.
+
+        When the server provides it, the `Digest` column identifies the
+        weights, so that the cached answers of a re-pulled model are not reused.
+        """
+        raise NotImplementedError
+
+    def generate(self, model: str, prompt: str, **options) -> str:
+        raise NotImplementedError
+
+    def chat(self, model: str, messages: list, **options) -> str:
+        raise NotImplementedError
+
+    def stream_chat(self, model: str, messages: list, **options):
+        """Yields the answer by chunks of text."""
+        raise NotImplementedError
+
+    def async_client(self):
+        """A new async client, to be used within a single event loop."""
+        raise NotImplementedError
+
+    async def agenerate_batch(
+        self, client, model: str, prompts: list, **options
+    ) -> list[str]:
+        raise NotImplementedError
+
+    def astream_generate(self, client, model: str, prompt: str, **options):
+        """Async iterator over the chunks of the answer, roughly one token each."""
+        raise NotImplementedError
+
+    def pull(self, model: str):
+        raise LLMError(f"Cannot download {model} with this backend")
+
+    def warm_up(self, model: str):
+        """Loads the model ahead of a run, when the server needs it."""
+
+
+class OllamaBackend(LLMBackend):
+    """A local Ollama server. Every request passes `keep_alive`."""
+
+    def __init__(
+        self, host: str = None, keep_alive: str = "30m", timeout: float = 300
+    ) -> None:
+        self.host = host
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.client = ollama.Client(host=host, timeout=timeout)
+
+    def _call(self, method, **kwargs):
+        try:
+            return method(keep_alive=self.keep_alive, **kwargs)
+        except ollama.ResponseError as e:
+            raise LLMError(e.error, e.status_code) from e
+
+    def list_models(self) -> pd.DataFrame:
+        return (
+            pd.json_normalize(self.client.list()["models"])
+            .drop(
+                [
+                    "details.format",
+                    "details.families",
+                    "details.parent_model",
+                    "modified_at",
+                    "model",
+                ],
+                axis=1,
+                errors="ignore",
+            )
+            .rename(
+                columns={
+                    "name": "LLM",
+                    "digest": "Digest",
+                    "size": "Size",
+                    "details.family": "Family",
+                    "details.parameter_size": "Parameters",
+                    "details.quantization_level": "Quantization",
+                },
+            )
+        )
+
+    def generate(self, model: str, prompt: str, **options) -> str:
+        return self._call(
+            self.client.generate, model=model, prompt=prompt, options=options or None
+        )["response"]
+
+    def chat(self, model: str, messages: list, **options) -> str:
+        return self._call(
+            self.client.chat, model=model, messages=messages, options=options or None
+        )["message"]["content"]
+
+    def stream_chat(self, model: str, messages: list, **options):
+        chunks = self._call(
+            self.client.chat,
+            model=model,
+            messages=messages,
+            stream=True,
+            options=options or None,
+        )
+        try:
+            for chunk in chunks:
+                yield chunk["message"]["content"]
+        except ollama.ResponseError as e:
+            raise LLMError(e.error, e.status_code) from e
+
+    def async_client(self):
+        return ollama.AsyncClient(host=self.host, timeout=self.timeout)
+
+    async def agenerate_batch(self, client, model, prompts, **options) -> list[str]:
+        (prompt,) = prompts
+        try:
+            response = await client.generate(
+                model=model,
+                prompt=prompt,
+                keep_alive=self.keep_alive,
+                options=options or None,
+            )
+        except ollama.ResponseError as e:
+            raise LLMError(e.error, e.status_code) from e
+        return [response["response"]]
+
+    async def astream_generate(self, client, model, prompt, **options):
+        try:
+            async for chunk in await client.generate(
+                model=model,
+                prompt=prompt,
+                stream=True,
+                keep_alive=self.keep_alive,
+                options=options or None,
+            ):
+                yield chunk["response"]
+        except ollama.ResponseError as e:
+            raise LLMError(e.error, e.status_code) from e
+
+    def pull(self, model: str):
+        return self.client.pull(model)
+
+    def warm_up(self, model: str):
+        # An empty prompt only loads the model
+        self._call(self.client.generate, model=model, prompt="")
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Any server implementing the OpenAI API, e.g. llama.cpp, vLLM or LM Studio.
+
+    With `batch_size` above 1, the batched generations are sent together
+    to the completions endpoint, for the servers able to batch them.
+    Otherwise, every prompt goes through the chat endpoint.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str = "none",
+        timeout: float = 300,
+        batch_size: int = 1,
+    ) -> None:
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.client = openai.OpenAI(base_url=base_url, api_key=api_key, timeout=timeout)
+
+    @property
+    def batch_endpoint(self) -> str:
+        # The raw prompts, without the chat template, get other answers
+        return "completions" if self.batch_size > 1 else "generate"
+
+    @staticmethod
+    def _error(e: openai.OpenAIError) -> LLMError:
+        return LLMError(str(e), getattr(e, "status_code", None))
+
+    def list_models(self) -> pd.DataFrame:
+        try:
+            models = self.client.models.list().data
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+        return pd.DataFrame({"LLM": [model.id for model in models]})
+
+    def generate(self, model: str, prompt: str, **options) -> str:
+        return self.chat(model, [{"role": "user", "content": prompt}], **options)
+
+    def chat(self, model: str, messages: list, **options) -> str:
+        try:
+            response = self.client.chat.completions.create(
+                model=model, messages=messages, **options
+            )
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+        return response.choices[0].message.content
+
+    def stream_chat(self, model: str, messages: list, **options):
+        try:
+            for chunk in self.client.chat.completions.create(
+                model=model, messages=messages, stream=True, **options
+            ):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+
+    def async_client(self):
+        return openai.AsyncOpenAI(
+            base_url=self.base_url, api_key=self.api_key, timeout=self.timeout
+        )
+
+    async def agenerate_batch(self, client, model, prompts, **options) -> list[str]:
+        try:
+            if self.batch_size == 1:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompts[0]}],
+                    **options,
+                )
+                return [response.choices[0].message.content]
+
+            response = await client.completions.create(
+                model=model, prompt=prompts, **options
+            )
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+        texts = [None] * len(prompts)
+        for choice in response.choices:
+            texts[choice.index] = choice.text
+        return texts
+
+    async def astream_generate(self, client, model, prompt, **options):
+        try:
+            async for chunk in await client.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                **options,
+            ):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError as e:
+            raise self._error(e) from e
+
+
+BACKENDS = {
+    "ollama": OllamaBackend,
+    "openai": OpenAICompatibleBackend,
+}
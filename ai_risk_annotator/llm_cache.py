@@ -0,0 +1,94 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_DB = "llm_cache.db"
+# Below the 999 bound parameters of the older SQLite builds
+MAX_KEYS_PER_QUERY = 500
+
+
+def response_key(
+    endpoint: str, model_digest: str, messages: list, options: dict
+) -> str:
+    """Hash of everything that determines an answer.
+
+    Only the role and content of the messages are kept, so that the
+    app's bookkeeping (e.g. the `show` flag of the chat history) does
+    not change the key.
+    """
+    payload = {
+        "endpoint": endpoint,
+        "model": model_digest,
+        "messages": [
+            {"role": message["role"], "content": message["content"]}
+            for message in messages
+        ],
+        "options": options,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def replay(text: str, delay: float = 0.0):
+    """Yields a cached answer by words, as if it was streamed by the model."""
+    for chunk in re.findall(r"\s*\S+\s*", text) or [text]:
+        if delay:
+            time.sleep(delay)
+        yield chunk
+
+
+class ResponseCache:
+    """Persistent cache of the LLM answers, in SQLite."""
+
+    def __init__(self, database: str = LLM_CACHE_DB) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            database, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                created_at REAL,
+                response TEXT
+            )
+            """)
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def get_many(self, keys: list) -> dict:
+        rows = []
+        with self._lock:
+            # A query per chunk, within SQLite's limit of bound parameters
+            for start in range(0, len(keys), MAX_KEYS_PER_QUERY):
+                chunk = keys[start : start + MAX_KEYS_PER_QUERY]
+                rows += self._db.execute(
+                    f"SELECT key, response FROM responses WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+        return dict(rows)
+
+    def put(self, key: str, model: str, response: str):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, model, time.time(), response),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
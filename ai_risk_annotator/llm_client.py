@@ -0,0 +1,361 @@
+import asyncio
+import contextlib
+import threading
+
+import pandas as pd
+import streamlit as st
+from concurrency import SharedCache
+from llm_backends import BACKENDS, LLMBackend, LLMError
+from llm_cache import LLM_CACHE_DB, ResponseCache, replay, response_key
+from llm_progress import GenerationListener
+from profiling import span
+
+# Short, so that newly pulled models show up quickly
+MODELS_TTL = 60
+
+
+class LLMBusyError(LLMError):
+    """All the LLM slots stayed busy for longer than the queue timeout."""
+
+
+class LLMClient:
+    """LLM client shared by all the sessions, on top of a `LLMBackend`.
+
+    - The backend's sync client keeps its HTTP connections open between
+      the calls, and a batch of generations runs on one async client.
+    - At most `max_concurrency` requests are sent to the server at once,
+      the other callers queue for up to `queue_timeout` seconds before
+      getting a `LLMBusyError`.
+    - `generate_many` groups the prompts by the backend's `batch_size`,
+      each group being a single request.
+    - The list of models is cached for `MODELS_TTL` seconds.
+    - With a `ResponseCache`, the answers are stored by model digest,
+      messages and options, and a repeated request costs no inference.
+      `use_cache=False` skips the lookup and stores the new answer.
+    """
+
+    def __init__(
+        self,
+        backend: LLMBackend,
+        max_concurrency: int = 2,
+        queue_timeout: float = 120,
+        cache: ResponseCache = None,
+    ) -> None:
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.cache = cache
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._models = SharedCache(MODELS_TTL)
+
+    def _acquire(self):
+        with span("llm_client.queue"):
+            if not self._slots.acquire(timeout=self.queue_timeout):
+                raise LLMBusyError(
+                    f"The {self.max_concurrency} LLM slots stayed busy "
+                    f"for {self.queue_timeout}s"
+                )
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Holds one of the concurrent request slots."""
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    def models(self) -> pd.DataFrame:
+        """The available models, one per row. Shared between the callers: do not modify."""
+        return self._models.get("models", self.backend.list_models)
+
+    def model_digest(self, model: str) -> str:
+        try:
+            models = self.models()
+        except Exception:
+            # The cached answers stay readable while the server is down
+            return model
+        if "Digest" in models.columns:
+            digests = models.loc[models.LLM == model, "Digest"]
+            if not digests.empty:
+                return f"{model}@{digests.iloc[0]}"
+        return model
+
+    def _cache_key(self, endpoint, model, messages, options) -> str:
+        return response_key(endpoint, self.model_digest(model), messages, options)
+
+    def _cached(self, key: str, use_cache: bool) -> str:
+        if self.cache is None or not use_cache:
+            return None
+        with span("llm_client.cache_lookup"):
+            return self.cache.get(key)
+
+    def _generate_keys(
+        self, model: str, prompts: list, options: dict, endpoint: str = "generate"
+    ) -> list:
+        return [
+            self._cache_key(
+                endpoint, model, [{"role": "user", "content": prompt}], options
+            )
+            for prompt in prompts
+        ]
+
+    def _cached_many(self, keys: list, use_cache: bool) -> dict:
+        if self.cache is None or not use_cache or not keys:
+            return {}
+        with span("llm_client.cache_lookup"):
+            return self.cache.get_many(keys)
+
+    def _store(self, key: str, model: str, response: str):
+        if self.cache is not None:
+            self.cache.put(key, model, response)
+
+    def generate(
+        self, model: str, prompt: str, use_cache: bool = True, **options
+    ) -> str:
+        messages = [{"role": "user", "content": prompt}]
+        key = self._cache_key("generate", model, messages, options)
+        response = self._cached(key, use_cache)
+        if response is None:
+            with self.slot():
+                response = self.backend.generate(model, prompt, **options)
+            self._store(key, model, response)
+        return response
+
+    def chat(
+        self, model: str, messages: list, use_cache: bool = True, **options
+    ) -> str:
+        key = self._cache_key("chat", model, messages, options)
+        response = self._cached(key, use_cache)
+        if response is None:
+            with self.slot():
+                response = self.backend.chat(model, messages, **options)
+            self._store(key, model, response)
+        return response
+
+    def stream_chat(
+        self,
+        model: str,
+        messages: list,
+        use_cache: bool = True,
+        replay_delay: float = 0.0,
+        **options,
+    ):
+        """Yields the chunks of the answer, holding a slot until the last one.
+
+        A cached answer is replayed by words, `replay_delay` seconds apart.
+        """
+        key = self._cache_key("chat", model, messages, options)
+        response = self._cached(key, use_cache)
+        if response is not None:
+            yield from replay(response, replay_delay)
+            return
+
+        chunks = []
+        with self.slot():
+            for chunk in self.backend.stream_chat(model, messages, **options):
+                chunks.append(chunk)
+                yield chunk
+        # Only the complete answers are stored
+        self._store(key, model, "".join(chunks))
+
+    def pull(self, model: str):
+        return self.backend.pull(model)
+
+    def warm_up(self, model: str):
+        with span("llm_client.warm_up"), self.slot():
+            self.backend.warm_up(model)
+
+    async def _generate_all(self, model, prompts, on_result, **options):
+        client = self.backend.async_client()
+        # The batches wait for their turn without the queue timeout,
+        # only the shared slots below can time out
+        batch_slots = asyncio.Semaphore(self.max_concurrency)
+        batch_size = self.backend.batch_size
+
+        async def generate_batch(start):
+            batch = prompts[start : start + batch_size]
+            async with batch_slots:
+                acquired = False
+                try:
+                    # Only wait in a thread when the other sessions hold the slots
+                    acquired = self._slots.acquire(blocking=False)
+                    if not acquired:
+                        await asyncio.to_thread(self._acquire)
+                        acquired = True
+                    texts = await self.backend.agenerate_batch(
+                        client, model, batch, **options
+                    )
+                except Exception as e:
+                    # A busy server only fails this batch, not the others
+                    texts = [e] * len(batch)
+                finally:
+                    if acquired:
+                        self._slots.release()
+            return start, texts
+
+        results = [None] * len(prompts)
+        for next_batch in asyncio.as_completed(
+            [generate_batch(start) for start in range(0, len(prompts), batch_size)]
+        ):
+            start, texts = await next_batch
+            for index, text in enumerate(texts, start):
+                results[index] = text
+                if on_result is not None:
+                    on_result(index, text)
+        return results
+
+    def generate_many(
+        self,
+        model: str,
+        prompts: list,
+        on_result=None,
+        use_cache: bool = True,
+        **options,
+    ) -> list:
+        """Generates the prompts concurrently, within the client's limits.
+
+        Returns the generated texts in the order of the prompts, with the
+        exception instead of the text for the failed ones. `on_result(index, text)`
+        is called as soon as each text arrives, in the caller's thread.
+        Only the prompts missing from the response cache are sent, and the
+        repeated ones are sent once.
+        """
+        keys = self._generate_keys(model, prompts, options, self.backend.batch_endpoint)
+        cached = self._cached_many(keys, use_cache)
+
+        results = [None] * len(prompts)
+        missing = []
+        # Index of the first occurrence of a prompt -> indices of its repeats
+        repeats = {}
+        first_index = {}
+        for index, key in enumerate(keys):
+            if key in cached:
+                results[index] = cached[key]
+                if on_result is not None:
+                    on_result(index, cached[key])
+            elif key in first_index:
+                repeats[first_index[key]].append(index)
+            else:
+                first_index[key] = index
+                repeats[index] = []
+                missing.append(index)
+
+        def store(missing_index, text):
+            index = missing[missing_index]
+            if not isinstance(text, Exception):
+                self._store(keys[index], model, text)
+            for same_index in [index] + repeats[index]:
+                results[same_index] = text
+                if on_result is not None:
+                    on_result(same_index, text)
+
+        if missing:
+            # Loads the model once, instead of in every concurrent request
+            try:
+                self.warm_up(model)
+            except Exception as e:
+                # The server is down or busy: every prompt fails with it
+                for missing_index in range(len(missing)):
+                    store(missing_index, e)
+                return results
+            with span("llm_client.generate_many"):
+                asyncio.run(
+                    self._generate_all(
+                        model, [prompts[index] for index in missing], store, **options
+                    )
+                )
+        return results
+
+    async def _stream_all(self, model, indices, prompts, keys, listener, **options):
+        client = self.backend.async_client()
+        workers = asyncio.Queue()
+        for worker in range(self.max_concurrency):
+            workers.put_nowait(worker)
+
+        async def stream_one(index):
+            worker = await workers.get()
+            listener.queued(index, worker)
+            try:
+                if not self._slots.acquire(blocking=False):
+                    await asyncio.to_thread(self._acquire)
+                try:
+                    listener.started(index, worker)
+                    chunks = []
+                    async for chunk in self.backend.astream_generate(
+                        client, model, prompts[index], **options
+                    ):
+                        chunks.append(chunk)
+                        listener.chunk(index, chunk)
+                finally:
+                    self._slots.release()
+            except Exception as e:
+                return index, e
+            finally:
+                workers.put_nowait(worker)
+            return index, "".join(chunks)
+
+        for next_result in asyncio.as_completed([stream_one(i) for i in indices]):
+            index, text = await next_result
+            if not isinstance(text, Exception):
+                self._store(keys[index], model, text)
+            listener.finished(index, text)
+
+    def stream_many(
+        self,
+        model: str,
+        prompts: list,
+        listener: GenerationListener,
+        use_cache: bool = True,
+        **options,
+    ):
+        """Streams the answers of the prompts concurrently, within the client's limits.
+
+        The `listener` is told when each prompt waits for and gets a worker,
+        of every chunk and of the full answer (or exception). The cached
+        answers are reported as finished right away, and the new ones are
+        stored in the cache. Unlike `generate_many`, the prompts are not batched.
+        """
+        keys = self._generate_keys(model, prompts, options)
+        cached = self._cached_many(keys, use_cache)
+
+        missing = []
+        for index, key in enumerate(keys):
+            if key in cached:
+                listener.finished(index, cached[key], cached=True)
+            else:
+                missing.append(index)
+
+        if missing:
+            try:
+                self.warm_up(model)
+            except Exception as e:
+                for index in missing:
+                    listener.finished(index, e)
+                return
+            with span("llm_client.stream_many"):
+                asyncio.run(
+                    self._stream_all(model, missing, prompts, keys, listener, **options)
+                )
+
+
+@st.cache_resource
+def get_llm_client() -> LLMClient:
+    """The client configured by the optional `[llm]` secrets section.
+
+    `backend` is `ollama` (default) or `openai`, for any OpenAI-compatible
+    server. `max_concurrency` and `queue_timeout` configure the client, and
+    `response_cache` is the path of the answers' cache (`false` to disable it).
+    The other options are passed to the backend (see `llm_backends`).
+    """
+    config = dict(st.secrets.get("llm", {}))
+    backend = BACKENDS[config.pop("backend", "ollama")]
+    client_options = {
+        option: config.pop(option)
+        for option in ["max_concurrency", "queue_timeout"]
+        if option in config
+    }
+    response_cache = config.pop("response_cache", LLM_CACHE_DB)
+    if response_cache:
+        client_options["cache"] = ResponseCache(response_cache)
+    return LLMClient(backend(**config), **client_options)
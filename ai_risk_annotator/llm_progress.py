@@ -0,0 +1,148 @@
+import statistics
+import time
+
+import pandas as pd
+
+
+class GenerationListener:
+    """Callbacks of `LLMClient.stream_many`, called in the caller's thread.
+
+    `index` is the position of the prompt and `worker` the concurrent
+    slot generating it.
+    """
+
+    def queued(self, index: int, worker: int):
+        pass
+
+    def started(self, index: int, worker: int):
+        pass
+
+    def chunk(self, index: int, chunk: str):
+        pass
+
+    def finished(self, index: int, result, cached: bool = False):
+        """`result` is the full answer, or the exception of a failed generation."""
+
+
+class GenerationStats(GenerationListener):
+    """Timings and throughput of a batch of streamed generations.
+
+    A chunk is counted as one token, which holds for the streaming APIs
+    of Ollama and of the OpenAI-compatible servers.
+    """
+
+    def __init__(self, n_prompts: int) -> None:
+        self.n_prompts = n_prompts
+        self.started_at = time.monotonic()
+        # index -> dict of the timestamps and the token count
+        self.prompts = {}
+        # worker -> index being generated
+        self.workers = {}
+
+    def queued(self, index, worker):
+        self.prompts[index] = dict(worker=worker, queued_at=time.monotonic(), tokens=0)
+        self.workers[worker] = index
+
+    def started(self, index, worker):
+        self.prompts[index]["started_at"] = time.monotonic()
+
+    def chunk(self, index, chunk):
+        prompt = self.prompts[index]
+        prompt.setdefault("first_token_at", time.monotonic())
+        prompt["tokens"] += 1
+
+    def finished(self, index, result, cached=False):
+        prompt = self.prompts.setdefault(index, dict(tokens=0))
+        prompt.update(
+            finished_at=time.monotonic(),
+            cached=cached,
+            failed=isinstance(result, Exception),
+        )
+        if self.workers.get(prompt.get("worker")) == index:
+            del self.workers[prompt["worker"]]
+
+    def _generated(self) -> list:
+        return [
+            prompt
+            for prompt in self.prompts.values()
+            if "finished_at" in prompt
+            and "first_token_at" in prompt
+            and not prompt["failed"]
+        ]
+
+    @property
+    def done(self) -> int:
+        return sum("finished_at" in prompt for prompt in self.prompts.values())
+
+    def stage_latencies(self) -> pd.DataFrame:
+        """Median and maximum seconds spent in each stage by the finished prompts."""
+        stages = {
+            "Waiting for a slot": [
+                p["started_at"] - p["queued_at"] for p in self._generated()
+            ],
+            "Time to first token": [
+                p["first_token_at"] - p["started_at"] for p in self._generated()
+            ],
+            "Generation": [
+                p["finished_at"] - p["first_token_at"] for p in self._generated()
+            ],
+        }
+        return pd.DataFrame(
+            [
+                dict(stage=stage, median_s=statistics.median(d), max_s=max(d))
+                for stage, d in stages.items()
+                if d
+            ],
+            columns=["stage", "median_s", "max_s"],
+        )
+
+    def _expected_tokens(self) -> float:
+        tokens = [prompt["tokens"] for prompt in self._generated()]
+        return statistics.mean(tokens) if tokens else None
+
+    def _expected_duration(self) -> float:
+        durations = [p["finished_at"] - p["started_at"] for p in self._generated()]
+        return statistics.mean(durations) if durations else None
+
+    def workers_progress(self) -> pd.DataFrame:
+        """Per worker: the prompt, tokens so far, tokens/s and the ETA of the prompt."""
+        now = time.monotonic()
+        expected_tokens = self._expected_tokens()
+        rows = []
+        for worker, index in sorted(self.workers.items()):
+            prompt = self.prompts[index]
+            tokens_per_s = eta = None
+            if "first_token_at" in prompt and now > prompt["first_token_at"]:
+                tokens_per_s = prompt["tokens"] / (now - prompt["first_token_at"])
+                if expected_tokens and tokens_per_s:
+                    eta = max(expected_tokens - prompt["tokens"], 0) / tokens_per_s
+            rows.append(
+                dict(
+                    worker=worker,
+                    prompt=index,
+                    tokens=prompt["tokens"],
+                    tokens_per_s=tokens_per_s,
+                    eta_s=eta,
+                )
+            )
+        return pd.DataFrame(
+            rows, columns=["worker", "prompt", "tokens", "tokens_per_s", "eta_s"]
+        )
+
+    def tokens_per_s(self) -> float:
+        """Overall throughput, over all the workers."""
+        elapsed = time.monotonic() - self.started_at
+        tokens = sum(prompt["tokens"] for prompt in self.prompts.values())
+        return tokens / elapsed if elapsed else 0.0
+
+    def eta(self) -> float:
+        """Seconds left for the whole batch, None until a prompt is generated."""
+        duration = self._expected_duration()
+        if duration is None:
+            return None
+        n_workers = max(len(self.workers), 1)
+        remaining = self.n_prompts - self.done - len(self.workers)
+        in_flight = self.workers_progress().eta_s.dropna()
+        return (in_flight.max() if not in_flight.empty else 0) + (
+            remaining * duration / n_workers
+        )
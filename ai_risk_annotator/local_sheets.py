@@ -0,0 +1,110 @@
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+from streamlit.connections import BaseConnection
+
+
+class LocalSheetsError(ConnectionError):
+    """Injected failure of the local sheets backend."""
+
+
+class LocalSheetsConnection(BaseConnection[sqlite3.Connection]):
+    """SQLite-backed stand-in for `GSheetsConnection`.
+
+    It implements the `read`/`update`/`create`/`clear` surface used by the
+    app, one table per worksheet, so that the app and the load tests can
+    run without Google Sheets. Every call can be slowed down and made to
+    fail to mimic the network. The options are read from the
+    `[connections.gsheets]` secrets section or passed as keyword arguments:
+
+    - `database`: path of the SQLite file (default `local_sheets.db`)
+    - `latency`: seconds added to every call (default 0)
+    - `jitter`: maximum random seconds added on top of the latency (default 0)
+    - `error_rate`: probability for a call to raise `LocalSheetsError` (default 0)
+    - `seed_dir`: directory of `<worksheet>.csv` files used to create the
+      worksheets that do not exist yet in the database
+    """
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        config = {**self._secrets.to_dict(), **kwargs}
+        self.latency = float(config.get("latency", 0))
+        self.jitter = float(config.get("jitter", 0))
+        self.error_rate = float(config.get("error_rate", 0))
+        self.seed_dir = config.get("seed_dir")
+        self._lock = threading.Lock()
+        # One connection shared by the sessions' threads, serialized by the lock
+        return sqlite3.connect(
+            config.get("database", "local_sheets.db"), check_same_thread=False
+        )
+
+    def _simulate_network(self):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.error_rate and random.random() < self.error_rate:
+            raise LocalSheetsError("Injected error of the local sheets backend")
+
+    def _worksheet_exists(self, worksheet: str) -> bool:
+        return (
+            self._instance.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (worksheet,),
+            ).fetchone()
+            is not None
+        )
+
+    def _seed(self, worksheet: str):
+        if self.seed_dir is None:
+            return
+        csv_path = Path(self.seed_dir) / f"{worksheet}.csv"
+        if csv_path.exists():
+            pd.read_csv(csv_path).to_sql(worksheet, self._instance, index=False)
+
+    def read(
+        self,
+        *,
+        worksheet: str,
+        ttl=None,
+        usecols: list = None,
+        date_formatstr: str = None,
+        **kwargs,
+    ) -> pd.DataFrame:
+        """Reads a whole worksheet. `ttl` is accepted for compatibility and ignored."""
+        self._simulate_network()
+        with self._lock:
+            if not self._worksheet_exists(worksheet):
+                self._seed(worksheet)
+            if not self._worksheet_exists(worksheet):
+                raise ValueError(f"Worksheet {worksheet} does not exist")
+            df = pd.read_sql_query(f'SELECT * FROM "{worksheet}"', self._instance)
+
+        if usecols is not None:
+            if all(isinstance(col, int) for col in usecols):
+                df = df.iloc[:, usecols]
+            else:
+                df = df.reindex(columns=usecols)
+        return df
+
+    def update(self, *, worksheet: str, data: pd.DataFrame, **kwargs) -> pd.DataFrame:
+        """Replaces the whole content of the worksheet, as `GSheetsConnection.update`."""
+        self._simulate_network()
+        with self._lock:
+            data.to_sql(worksheet, self._instance, if_exists="replace", index=False)
+            self._instance.commit()
+        return data
+
+    def create(self, *, worksheet: str, data: pd.DataFrame, **kwargs) -> pd.DataFrame:
+        self._simulate_network()
+        with self._lock:
+            data.to_sql(worksheet, self._instance, if_exists="fail", index=False)
+            self._instance.commit()
+        return data
+
+    def clear(self, *, worksheet: str, **kwargs) -> dict:
+        self._simulate_network()
+        with self._lock:
+            self._instance.execute(f'DELETE FROM "{worksheet}"')
+            self._instance.commit()
+        return {"clearedRange": worksheet}
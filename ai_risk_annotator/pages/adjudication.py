@@ -0,0 +1,135 @@
+import datetime
+
+import pandas as pd
+import streamlit as st
+from adjudication import FIELDS, candidate_labels, get_disagreement_table
+from latest_annotations import get_latest_annotations
+from profiling import span
+from utils import (
+    check_password,
+    create_side_menu,
+    debug_page_only,
+    get_annotations,
+    get_annotators,
+    get_connection,
+    get_gold_labels,
+    gold_columns,
+    read_incidents_repository_from_file,
+    write_gold_labels,
+)
+
+st.set_page_config(page_title="AI Harm Annotator", layout="wide")
+create_side_menu()
+
+# Hidden page, only available in debug mode
+debug_page_only()
+
+st.markdown("# ⚖️")
+st.markdown("### Adjudication")
+
+if not check_password():
+    st.stop()
+
+try:
+    conn = get_connection()
+    annotators = get_annotators(conn)
+    df_annotations = get_annotations(conn)
+    df_gold = get_gold_labels(conn)
+except Exception as e:
+    st.error("Cannot connect to Google Sheets. Error: " + str(e))
+    st.stop()
+
+with st.sidebar:
+    st.divider()
+    if st.button("Refresh the annotations", use_container_width=True):
+        get_annotations.clear()
+        get_gold_labels.clear()
+        st.rerun()
+    hide_adjudicated = st.toggle("Hide the adjudicated incidents", value=True)
+
+repository = read_incidents_repository_from_file()
+latest_annotations = get_latest_annotations()
+disagreement_table = get_disagreement_table()
+# Only the incidents whose annotations changed since the last run are scored again
+with span("adjudication.update_scores"):
+    latest_annotations.update(df_annotations)
+    df_latest = latest_annotations.frame()
+    disagreement_table.update(df_latest)
+df_scores = disagreement_table.ranked()
+adjudicated = set(df_gold.incident_ID)
+
+left, middle, right = st.columns(3)
+left.metric("Incidents with several annotators", len(df_scores))
+middle.metric("With disagreements", int((df_scores.disagreement > 0).sum()))
+right.metric("Adjudicated", len(adjudicated))
+
+if hide_adjudicated:
+    df_scores = df_scores[~df_scores.index.isin(adjudicated)]
+df_scores.insert(0, "title", repository.title.reindex(df_scores.index))
+st.dataframe(
+    df_scores,
+    use_container_width=True,
+    column_config={
+        field: st.column_config.ProgressColumn(min_value=0, max_value=1)
+        for field in FIELDS + ["disagreement"]
+    },
+)
+
+incident = st.selectbox(
+    "Incident to adjudicate",
+    options=df_scores.index,
+    index=None,
+    format_func=lambda x: f"{x}: {df_scores.loc[x, 'title']} "
+    f"({df_scores.loc[x, 'disagreement']:.0%} of disagreement)",
+)
+if not incident:
+    st.stop()
+
+df_incident = df_latest[df_latest.incident_ID == incident]
+
+# Who chose what, field by field
+for field, tab in zip(FIELDS, st.tabs(FIELDS)):
+    with tab:
+        st.dataframe(
+            pd.crosstab(df_incident[field], df_incident.annotator).astype(bool),
+            use_container_width=True,
+        )
+
+st.markdown("#### Gold labels")
+st.caption("The labels given by at least half of the annotators are kept by default.")
+df_candidates = st.data_editor(
+    candidate_labels(df_incident),
+    disabled=FIELDS + ["annotators", "votes"],
+    hide_index=True,
+    use_container_width=True,
+    key=f"candidates_{incident}",
+)
+left, right = st.columns(2)
+adjudicator = left.selectbox("Adjudicator", annotators, index=None)
+notes = right.text_input("Notes on the adjudication")
+
+if st.button(
+    "Save the gold labels",
+    type="primary",
+    use_container_width=True,
+    disabled=not adjudicator or not df_candidates.keep.any(),
+):
+    now = datetime.datetime.now()
+    df_labels = df_candidates[df_candidates.keep].assign(
+        datetime=now.strftime("%Y-%m-%d"),
+        adjudicator=adjudicator,
+        incident_ID=incident,
+        notes=notes,
+        timestamp=int(now.timestamp()),
+    )[gold_columns]
+    with st.spinner("Writing to Google Sheets..."):
+        try:
+            write_gold_labels(conn, incident, df_labels)
+        except Exception as e:
+            st.error(
+                "Cannot write the gold labels. Check that the Gold worksheet exists. "
+                "Error: " + str(e)
+            )
+            st.stop()
+    st.toast(f"The gold labels of {incident} were saved.")
+    st.rerun()
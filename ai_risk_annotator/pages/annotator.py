@@ -2,29 +2,42 @@ import datetime
 
 import pandas as pd
 import streamlit as st
-from streamlit_gsheets import GSheetsConnection
 from streamlit_markmap import markmap
+from concurrency import describe_freshness
 from form import (
     display_question,
+    download_harms,
     stop_condition,
     Stakeholders,
     Harms,
 )
+from latest_annotations import get_latest_annotations
+from search_index import get_search_index
+from suggestions import HARM_TYPES, Suggestion, get_suggestion_store, within_taxonomy
 from utils import (
+    append_annotations,
     check_password,
     columns,
     create_side_menu,
     get_annotated_incidents,
+    get_annotations,
+    get_annotator_queues,
     get_annotators,
+    get_connection,
     get_incidents_batch,
+    prefetch_incident_descriptions,
     read_incidents_repository_from_file,
     scrap_incident_description,
+    snapshot_version,
     switch_page,
 )
+from work_queues import get_work_queues
 
 st.set_page_config(page_title="AI and Algorithmic Harm Annotator", layout="centered")
 create_side_menu()
 ANNOTATED_CAPTION = "Annotated ✔️"
+SEARCH_RESULTS = 30
+SIMILAR_INCIDENTS = 5
 
 st.markdown("# ✍🏻 ")
 st.markdown("### Annotations")
@@ -35,10 +48,15 @@ if not check_password():
 with st.sidebar:
     st.divider()
     show_descriptions = st.toggle("Show descriptions next to the questions", value=True)
+    use_suggestions = st.toggle(
+        "Pre-fill with the model's suggestions",
+        value=True,
+        help="The answers suggested beforehand by an LLM, when there are some for the incident.",
+    )
 
 # Connect to the Google Sheets where to store the answers
 try:
-    conn = st.connection("gsheets", type=GSheetsConnection)
+    conn = get_connection()
 except Exception as e:
     st.error("Cannot connect to Google Sheets. Error: " + str(e))
     st.info(
@@ -47,13 +65,15 @@ except Exception as e:
     st.stop()
 
 
-harms = Harms().download(conn)
-stakeholders = Stakeholders().download(conn)
+harms = Harms.download(conn)
+stakeholders = Stakeholders.download(conn)
 
 with st.sidebar:
     st.divider()
     st.subheader("Taxonomy overview", help="Zoom and scroll for more details")
     markmap(harms.mindmap())
+    # The taxonomy may be served stale while it is refreshed in the background
+    st.caption(describe_freshness(download_harms.freshness(conn)))
 
 
 with st.container(border=False):
@@ -81,23 +101,56 @@ with st.container(border=False):
     if not user:
         st.stop()
 
+    # Set by "Submit and next", before the widgets below are created
+    if "next_incident" in st.session_state:
+        st.session_state.incident = st.session_state.pop("next_incident")
+        st.session_state.incident_search = ""
+
     repository = read_incidents_repository_from_file()
     incidents_list = None
     if not st.sidebar.toggle("Show all incidents", False):
         try:
-            incidents_list = get_incidents_batch(conn)
-            incidents_list = set(incidents_list) & set(repository.index)
-            incidents_list = sorted(list(incidents_list), reverse=True)
-        except Exception as e:
-            st.toast(
-                "Cannot read the short-listed list of incidents from Google Sheets."
-            )
-            st.toast(e)
+            # The annotator's own queue comes first, in the scheduler's order
+            incidents_list = [
+                incident_id
+                for incident_id in get_annotator_queues(conn).get(user, [])
+                if incident_id in repository.index
+            ]
+        except Exception:
+            incidents_list = None
+        if not incidents_list:
+            try:
+                incidents_list = get_incidents_batch(conn)
+                incidents_list = set(incidents_list) & set(repository.index)
+                incidents_list = sorted(list(incidents_list), reverse=True)
+            except Exception as e:
+                st.toast(
+                    "Cannot read the short-listed list of incidents from Google Sheets."
+                )
+                st.toast(e)
 
     if not incidents_list:
         incidents_list = sorted(list(repository.index), reverse=True)
+    queued_incidents = incidents_list
 
     st.markdown("Select an incident")
+    query = st.text_input(
+        "Search",
+        placeholder="Search the incidents by keywords, e.g. deepfake elections",
+        label_visibility="collapsed",
+        key="incident_search",
+    )
+    if query:
+        search_index = get_search_index(repository, snapshot_version(repository))
+        listed_incidents = set(incidents_list)
+        incidents_list = [
+            incident_id
+            for incident_id, _ in search_index.search(query, k=SEARCH_RESULTS)
+            if incident_id in listed_incidents
+        ]
+        if not incidents_list:
+            st.info("No incident matches your search.")
+            st.stop()
 
     try:
         annotated_incidents = get_annotated_incidents(conn)
@@ -112,6 +165,9 @@ with st.container(border=False):
     else:
         annotated_incidents = annotated_incidents[user]
 
+    # The listed incidents left to annotate, shared by the user's sessions
+    work_queue = get_work_queues().get(user, queued_incidents, annotated_incidents)
+
     if "submitted_incidents" not in st.session_state:
         st.session_state.submitted_incidents = {}
 
@@ -129,7 +185,11 @@ with st.container(border=False):
             index=None,
             label_visibility="collapsed",
             horizontal=True,
-            captions=st.session_state.submitted_incidents[user].values(),
+            captions=[
+                st.session_state.submitted_incidents[user].get(k, "")
+                for k in incidents_list
+            ],
+            key="incident",
         )
     else:
         incident = st.selectbox(
@@ -137,6 +197,8 @@ with st.container(border=False):
             options=incidents_list,
             index=None,
             label_visibility="collapsed",
+            format_func=lambda x: f"{x}: {repository.loc[x, 'title']}",
+            key="incident",
         )
         if (
             incident
@@ -154,6 +216,10 @@ with st.container(border=False):
     st.markdown("##### Incident: " + repository.loc[incident, "title"])
     with st.container(height=None, border=False):
         st.info(scrap_incident_description(incident_page))
+    # The next incident of the queue is ready when the annotator submits
+    prefetch_incident_descriptions(
+        [repository.loc[i, "links"] for i in work_queue.upcoming(incident)]
+    )
 
     st.page_link(
         incident_page,
@@ -162,26 +228,86 @@ with st.container(border=False):
         icon="🌐",
     )
 
+    with st.expander("Similar incidents"):
+        search_index = get_search_index(repository, snapshot_version(repository))
+        for similar_incident, _ in search_index.similar(incident, k=SIMILAR_INCIDENTS):
+            st.markdown(
+                f"[{similar_incident}]({repository.loc[similar_incident, 'links']}): "
+                f"{repository.loc[similar_incident, 'title']}"
+            )
+
+# The suggestions are computed beforehand (see the LLM page), this is a
+# single lookup in the local store
+suggestion = None
+if use_suggestions:
+    stored_suggestion = get_suggestion_store().get(incident)
+    if stored_suggestion is not None:
+        suggestion = Suggestion(
+            incident,
+            stored_suggestion.model,
+            within_taxonomy(stored_suggestion.harms, harms, stakeholders),
+        )
+        st.caption(
+            f"🤖 The answers are pre-filled with the suggestions of `{suggestion.model}`, "
+            "please check them."
+        )
+
 st.divider()
-results = []
 
-harm_category_section = st.container(border=True)
-selected_harm_categories = display_question(
-    key_prefix=incident,
-    question="Which :violet[category] of harms is incurred? *(multiple options are possible)*",
-    description=harms.description(),
-    widget_cls=st.multiselect,
-    widget_kwargs=dict(
-        options=harms.values(),
-        default=None,
-    ),
-    container=harm_category_section,
-    help_text=harms.description(),
-    show_descriptions=show_descriptions,
-)
-stop_condition(not selected_harm_categories, SUBMIT_BUTTON_MESSAGE)
+# Answers of the fragments below, keyed by branch of the question tree.
+# A branch is stored as None until all its questions are answered.
+if "answered_branches" not in st.session_state:
+    st.session_state.answered_branches = {}
+answered_branches = st.session_state.answered_branches
+
+
+# Each harm category, and each harm subcategory within it, is a fragment:
+# answering a question only reruns its own branch instead of the whole page
+@st.fragment
+def harm_subcategory_section(incident, harm_category, harm_subcategory):
+    branch = (incident, harm_category, harm_subcategory)
+    answered_branches[branch] = None
+
+    sub_left, sub_right = st.columns((1, 35))
+    sub_left.write("↳")
+    stakeholder_container = sub_right.container(border=True)
+    impacted_stakeholders = display_question(
+        key_prefix=f"{incident}__{harm_category}__{harm_subcategory}",
+        question=f"Who are the :violet[impacted] stakeholders by `{harm_subcategory}`?",
+        description=stakeholders.description(),
+        widget_cls=st.multiselect,
+        widget_kwargs=dict(options=stakeholders.values(), default=None),
+        container=stakeholder_container,
+        help_text="External stakeholder (ie. not deployers or developers) individuals, groups, communities or entities using, being targeted by, or otherwise directly or indirectly negatively affected by a technology system. \n"
+        + stakeholders.description(),
+        show_descriptions=show_descriptions,
+        suggestion=(
+            suggestion.stakeholders(harm_category, harm_subcategory)
+            if suggestion
+            else None
+        ),
+    )
+
+    if not impacted_stakeholders:
+        return
+
+    notes = display_question(
+        key_prefix=f"{incident}__{harm_category}__{harm_subcategory}",
+        question=f"*[Optional]* Any :violet[notes] on `{harm_subcategory}` and `{', '.join(impacted_stakeholders)}`?",
+        widget_cls=st.text_area,
+        widget_kwargs=dict(
+            placeholder="E.g. missing, overlapping or unclear harm type names or definitions."
+        ),
+        container=stakeholder_container,
+    )
+    answered_branches[branch] = dict(stakeholders=impacted_stakeholders, notes=notes)
+
+
+@st.fragment
+def harm_category_section(incident, harm_category):
+    branch = (incident, harm_category)
+    answered_branches[branch] = None
 
-for harm_category in selected_harm_categories:
     left, right = st.columns((1, 35))
     left.write("↳")
     harm_subcategories_prefix = f"{incident}__{harm_category}"
@@ -211,6 +337,7 @@ for harm_category in selected_harm_categories:
             container=harm_subcategories_container,
             help_text=harms.description(),
             show_descriptions=show_descriptions,
+            suggestion=suggestion.subcategories(harm_category) if suggestion else None,
         )
 
     harm_type = display_question(
@@ -219,70 +346,133 @@ for harm_category in selected_harm_categories:
         description=harms.description("type"),
         widget_cls=st.selectbox,
         widget_kwargs=dict(
-            options=["Actual", "Potential"],
+            options=HARM_TYPES,
             index=None,
         ),
         container=harm_subcategories_container,
         help_text=harms.description("type"),
         show_descriptions=show_descriptions,
+        suggestion=suggestion.harm_type(harm_category) if suggestion else None,
     )
 
-    stop_condition(
-        not selected_harm_subcategories or not harm_type, SUBMIT_BUTTON_MESSAGE
-    )
+    if not selected_harm_subcategories or not harm_type:
+        return
 
-    for harm_subcategory in selected_harm_subcategories:
-        sub_left, sub_right = right.columns((1, 35))
-        sub_left.write("↳")
-        stakeholder_container = sub_right.container(border=True)
-        impacted_stakeholders = display_question(
-            key_prefix=f"{incident}__{harm_category}__{harm_subcategory}",
-            question=f"Who are the :violet[impacted] stakeholders by `{harm_subcategory}`?",
-            description=stakeholders.description(),
-            widget_cls=st.multiselect,
-            widget_kwargs=dict(options=stakeholders.values(), default=None),
-            container=stakeholder_container,
-            help_text="External stakeholder (ie. not deployers or developers) individuals, groups, communities or entities using, being targeted by, or otherwise directly or indirectly negatively affected by a technology system. \n"
-            + stakeholders.description(),
-            show_descriptions=show_descriptions,
+    answered_branches[branch] = dict(
+        harm_type=harm_type, harm_subcategories=selected_harm_subcategories
+    )
+    with right:
+        for harm_subcategory in selected_harm_subcategories:
+            harm_subcategory_section(incident, harm_category, harm_subcategory)
+
+
+def collect_results(incident, harm_categories) -> list | None:
+    """Flattens the answered branches into annotation rows.
+
+    Returns None if any question of the selected branches is unanswered.
+    """
+    results = []
+    for harm_category in harm_categories:
+        category_answers = answered_branches.get((incident, harm_category))
+        if category_answers is None:
+            return None
+        for harm_subcategory in category_answers["harm_subcategories"]:
+            answers = answered_branches.get((incident, harm_category, harm_subcategory))
+            if answers is None:
+                return None
+            for stakeholder in answers["stakeholders"]:
+                results.append(
+                    dict(
+                        datetime="",
+                        annotator=user,
+                        incident_ID=incident,
+                        stakeholders=stakeholder,
+                        harm_category=harm_category,
+                        harm_subcategory=harm_subcategory,
+                        harm_type=category_answers["harm_type"],
+                        notes=answers["notes"],
+                        timestamp="",
+                    )
+                )
+    return results
+
+
+def suggestion_answers(incident, harm_categories) -> dict:
+    """The suggested and submitted answers of each pre-filled question."""
+    answers = {"categories": (suggestion.categories(), harm_categories)}
+    for harm_category in suggestion.categories():
+        # The branches of the unselected answers are left empty
+        category_answers = {}
+        if harm_category in harm_categories:
+            category_answers = answered_branches.get((incident, harm_category)) or {}
+        selected_subcategories = category_answers.get("harm_subcategories", [])
+        answers[f"subcategories:{harm_category}"] = (
+            suggestion.subcategories(harm_category),
+            selected_subcategories,
         )
-
-        stop_condition(not impacted_stakeholders, SUBMIT_BUTTON_MESSAGE)
-
-        notes = display_question(
-            key_prefix=f"{incident}__{harm_category}__{harm_subcategory}",
-            question=f"*[Optional]* Any :violet[notes] on `{harm_subcategory}` and `{', '.join(impacted_stakeholders)}`?",
-            widget_cls=st.text_area,
-            widget_kwargs=dict(
-                placeholder="E.g. missing, overlapping or unclear harm type names or definitions."
-            ),
-            container=stakeholder_container,
+        answers[f"harm_type:{harm_category}"] = (
+            suggestion.harm_type(harm_category),
+            category_answers.get("harm_type"),
         )
-
-        for stakeholder in impacted_stakeholders:
-            results.append(
-                dict(
-                    datetime="",
-                    annotator=user,
-                    incident_ID=incident,
-                    stakeholders=stakeholder,
-                    harm_category=harm_category,
-                    harm_subcategory=harm_subcategory,
-                    harm_type=harm_type,
-                    notes=notes,
-                    timestamp="",
+        for harm_subcategory in suggestion.subcategories(harm_category):
+            subcategory_answers = {}
+            if harm_subcategory in selected_subcategories:
+                subcategory_answers = (
+                    answered_branches.get((incident, harm_category, harm_subcategory))
+                    or {}
                 )
+            answers[f"stakeholders:{harm_category}/{harm_subcategory}"] = (
+                suggestion.stakeholders(harm_category, harm_subcategory),
+                subcategory_answers.get("stakeholders", []),
             )
+    # Only the questions which had a suggestion
+    return {
+        question: (suggested, answered)
+        for question, (suggested, answered) in answers.items()
+        if suggested
+    }
+
+
+harm_categories_container = st.container(border=True)
+selected_harm_categories = display_question(
+    key_prefix=incident,
+    question="Which :violet[category] of harms is incurred? *(multiple options are possible)*",
+    description=harms.description(),
+    widget_cls=st.multiselect,
+    widget_kwargs=dict(
+        options=harms.values(),
+        default=None,
+    ),
+    container=harm_categories_container,
+    help_text=harms.description(),
+    show_descriptions=show_descriptions,
+    suggestion=suggestion.categories() if suggestion else None,
+)
+stop_condition(not selected_harm_categories, SUBMIT_BUTTON_MESSAGE)
+
+for harm_category in selected_harm_categories:
+    harm_category_section(incident, harm_category)
 
 ### Submission
-submitted = st.button(
+submit_column, next_column = st.columns(2)
+submitted = submit_column.button(
     SUBMIT_BUTTON_MESSAGE,
+    use_container_width=True,
+)
+submitted_and_next = next_column.button(
+    "Submit and go to the next incident",
     type="primary",
     use_container_width=True,
+    disabled=not work_queue.upcoming(incident),
 )
 
 ### Upload
-if submitted:
+if submitted or submitted_and_next:
+    results = collect_results(incident, selected_harm_categories)
+    if not results:
+        st.warning("Please answer all the questions before submitting.", icon="⚠️")
+        st.stop()
+
     current_datetime = datetime.datetime.now()
     timestamp = int(current_datetime.timestamp())
     current_datetime = current_datetime.strftime("%Y-%m-%d")
@@ -293,19 +483,12 @@ if submitted:
 
     with st.spinner("Writing to Google Sheets..."):
         try:
-            df = (
-                conn.read(
-                    worksheet="Annotations",
-                    ttl=0,
-                    usecols=columns,
-                    date_formatstr="%Y-%m-%d",
-                )
-                .dropna(how="all", axis=0)
-                .dropna(how="all", axis=1)
-            )
-
-            df = pd.concat([df, df_update], ignore_index=True)
-            conn.update(worksheet="Annotations", data=df)
+            append_annotations(conn, df_update)
+            # Refreshed in the background: the queue already knows this
+            # incident is done, and the other sessions get the new index
+            get_annotated_incidents.expire(conn)
+            get_annotations.expire(conn)
+            get_latest_annotations().apply(df_update)
         except Exception as e:
             st.error("Cannot connect to Google Sheets. Error: " + str(e))
             st.info(
@@ -325,11 +508,23 @@ if submitted:
             )
             st.stop()
 
+    if suggestion and suggestion.harms:
+        # How much of the suggestions the annotator kept
+        get_suggestion_store().record_acceptance(
+            incident, user, suggestion_answers(incident, selected_harm_categories)
+        )
+
     st.toast(
         "Your answers were submitted. You can select another incident to annotate."
     )
 
     st.session_state.submitted_incidents[user][incident] = ANNOTATED_CAPTION
     st.session_state.current_user = annotators.index(user)
+    work_queue.mark_done(incident)
 
+    next_incident = work_queue.next() if submitted_and_next else None
+    if next_incident:
+        # Its description was prefetched, the next rerun shows it right away
+        st.session_state.next_incident = next_incident
+        st.rerun()
     switch_page("thanks")
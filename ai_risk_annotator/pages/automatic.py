@@ -1,19 +1,43 @@
 import streamlit as st
+from chunking import truncate_to_tokens
+from concurrency import clear_shared_caches
+from dedup import canonical_articles
+from few_shot import FewShotRetriever, annotation_labels
+from form import Harms, Stakeholders, taxonomy_version
 from llm import build_llm_selection, extract_content, call_ollama_chat
+from llm_client import get_llm_client
+from latest_annotations import get_latest_annotations
+from llm_progress import GenerationStats
+from profiling import span
+from search_index import get_search_index, incident_documents
+from suggestions import get_suggestion_store, precompute_suggestions
+from summarize import MapReduceSummarizer
 from utils import (
     check_password,
     create_side_menu,
+    get_annotations,
+    get_connection,
     read_incidents_repository_from_file,
     stakeholders,
     get_list_of_links,
     scrap_incident_description,
+    snapshot_version,
+    write_atomic,
 )
 import shelve
-import ollama
 import json
 import os.path
-
-WORD_LIMIT = 8000 * 70 / 100
+import time
+
+# Token budgets of an article chunk in the summaries (and of the article
+# given as context in the chat), and of the notes combined in one call
+CHUNK_TOKENS = 1500
+REDUCE_TOKENS = 3000
+# Annotated incidents given as examples in the taxonomy questions, and their token budget
+FEW_SHOT_EXAMPLES = 3
+FEW_SHOT_TOKENS = 1200
+# Seconds between two checkpoints of a summary being generated
+CHECKPOINT_INTERVAL = 2
 st.set_page_config(page_title="AI Harm Annotator", layout="wide")
 create_side_menu()
 st.markdown("# LLM-based annotation")
@@ -35,17 +59,44 @@ if "chat_history" not in st.session_state or st.sidebar.button(
 with st.sidebar:
     if st.button("Clear cache", use_container_width=True):
         st.cache_data.clear()
+        clear_shared_caches()
         st.rerun()
+    use_llm_cache = st.toggle(
+        "Reuse the cached LLM answers",
+        value=True,
+        help="Identical requests to the same model are answered from the cache. "
+        "Turn it off to generate new answers.",
+    )
+    use_few_shot = st.toggle(
+        "Add annotated examples to the questions",
+        value=True,
+        help="The human annotations of the most similar incidents "
+        "are given to the LLM as examples.",
+    )
 
 
 # Read the incident repo and make the dropdown menu
 repository = read_incidents_repository_from_file()
 incidents_list = sorted(list(repository.index), reverse=True)
+query = st.text_input(
+    "Search",
+    placeholder="Search the incidents by keywords",
+    label_visibility="collapsed",
+)
+incident_options = incidents_list
+if query:
+    incident_options = [
+        incident_id
+        for incident_id, _ in get_search_index(
+            repository, snapshot_version(repository)
+        ).search(query, k=30)
+    ]
 incident = st.selectbox(
     "incident",
-    options=incidents_list,
+    options=incident_options,
     index=None,
     label_visibility="collapsed",
+    format_func=lambda x: f"{x}: {repository.loc[x, 'title']}",
     on_change=clear_history,
 )
 
@@ -80,15 +131,122 @@ Based on the above article, generate a summary of the incident, including the fo
 
 Keep the summary concise, with no title, and dive straight into the topic.
 """
+# Long articles, and incidents covered by several articles, are summarized
+# in parts whose notes are then combined
+map_template = """Act like an excellent journalist and writer.
+Below is an excerpt of a media article of an AI incident:
+
+(start of the excerpt)
+{0}
+(end of the excerpt)
+
+Write dense notes of the facts of this excerpt about the incident,
+the stakeholders impacted and their roles, the harm caused to them and its consequences.
+Only use the excerpt, with no title and no introduction.
+"""
+reduce_template = """Act like an excellent journalist and writer.
+You have a particularly good expertise in writing dense articles summaries.
+Below are notes taken from the media articles of an AI incident:
+
+(start of the notes)
+{0}
+(end of the notes)
+
+Based on the above notes, generate a summary of the incident, including the following information:
+
+- A clear and concise description of the incident.
+- The stakeholders impacted by the incident and their roles.
+- The specific harm caused to the stakeholders.
+- The potential consequences of the incident.
+
+Keep the summary concise, with no title, and dive straight into the topic.
+"""
+
+
+class SummaryWriter(GenerationStats):
+    """Checkpoints the summaries while they are streamed and shows the progress.
+
+    The partial summary of an incident is saved every `CHECKPOINT_INTERVAL`
+    seconds, so that a crash does not lose the text generated so far, and
+    the final one replaces it atomically.
+    """
+
+    def __init__(self, incident_ids, progress, metrics):
+        super().__init__(len(incident_ids))
+        self.incident_ids = incident_ids
+        self.progress = progress
+        self.metrics = metrics
+        self.partial = {}
+        self.checkpointed_at = {}
+        self.rendered_at = 0
+
+    def started(self, index, worker):
+        super().started(index, worker)
+        self.partial[index] = []
+        self.checkpointed_at[index] = time.monotonic()
+
+    def chunk(self, index, chunk):
+        super().chunk(index, chunk)
+        self.partial[index].append(chunk)
+        if time.monotonic() - self.checkpointed_at[index] > CHECKPOINT_INTERVAL:
+            write_atomic(
+                f"summaries/{self.incident_ids[index]}.partial.txt",
+                json.dumps("".join(self.partial[index])),
+            )
+            self.checkpointed_at[index] = time.monotonic()
+        self.render()
+
+    def finished(self, index, result, cached=False):
+        super().finished(index, result, cached)
+        incident_id = self.incident_ids[index]
+        self.partial.pop(index, None)
+        if isinstance(result, Exception):
+            st.error(f"Cannot summarize `{incident_id}`: {result}")
+        else:
+            write_atomic(f"summaries/{incident_id}.txt", json.dumps(result))
+            if os.path.exists(f"summaries/{incident_id}.partial.txt"):
+                os.remove(f"summaries/{incident_id}.partial.txt")
+        self.progress.progress(
+            self.done / self.n_prompts,
+            text=f"Summarizing incidents: {incident_id} ({self.done}/{self.n_prompts})",
+        )
+        self.render()
+
+    def render(self, articles_duration=None, force=False):
+        # Redrawing on every token would slow down the generation
+        if not force and time.monotonic() - self.rendered_at < 0.5:
+            return
+        self.rendered_at = time.monotonic()
+        eta = self.eta()
+        with self.metrics.container():
+            left, middle, right = st.columns(3)
+            left.metric("Summarized", f"{self.done}/{self.n_prompts}")
+            middle.metric("Tokens/s", f"{self.tokens_per_s():.1f}")
+            right.metric("ETA", "-" if eta is None else f"{eta:.0f} s")
+            df_workers = self.workers_progress()
+            df_workers["incident"] = [self.incident_ids[i] for i in df_workers.prompt]
+            st.dataframe(
+                df_workers[["worker", "incident", "tokens", "tokens_per_s", "eta_s"]],
+                hide_index=True,
+                use_container_width=True,
+            )
+            df_stages = self.stage_latencies()
+            if articles_duration is not None:
+                st.caption(f"Media articles collected in {articles_duration:.1f} s")
+            st.dataframe(df_stages, hide_index=True, use_container_width=True)
+
+
 if st.sidebar.button("Generate summaries", use_container_width=True):
-    progress = st.progress(0.0, text="Summarizing incidents")
+    progress = st.progress(0.0, text="Collecting the media articles")
+    collection_started_at = time.monotonic()
 
+    pending_incidents = []
     # current = st.empty()
     for i, incident_id in enumerate(incidents_list, 1):
         # with st.expander(repository.loc[incident_id, "title"], expanded=False):
         progress.progress(
             i / len(incidents_list),
-            text=f"Summarizing incidents: {incident_id} ({i}/{len(incidents_list)})",
+            text=f"Collecting the media articles: {incident_id} ({i}/{len(incidents_list)})",
         )
 
         # summary_tab, media_tab = st.tabs(["Summary", "Media"])
@@ -111,14 +269,13 @@ if st.sidebar.button("Generate summaries", use_container_width=True):
                 st.error(f"No links for `{incident_id}` ({incident_page})")
                 continue
 
-            media_descriptions = extract_content(links_list, WORD_LIMIT)
+            media_descriptions = extract_content(links_list)
             if not media_descriptions:
                 st.error(f"No content for `{incident_id}` ({incident_page})")
                 st.markdown("\n".join(links_list))
                 continue
 
-            with open(f"media/{incident_id}.txt", "w") as f:
-                json.dump(media_descriptions, f)
+            write_atomic(f"media/{incident_id}.txt", json.dumps(media_descriptions))
 
         # tabs = media_tab.tabs(
         #     [f"Link {n}" for n in range(1, len(media_descriptions) + 1)]
@@ -128,14 +285,118 @@ if st.sidebar.button("Generate summaries", use_container_width=True):
         if os.path.exists(f"summaries/{incident_id}.txt"):
             continue
 
-        summary = ollama.generate(
-            model=selected_llm,
-            prompt=prompt_template.format(media_descriptions[0]),
-        )["response"]
+        pending_incidents.append((incident_id, media_descriptions))
+
+    articles_duration = time.monotonic() - collection_started_at
+
+    # All the articles are used: the long ones are split in chunks
+    # summarized in parallel, then the notes are combined per incident
+    summarizer = MapReduceSummarizer(
+        get_llm_client(),
+        selected_llm,
+        summary_template=prompt_template,
+        map_template=map_template,
+        reduce_template=reduce_template,
+        chunk_tokens=CHUNK_TOKENS,
+        reduce_tokens=REDUCE_TOKENS,
+        use_cache=use_llm_cache,
+    )
+    # The near-duplicate articles of an incident, e.g. the copies
+    # of a wire story, are summarized once
+    with span("automatic.deduplicate_articles"):
+        incidents_articles, n_duplicates = canonical_articles(
+            [articles for _, articles in pending_incidents]
+        )
+    if n_duplicates:
+        st.caption(f"{n_duplicates} near-duplicate media articles are skipped")
+    n_parts = summarizer.count_calls(incidents_articles)
+    progress.progress(0.0, text="Summarizing the parts of the articles")
+    summarized_parts = []
+
+    def show_parts_progress(index, text):
+        summarized_parts.append(index)
+        progress.progress(
+            min(len(summarized_parts) / max(n_parts, 1), 1.0),
+            text=f"Summarizing the parts of the articles ({len(summarized_parts)}/{n_parts})",
+        )
+
+    with span("automatic.summarize_parts"):
+        final_prompts = summarizer.final_prompts(
+            incidents_articles, on_result=show_parts_progress
+        )
+    for i, errors in summarizer.errors.items():
+        st.warning(
+            f"{len(errors)} parts of `{pending_incidents[i][0]}` could not be summarized: {errors[0]}"
+        )
+    summaries_to_stream = [
+        (incident_id, prompt)
+        for (incident_id, _), prompt in zip(pending_incidents, final_prompts)
+        if prompt is not None
+    ]
+
+    # The summaries are streamed concurrently, within the client's limit,
+    # and the cached ones are not generated again
+    progress.progress(0.0, text="Summarizing incidents")
+    metrics = st.empty()
+    summary_writer = SummaryWriter(
+        [incident_id for incident_id, _ in summaries_to_stream], progress, metrics
+    )
+    with span("automatic.generate_summaries"):
+        get_llm_client().stream_many(
+            selected_llm,
+            [prompt for _, prompt in summaries_to_stream],
+            summary_writer,
+            use_cache=use_llm_cache,
+        )
+    summary_writer.render(articles_duration, force=True)
+
+if st.sidebar.button("Suggest annotations", use_container_width=True):
+    # Pre-fills of the annotator form, computed once per model and taxonomy
+    conn = get_connection()
+    harms = Harms.download(conn)
+    stakeholders_taxonomy = Stakeholders.download(conn)
+    suggestion_store = get_suggestion_store()
+    already_suggested = suggestion_store.suggested_incidents(
+        selected_llm, taxonomy_version(harms.version, stakeholders_taxonomy.version)
+    )
+    documents = incident_documents(repository)
+    descriptions = {}
+    for incident_id in incidents_list:
+        if incident_id in already_suggested:
+            continue
+        # The summary of the articles when there is one, else the description
+        descriptions[incident_id] = documents[incident_id]
+        if os.path.exists(f"summaries/{incident_id}.txt"):
+            with open(f"summaries/{incident_id}.txt") as f:
+                descriptions[incident_id] = json.load(f)
+
+    progress = st.progress(0.0, text="Suggesting annotations")
+    suggested = []
 
-        with open(f"summaries/{incident_id}.txt", "w") as f:
-            json.dump(summary, f)
+    def show_suggestions_progress(index, text):
+        suggested.append(index)
+        progress.progress(
+            len(suggested) / len(descriptions),
+            text=f"Suggesting annotations ({len(suggested)}/{len(descriptions)})",
+        )
 
+    with span("automatic.suggest_annotations"):
+        n_stored = precompute_suggestions(
+            get_llm_client(),
+            selected_llm,
+            suggestion_store,
+            descriptions,
+            harms,
+            stakeholders_taxonomy,
+            on_result=show_suggestions_progress,
+            use_cache=use_llm_cache,
+        )
+    st.success(
+        f"{n_stored} new suggestions, {len(descriptions) - n_stored} unusable answers, "
+        f"{len(already_suggested)} incidents already suggested"
+    )
+    st.caption("Share of the suggestions kept by the annotators")
+    st.dataframe(suggestion_store.acceptance(), hide_index=True)
 
 if not incident:
     st.stop()
@@ -157,7 +418,7 @@ links_list = get_list_of_links(incident_page)
 if not links_list:
     st.error("Empty list of links")
     st.stop()
-media_descriptions = extract_content(links_list, WORD_LIMIT)
+media_descriptions = extract_content(links_list)
 
 with st.sidebar:
     st.divider()
@@ -180,16 +441,38 @@ I want you to carefully answer my following questions based on the incident desc
 Do not make things up. If you do not know, simply say that do you do not know.
 
 Here is the media article:
-{media_descriptions[selected_media_link]}
+{truncate_to_tokens(media_descriptions[selected_media_link], CHUNK_TOKENS)}
 
 
 """
 
+# The human labels of the closest annotated incidents, as few-shot examples
+few_shot_examples = ""
+if use_few_shot:
+    try:
+        df_annotations = get_annotations(get_connection())
+    except Exception as e:
+        st.toast("Cannot read the annotations from Google Sheets: " + str(e))
+    else:
+        latest_annotations = get_latest_annotations()
+        latest_annotations.update(df_annotations)
+        retriever = FewShotRetriever(
+            get_search_index(repository, snapshot_version(repository)),
+            incident_documents(repository),
+            annotation_labels(latest_annotations.frame()),
+        )
+        few_shot_examples = retriever.prompt(
+            incident, k=FEW_SHOT_EXAMPLES, max_tokens=FEW_SHOT_TOKENS
+        )
+    if few_shot_examples:
+        with st.expander("Annotated examples given to the LLM", expanded=False):
+            st.text(few_shot_examples)
+
 if selected_llm not in st.session_state["chat_history"]:
     st.session_state.chat_history[selected_llm] = []
 
 
-(questions_tab, summaries_tab) = st.tabs(["Taxonomy questions", "All summaries"])
+questions_tab, summaries_tab = st.tabs(["Taxonomy questions", "All summaries"])
 
 if st.sidebar.button("LLM run", use_container_width=True, type="primary"):
     with questions_tab:
@@ -202,7 +485,9 @@ if st.sidebar.button("LLM run", use_container_width=True, type="primary"):
         Based on this article, make a short summary of the incident emphasizing who was harmed and how they were harmed.
         """
 
-        call_ollama_chat(selected_llm, prompt_template, store_prompt=False)
+        call_ollama_chat(
+            selected_llm, prompt_template, store_prompt=False, use_cache=use_llm_cache
+        )
 
     # if st.sidebar.button(
     #     "Who are the impacted stakeholders?", use_container_width=True, type="primary"
@@ -222,11 +507,13 @@ if st.sidebar.button("LLM run", use_container_width=True, type="primary"):
 
         prompt_template = f"""We have established the following stakeholders taxonomy:
         {stakeholders_descriptions}.
-        Based on the description of the AI incident and the stakeholders taxonomy, determine which stakeholders are impacted in the case of this incident?
+        {few_shot_examples}Based on the description of the AI incident and the stakeholders taxonomy, determine which stakeholders are impacted in the case of this incident?
         Keep your answer short.
         """
 
-        call_ollama_chat(selected_llm, prompt_template, store_prompt=False)
+        call_ollama_chat(
+            selected_llm, prompt_template, store_prompt=False, use_cache=use_llm_cache
+        )
 
     # with discussion_tab:
     #     prompt = st.chat_input(max_chars=4096 * 3)
@@ -0,0 +1,100 @@
+import pandas as pd
+import streamlit as st
+from export import (
+    CHUNK_ROWS,
+    EXPORT_DIR,
+    FORMATS,
+    SCHEMAS,
+    description_chunks,
+    export_datasets,
+    frame_chunks,
+    repository_chunks,
+    summary_chunks,
+)
+from latest_annotations import get_latest_annotations
+from suggestions import get_suggestion_store
+from utils import (
+    check_password,
+    create_side_menu,
+    debug_page_only,
+    get_annotations,
+    get_connection,
+    load_extra_data,
+    read_incidents_repository_from_file,
+)
+
+st.set_page_config(page_title="AI Harm Annotator", layout="wide")
+create_side_menu()
+
+# Hidden page, only available in debug mode
+debug_page_only()
+
+st.markdown("# 📦")
+st.markdown("### Export")
+
+if not check_password():
+    st.stop()
+
+st.caption(
+    f"The datasets are written chunk by chunk to a new directory of `{EXPORT_DIR}/`, "
+    "with a `manifest.json` describing their schemas. "
+    "Load them with `export.read_export` or any Parquet/JSONL reader."
+)
+
+left, middle, right = st.columns(3)
+datasets = left.multiselect("Datasets", list(SCHEMAS), default=list(SCHEMAS))
+fmt = middle.radio(
+    "Format",
+    FORMATS,
+    index=len(FORMATS) - 1,
+    horizontal=True,
+    help="Parquet requires pyarrow.",
+)
+only_latest = right.toggle(
+    "Only the latest submissions",
+    help="Only export the last submission of each annotator on each incident.",
+)
+
+if not st.button(
+    "Export", type="primary", use_container_width=True, disabled=not datasets
+):
+    st.stop()
+
+# The datasets are only read when the export gets to them
+sources = {}
+if "annotations" in datasets:
+    try:
+        df_annotations = get_annotations(get_connection())
+    except Exception as e:
+        st.error("Cannot connect to Google Sheets. Error: " + str(e))
+        st.stop()
+    if only_latest:
+        latest_annotations = get_latest_annotations()
+        latest_annotations.update(df_annotations)
+        df_annotations = latest_annotations.frame()
+    sources["annotations"] = frame_chunks(df_annotations)
+if "repository" in datasets:
+    sources["repository"] = repository_chunks(read_incidents_repository_from_file())
+if "descriptions" in datasets:
+    sources["descriptions"] = description_chunks(*load_extra_data())
+if "summaries" in datasets:
+    sources["summaries"] = summary_chunks()
+if "suggestions" in datasets:
+    sources["suggestions"] = get_suggestion_store().iter_suggestions(CHUNK_ROWS)
+
+progress = st.empty()
+
+
+def show_progress(dataset, rows):
+    progress.caption(f"Exporting {dataset}: {rows} rows")
+
+
+with st.spinner("Exporting..."):
+    manifest = export_datasets(sources, fmt, on_progress=show_progress)
+progress.empty()
+
+st.success(f"Exported to `{manifest['path']}`")
+st.dataframe(
+    pd.DataFrame(manifest["datasets"]).T[["rows", "files", "partition"]],
+    use_container_width=True,
+)
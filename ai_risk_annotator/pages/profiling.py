@@ -0,0 +1,87 @@
+import time
+
+import pandas as pd
+import streamlit as st
+from concurrency import shared_cache_stats
+from profiling import clear_spans, read_spans, summarize_spans
+from utils import create_side_menu, debug_page_only
+
+st.set_page_config(page_title="AI Harm Annotator", layout="wide")
+create_side_menu()
+
+# Hidden page, only available in debug mode
+debug_page_only()
+
+st.markdown("# ⏱️")
+st.markdown("### Server-side profiling")
+
+with st.sidebar:
+    st.divider()
+    window = st.selectbox(
+        "Time window",
+        options=[15 * 60, 60 * 60, 24 * 60 * 60, None],
+        index=1,
+        format_func=lambda x: "All" if x is None else f"Last {x // 60} minutes",
+    )
+    if st.button("Refresh", use_container_width=True):
+        st.rerun()
+    if st.button("Clear the recorded spans", use_container_width=True):
+        clear_spans()
+        st.rerun()
+
+st.markdown("#### Shared caches", help="Counts since the server started")
+df_cache_stats = pd.DataFrame(
+    shared_cache_stats(),
+    columns=["function", "key", "hit", "stale", "miss", "coalesced"],
+)
+st.dataframe(
+    df_cache_stats.sort_values(["function", "miss"], ascending=[True, False]),
+    use_container_width=True,
+    hide_index=True,
+)
+
+df_spans = read_spans(since=time.time() - window if window else 0)
+if df_spans.empty:
+    st.info("No spans were recorded yet. Browse the other pages and come back.")
+    st.stop()
+
+df_spans["page"] = df_spans["page"].fillna("(background)")
+pages = sorted(df_spans["page"].unique())
+selected_pages = st.multiselect("Pages", pages, default=pages)
+df_spans = df_spans[df_spans["page"].isin(selected_pages)]
+
+st.markdown("#### Spans")
+st.dataframe(
+    summarize_spans(df_spans),
+    use_container_width=True,
+    column_config={
+        "p50": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+        "p95": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+        "total": st.column_config.NumberColumn("total (ms)", format="%.0f"),
+        "miss_p50": st.column_config.NumberColumn("miss p50 (ms)", format="%.1f"),
+    },
+)
+
+st.markdown("#### Reruns")
+df_reruns = (
+    df_spans[df_spans.kind != "miss"]
+    .dropna(subset=["rerun_id"])
+    .groupby(["rerun_id", "page"])
+    .agg(started_at=("created_at", "min"), spans=("name", "count"))
+    .reset_index()
+    .sort_values("started_at", ascending=False)
+)
+df_reruns.started_at = pd.to_datetime(df_reruns.started_at, unit="s")
+selected_rerun = st.selectbox(
+    "Rerun",
+    df_reruns.rerun_id,
+    format_func=lambda x: "{page} at {started_at}".format(
+        **df_reruns.set_index("rerun_id").loc[x]
+    ),
+)
+if selected_rerun:
+    st.dataframe(
+        df_spans[df_spans.rerun_id == selected_rerun][["name", "kind", "duration_ms"]],
+        use_container_width=True,
+        hide_index=True,
+    )
@@ -0,0 +1,96 @@
+import streamlit as st
+from latest_annotations import get_latest_annotations
+from profiling import span
+from scheduler import get_batch_scheduler
+from search_index import get_search_index
+from utils import (
+    check_password,
+    create_side_menu,
+    debug_page_only,
+    get_annotations,
+    get_annotators,
+    get_connection,
+    read_incidents_repository_from_file,
+    snapshot_version,
+    write_annotator_queues,
+)
+
+st.set_page_config(page_title="AI Harm Annotator", layout="wide")
+create_side_menu()
+
+# Hidden page, only available in debug mode
+debug_page_only()
+
+st.markdown("# 🗂️")
+st.markdown("### Annotation batches")
+
+if not check_password():
+    st.stop()
+
+try:
+    conn = get_connection()
+    annotators = get_annotators(conn)
+    df_annotations = get_annotations(conn)
+except Exception as e:
+    st.error("Cannot connect to Google Sheets. Error: " + str(e))
+    st.stop()
+
+with st.sidebar:
+    st.divider()
+    if st.button("Refresh the annotations", use_container_width=True):
+        get_annotations.clear()
+        st.rerun()
+
+repository = read_incidents_repository_from_file()
+repository_version = snapshot_version(repository)
+scheduler = get_batch_scheduler(
+    get_search_index(repository, repository_version), repository_version
+)
+# Only the incidents whose annotations changed since the last run are scored again
+latest_annotations = get_latest_annotations()
+with span("scheduler.update_scores"):
+    latest_annotations.update(df_annotations)
+    n_changed = scheduler.update(latest_annotations.frame())
+st.caption(f"Scores updated for {n_changed} incidents")
+
+df_scores = scheduler.scores()
+df_scores["title"] = repository.title.reindex(df_scores.index)
+
+left, middle, right = st.columns(3)
+selected_annotators = left.multiselect("Annotators", annotators, default=annotators)
+queue_size = middle.number_input("Incidents per annotator", 1, 500, 20)
+annotators_per_incident = right.number_input(
+    "Annotators per incident",
+    1,
+    len(annotators) or 1,
+    min(2, len(annotators) or 1),
+    help="The overlap needed for the agreement statistics. "
+    "The contested incidents get one more annotator.",
+)
+
+df_queues = scheduler.queues(
+    selected_annotators, queue_size, annotators_per_incident
+).join(df_scores[["title"]], on="incident_ID")
+
+queues_tab, scores_tab = st.tabs(["Queues", "Scores"])
+with queues_tab:
+    st.dataframe(df_queues, hide_index=True, use_container_width=True)
+    if st.button(
+        "Write the queues to Google Sheets",
+        type="primary",
+        use_container_width=True,
+        disabled=df_queues.empty,
+    ):
+        with st.spinner("Writing to Google Sheets..."):
+            write_annotator_queues(conn, df_queues)
+        st.toast("The annotators will see their new queues.")
+
+with scores_tab:
+    st.dataframe(
+        df_scores.sort_values("score", ascending=False),
+        use_container_width=True,
+        column_config={
+            "uncertainty": st.column_config.ProgressColumn(min_value=0, max_value=1),
+            "disagreement": st.column_config.ProgressColumn(min_value=0, max_value=1),
+        },
+    )
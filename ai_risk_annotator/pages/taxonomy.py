@@ -0,0 +1,125 @@
+import streamlit as st
+from form import Harms, Stakeholders
+from latest_annotations import get_latest_annotations
+from taxonomy_versions import diff_taxonomies, get_taxonomy_store, taxonomy_labels
+from utils import (
+    check_password,
+    create_side_menu,
+    debug_page_only,
+    get_annotations,
+    get_connection,
+)
+
+st.set_page_config(page_title="AI Harm Annotator", layout="wide")
+create_side_menu()
+
+# Hidden page, only available in debug mode
+debug_page_only()
+
+st.markdown("# 🏷️")
+st.markdown("### Taxonomy versions")
+
+if not check_password():
+    st.stop()
+
+try:
+    conn = get_connection()
+    snapshots = [Harms.download(conn), Stakeholders.download(conn)]
+except Exception as e:
+    st.error("Cannot connect to Google Sheets. Error: " + str(e))
+    st.stop()
+
+taxonomy_store = get_taxonomy_store()
+# The current versions, in case the store is newer than the cached taxonomy
+for snapshot in snapshots:
+    taxonomy_store.record(snapshot)
+
+st.caption(
+    "The labels of the older versions are translated to the new ones when the "
+    "annotations are read. The Annotations worksheet is left unchanged."
+)
+
+kind = st.radio("Taxonomy", ["harms", "stakeholders"], horizontal=True)
+df_versions = taxonomy_store.versions(kind)
+st.dataframe(df_versions, hide_index=True, use_container_width=True)
+
+
+def refresh_annotations():
+    # The views of the annotations are rebuilt with the new labels
+    get_annotations.clear()
+    get_latest_annotations.clear()
+
+
+if len(df_versions) < 2:
+    st.info("Only one version of this taxonomy was seen so far.")
+else:
+    left, right = st.columns(2)
+    created_at = dict(zip(df_versions.version, df_versions.created_at))
+    from_version = left.selectbox(
+        "From the version",
+        df_versions.version,
+        index=len(df_versions) - 2,
+        format_func=lambda v: f"{v} ({created_at[v]:%Y-%m-%d %H:%M})",
+    )
+    to_version = right.selectbox(
+        "To the version",
+        df_versions.version,
+        index=len(df_versions) - 1,
+        format_func=lambda v: f"{v} ({created_at[v]:%Y-%m-%d %H:%M})",
+    )
+    to_content = taxonomy_store.content(to_version)
+    df_diff = diff_taxonomies(kind, taxonomy_store.content(from_version), to_content)
+    # The existing mappings win over the guesses
+    mappings = taxonomy_store.mappings()
+    df_diff["new"] = [
+        mappings.get(field, {}).get(old, new)
+        for field, old, new in zip(df_diff.field, df_diff.old, df_diff.new)
+    ]
+
+    st.markdown(f"#### {len(df_diff)} labels removed or renamed")
+    st.caption(
+        "Pick the new label of each old one, or leave it empty to keep the old label. "
+        "The labels with the same description are matched by default."
+    )
+    df_edited = st.data_editor(
+        df_diff,
+        column_config={
+            "new": st.column_config.SelectboxColumn(
+                options=sorted(
+                    {
+                        label
+                        for labels in taxonomy_labels(kind, to_content).values()
+                        for label in labels
+                    }
+                )
+            )
+        },
+        disabled=["field", "old"],
+        hide_index=True,
+        use_container_width=True,
+        key=f"mappings_{from_version}_{to_version}",
+    )
+    if st.button(
+        "Save the mappings",
+        type="primary",
+        use_container_width=True,
+        disabled=df_edited.new.isna().all(),
+    ):
+        n_saved = taxonomy_store.add_mappings(df_edited, from_version, to_version)
+        refresh_annotations()
+        st.toast(f"{n_saved} mappings saved.")
+        st.rerun()
+
+st.markdown("#### Mappings")
+df_mappings = taxonomy_store.mapping_table()
+st.dataframe(df_mappings, hide_index=True, use_container_width=True)
+removed = st.multiselect(
+    "Mappings to remove",
+    list(zip(df_mappings.field, df_mappings.old)),
+    format_func=lambda m: f"{m[0]}: {m[1]}",
+)
+if st.button("Remove the mappings", disabled=not removed):
+    for field, old in removed:
+        taxonomy_store.delete_mapping(field, old)
+    refresh_annotations()
+    st.rerun()
@@ -0,0 +1,197 @@
+import contextlib
+import functools
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+PROFILING_DB = "profiling.db"
+
+# Spans are queued and written by a background thread
+# so that recording them stays off the rerun's critical path
+MAX_QUEUED_SPANS = 10_000
+_spans = queue.Queue(maxsize=MAX_QUEUED_SPANS)
+_writer = None
+_writer_lock = threading.Lock()
+_enabled = None
+logger = logging.getLogger(__name__)
+
+
+def is_enabled() -> bool:
+    """Profiling is on in debug mode, or when the `profiling` secret is set."""
+    global _enabled
+    if _enabled is None:
+        try:
+            _enabled = bool(st.secrets.get("profiling", st.secrets.get("debug_mode")))
+        except Exception:
+            _enabled = False
+    return _enabled
+
+
+def _connect() -> sqlite3.Connection:
+    db = sqlite3.connect(PROFILING_DB, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=OFF")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS spans (
+            created_at REAL,
+            session_id TEXT,
+            rerun_id TEXT,
+            page TEXT,
+            name TEXT,
+            kind TEXT,
+            duration_ms REAL
+        )
+        """)
+    return db
+
+
+def _write_spans():
+    db = None
+    while True:
+        rows = [_spans.get()]
+        while not _spans.empty() and len(rows) < 500:
+            rows.append(_spans.get_nowait())
+        try:
+            if db is None:
+                db = _connect()
+            db.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        except Exception:
+            # A locked or broken database loses the batch, not the writer,
+            # which connects again for the next one
+            logger.exception("Dropped %d profiling spans", len(rows))
+            db = None
+
+
+def _start_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(
+                target=_write_spans, name="profiling-writer", daemon=True
+            )
+            _writer.start()
+
+
+def _current_rerun() -> tuple:
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        # Background threads and scripts outside of streamlit
+        return None, None, None
+    rerun_id, page = st.session_state.get("_profiling_rerun", (None, None))
+    return ctx.session_id, rerun_id, page
+
+
+def begin_rerun():
+    """Tags the spans recorded from now on with a new rerun id and the page name."""
+    if not is_enabled():
+        return
+    main_script = getattr(sys.modules["__main__"], "__file__", None) or ""
+    page = os.path.splitext(os.path.basename(main_script))[0]
+    st.session_state["_profiling_rerun"] = (uuid.uuid4().hex[:12], page)
+
+
+def record(name: str, kind: str, duration_ms: float):
+    if not is_enabled():
+        return
+    _start_writer()
+    try:
+        _spans.put_nowait((time.time(), *_current_rerun(), name, kind, duration_ms))
+    except queue.Full:
+        # The writer is behind, the span is dropped rather than blocking the rerun
+        pass
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = "span"):
+    """Times the enclosed block."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, kind, (time.perf_counter() - start) * 1000)
+
+
+def _qualified_name(func) -> str:
+    module = "page" if func.__module__ == "__main__" else func.__module__
+    return f"{module}.{func.__qualname__}"
+
+
+def timed(func=None, *, name: str = None):
+    """Times every call of the decorated function.
+
+    When stacked on top of a cache decorator (`st.cache_data`, `shared_cache`), each call
+    counts as a cache access. Combined with `cache_miss` below the cache
+    decorator, the debug page derives the hit and miss counts.
+    """
+    if func is None:
+        return functools.partial(timed, name=name)
+    span_name = name or _qualified_name(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(span_name, "call"):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def cache_miss(func=None, *, name: str = None):
+    """Records a cache miss each time the decorated function actually runs.
+
+    To be placed below the cache decorator.
+    """
+    if func is None:
+        return functools.partial(cache_miss, name=name)
+    span_name = name or _qualified_name(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(span_name, "miss"):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def read_spans(since: float = 0) -> pd.DataFrame:
+    with contextlib.closing(_connect()) as db:
+        return pd.read_sql_query(
+            "SELECT * FROM spans WHERE created_at >= ?", db, params=(since,)
+        )
+
+
+def summarize_spans(df_spans: pd.DataFrame) -> pd.DataFrame:
+    """Count, p50 and p95 per span, with cache hits for instrumented caches."""
+    df_durations = df_spans[df_spans.kind != "miss"]
+    df_summary = df_durations.groupby("name").duration_ms.agg(
+        count="count",
+        p50=lambda x: x.quantile(0.5),
+        p95=lambda x: x.quantile(0.95),
+        total="sum",
+    )
+    df_misses = (
+        df_spans[df_spans.kind == "miss"]
+        .groupby("name")
+        .duration_ms.agg(misses="count", miss_p50=lambda x: x.quantile(0.5))
+    )
+    df_summary = df_summary.join(df_misses, how="outer")
+    # The names with only misses (a cache without `timed`) or without any
+    df_summary["count"] = df_summary["count"].fillna(0).astype(int)
+    df_summary["total"] = df_summary.total.fillna(0)
+    df_summary["misses"] = df_summary.misses.fillna(0).astype(int)
+    df_summary["hits"] = (df_summary["count"] - df_summary.misses).clip(lower=0)
+    # Stable, so that the equal totals stay in the order of the names
+    return df_summary.sort_values("total", ascending=False, kind="stable")
+
+
+def clear_spans():
+    with contextlib.closing(_connect()) as db:
+        db.execute("DELETE FROM spans")
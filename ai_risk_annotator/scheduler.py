@@ -0,0 +1,208 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import streamlit as st
+from analytics import changed_incidents, incident_hashes
+from profiling import span
+from search_index import SearchIndex
+
+# Annotated neighbours whose labels tell how uncertain the labels of an incident are
+NEIGHBOURS = 10
+# Incidents with this much disagreement get one more annotator
+CONTESTED_DISAGREEMENT = 0.5
+MAX_ANNOTATORS = 4
+UNCERTAINTY_WEIGHT = 1.0
+DISAGREEMENT_WEIGHT = 1.0
+
+
+class BatchScheduler:
+    """Ranks the incidents to annotate next and spreads them among the annotators.
+
+    The score of an incident adds up:
+
+    - the uncertainty: the normalized entropy of the harm categories of
+      its annotated neighbours in the search index, 1 without any,
+    - the disagreement: for the categories chosen by its annotators, the
+      mean of 4p(1-p), where p is the share of annotators choosing it.
+
+    `update` only recomputes the incidents whose annotations changed, and
+    the uncertainty of the incidents having them as neighbours.
+    """
+
+    def __init__(self, index: SearchIndex, neighbours: int = NEIGHBOURS) -> None:
+        self._lock = threading.Lock()
+        self.ids = list(index.ids)
+        self.positions = dict(index.positions)
+        n_incidents = len(self.ids)
+        with span("scheduler.neighbours"):
+            self.neighbours = index.neighbours(neighbours)
+        # Who has each incident among its neighbours
+        rows, ranks = np.nonzero(self.neighbours >= 0)
+        self.neighbour_of = sp.csr_matrix(
+            (
+                np.ones(len(rows), dtype=np.int8),
+                (self.neighbours[rows, ranks], rows),
+            ),
+            shape=(n_incidents, n_incidents),
+        )
+
+        self.categories = {}
+        # Share of each harm category in the annotations of each incident
+        self.distributions = np.zeros((n_incidents, 0))
+        self.n_annotators = np.zeros(n_incidents, dtype=np.int64)
+        self.disagreement = np.zeros(n_incidents)
+        self.uncertainty = np.ones(n_incidents)
+        self.annotators = {}
+        self.hashes = pd.Series(dtype=np.uint64, index=pd.Index([], dtype=object))
+        self.source_version = None
+
+    def _category_columns(self, categories) -> list:
+        for category in categories:
+            self.categories.setdefault(category, len(self.categories))
+        missing = len(self.categories) - self.distributions.shape[1]
+        if missing:
+            self.distributions = np.hstack(
+                [self.distributions, np.zeros((len(self.ids), missing))]
+            )
+        return [self.categories[category] for category in categories]
+
+    def update(self, df_annotations: pd.DataFrame) -> int:
+        """Takes the new annotations into account, returns the number of changed incidents."""
+        # `LatestAnnotations.frame` stores its version, unchanged without new submissions
+        source_version = df_annotations.attrs.get("version")
+        if source_version is not None and source_version == self.source_version:
+            return 0
+        df = df_annotations.dropna(subset=["incident_ID", "annotator", "harm_category"])
+        df = df[df.incident_ID.isin(self.positions)]
+        hashes = incident_hashes(df, ["annotator", "incident_ID", "harm_category"])
+        with self._lock:
+            self.source_version = source_version
+            changed = changed_incidents(self.hashes, hashes)
+            if not changed:
+                return 0
+            with span("scheduler.update"):
+                self._update_incidents(df[df.incident_ID.isin(changed)], changed)
+            self.hashes = hashes
+        return len(changed)
+
+    def _update_incidents(self, df: pd.DataFrame, changed: set):
+        positions = np.array([self.positions[i] for i in changed])
+        self.n_annotators[positions] = 0
+        self.disagreement[positions] = 0
+        self.distributions[positions] = 0
+        for incident_id in changed:
+            self.annotators.pop(incident_id, None)
+
+        if not df.empty:
+            self.annotators.update(df.groupby("incident_ID").annotator.agg(set))
+            n_annotators = df.groupby("incident_ID").annotator.nunique()
+            self.n_annotators[[self.positions[i] for i in n_annotators.index]] = (
+                n_annotators.to_numpy()
+            )
+
+            votes = df.drop_duplicates(["incident_ID", "annotator", "harm_category"])
+            counts = votes.groupby(["incident_ID", "harm_category"]).size()
+            incidents = counts.index.get_level_values("incident_ID")
+            shares = counts.to_numpy() / n_annotators.reindex(incidents).to_numpy()
+            disagreement = (
+                pd.Series(4 * shares * (1 - shares), index=incidents)
+                .groupby(level=0)
+                .mean()
+            )
+            self.disagreement[[self.positions[i] for i in disagreement.index]] = (
+                disagreement.to_numpy()
+            )
+
+            rows = [self.positions[i] for i in incidents]
+            columns = self._category_columns(
+                counts.index.get_level_values("harm_category")
+            )
+            self.distributions[rows, columns] = counts.to_numpy()
+            totals = self.distributions[positions].sum(axis=1, keepdims=True)
+            self.distributions[positions] /= np.maximum(totals, 1)
+
+        # The uncertainty of the changed incidents' neighbourhoods
+        affected = np.union1d(positions, self.neighbour_of[positions].indices)
+        self.uncertainty[affected] = self._uncertainty(affected)
+
+    def _uncertainty(self, positions: np.ndarray) -> np.ndarray:
+        neighbours = self.neighbours[positions]
+        labelled = (neighbours >= 0) & (self.n_annotators[neighbours] > 0)
+        n_labelled = labelled.sum(axis=1)
+        n_categories = self.distributions.shape[1]
+        if n_categories < 2:
+            return np.where(n_labelled > 0, 0.0, 1.0)
+        distributions = (self.distributions[neighbours] * labelled[..., None]).sum(
+            axis=1
+        ) / np.maximum(n_labelled, 1)[:, None]
+        entropy = -(
+            distributions * np.log(np.where(distributions > 0, distributions, 1))
+        ).sum(axis=1)
+        return np.where(n_labelled > 0, np.abs(entropy) / np.log(n_categories), 1.0)
+
+    def scores(self) -> pd.DataFrame:
+        with self._lock:
+            df_scores = pd.DataFrame(
+                dict(
+                    annotators=self.n_annotators,
+                    uncertainty=self.uncertainty,
+                    disagreement=self.disagreement,
+                ),
+                index=pd.Index(self.ids, name="incident_ID"),
+            )
+        df_scores["score"] = (
+            UNCERTAINTY_WEIGHT * df_scores.uncertainty
+            + DISAGREEMENT_WEIGHT * df_scores.disagreement
+        )
+        return df_scores
+
+    def queues(
+        self, annotators: list, queue_size: int, annotators_per_incident: int = 2
+    ) -> pd.DataFrame:
+        """Queues of `queue_size` incidents per annotator, the best scores first.
+
+        Each incident is given to enough annotators to reach
+        `annotators_per_incident`, for the agreement statistics, and the
+        contested ones to one more. The incidents go to the annotators with
+        the shortest queues who have not annotated them yet.
+        """
+        df_scores = self.scores()
+        needed = np.maximum(annotators_per_incident - df_scores.annotators, 0)
+        contested = (df_scores.disagreement >= CONTESTED_DISAGREEMENT) & (
+            df_scores.annotators < MAX_ANNOTATORS
+        )
+        df_scores["needed"] = np.where(contested & (needed == 0), 1, needed)
+        candidates = df_scores[df_scores.needed > 0].sort_values(
+            "score", ascending=False
+        )
+
+        loads = {annotator: 0 for annotator in annotators}
+        assignments = []
+        for incident_id, needed, score in zip(
+            candidates.index, candidates.needed, candidates.score
+        ):
+            if min(loads.values(), default=queue_size) >= queue_size:
+                break
+            done_by = self.annotators.get(incident_id, set())
+            eligible = sorted(
+                (
+                    annotator
+                    for annotator, load in loads.items()
+                    if load < queue_size and annotator not in done_by
+                ),
+                key=loads.get,
+            )
+            for annotator in eligible[:needed]:
+                assignments.append((annotator, incident_id, loads[annotator], score))
+                loads[annotator] += 1
+        return pd.DataFrame(
+            assignments, columns=["annotator", "incident_ID", "position", "score"]
+        ).sort_values(["annotator", "position"], ignore_index=True)
+
+
+@st.cache_resource(max_entries=2)
+def get_batch_scheduler(_index: SearchIndex, repository_version: str) -> BatchScheduler:
+    """The scheduler of a repository snapshot, kept across the reruns to be updated incrementally."""
+    return BatchScheduler(_index)
@@ -0,0 +1,314 @@
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import streamlit as st
+from concurrency import shared_cache
+from profiling import cache_miss, span, timed
+from utils import TTL, load_extra_data
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+SEARCH_INDEX_DIR = "search_index"
+# BM25 parameters, the usual defaults
+K1 = 1.5
+B = 0.75
+STOPWORDS = set(
+    """a an and are as at be been but by for from had has have he her his how in
+    into is it its of on or over she than that the their them they this to was
+    were what when which who will with after also about more""".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        token
+        for token in re.findall(r"[a-z0-9]+", text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _write_atomic_bytes(path: Path, write):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class SearchIndex:
+    """Search index of the incidents, stored in a directory.
+
+    The term counts of every document are kept on disk, so that an update
+    only tokenizes the new and changed documents. The BM25 weights (for the
+    search) and the TF-IDF vectors (for the similar incidents) are derived
+    from the counts with a few sparse operations.
+
+    With an `embedding_model` (needs `sentence-transformers`), the documents
+    are also embedded on the CPU: the similar incidents then come from the
+    embeddings, and the search fuses the BM25 and embedding rankings.
+    """
+
+    def __init__(self, directory: str = SEARCH_INDEX_DIR, embedding_model: str = None):
+        self.directory = Path(directory)
+        self.ids = []
+        self.hashes = []
+        self.vocabulary = {}
+        self.counts = sp.csr_matrix((0, 0), dtype=np.float32)
+        self.embeddings = None
+        self.embedding_model = embedding_model
+        self._encoder = None
+
+    @classmethod
+    def load(cls, directory: str = SEARCH_INDEX_DIR, embedding_model: str = None):
+        index = cls(directory, embedding_model)
+        meta_path = index.directory / "meta.json"
+        if not meta_path.exists():
+            return index
+        meta = json.loads(meta_path.read_text())
+        index.ids = meta["ids"]
+        index.hashes = meta["hashes"]
+        index.vocabulary = {term: i for i, term in enumerate(meta["vocabulary"])}
+        index.counts = sp.load_npz(index.directory / "counts.npz").tocsr()
+        embeddings_path = index.directory / "embeddings.npy"
+        if (
+            embedding_model
+            and meta.get("embedding_model") == embedding_model
+            and embeddings_path.exists()
+        ):
+            index.embeddings = np.load(embeddings_path)
+        index._prepare()
+        return index
+
+    def save(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        _write_atomic_bytes(
+            self.directory / "counts.npz", lambda f: sp.save_npz(f, self.counts)
+        )
+        if self.embeddings is not None:
+            _write_atomic_bytes(
+                self.directory / "embeddings.npy",
+                lambda f: np.save(f, self.embeddings),
+            )
+        # Written last: it tells which counts and embeddings are valid
+        meta = {
+            "ids": self.ids,
+            "hashes": self.hashes,
+            "vocabulary": sorted(self.vocabulary, key=self.vocabulary.get),
+            "embedding_model": (
+                self.embedding_model if self.embeddings is not None else None
+            ),
+        }
+        _write_atomic_bytes(
+            self.directory / "meta.json", lambda f: f.write(json.dumps(meta).encode())
+        )
+
+    def _count_terms(self, texts: list[str]) -> sp.csr_matrix:
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for token in tokenize(text):
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+        return sp.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(texts), len(self.vocabulary)),
+        )
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        if self._encoder is None:
+            self._encoder = SentenceTransformer(self.embedding_model, device="cpu")
+        return self._encoder.encode(
+            texts, normalize_embeddings=True, convert_to_numpy=True
+        ).astype(np.float32)
+
+    def update(self, documents: dict) -> int:
+        """Indexes the new and changed documents and drops the removed ones.
+
+        Returns the number of (re)indexed documents.
+        """
+        hashes = {doc_id: text_hash(text) for doc_id, text in documents.items()}
+        position = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        use_embeddings = self._encoder_available()
+        if use_embeddings and self.embeddings is None:
+            # No valid embeddings on disk: everything is indexed again
+            kept = []
+        else:
+            kept = [
+                doc_id
+                for doc_id in self.ids
+                if hashes.get(doc_id) == self.hashes[position[doc_id]]
+            ]
+        kept_set = set(kept)
+        changed = [doc_id for doc_id in documents if doc_id not in kept_set]
+        if not changed and len(kept) == len(self.ids):
+            return 0
+
+        with span("search_index.update"):
+            kept_rows = [position[doc_id] for doc_id in kept]
+            new_counts = self._count_terms([documents[doc_id] for doc_id in changed])
+            old_counts = self.counts[kept_rows]
+            old_counts.resize((len(kept), len(self.vocabulary)))
+            self.counts = sp.vstack([old_counts, new_counts]).tocsr()
+
+            if use_embeddings:
+                new_embeddings = self._encode([documents[doc_id] for doc_id in changed])
+                self.embeddings = (
+                    np.vstack([self.embeddings[kept_rows], new_embeddings])
+                    if kept
+                    else new_embeddings
+                )
+
+            self.ids = kept + changed
+            self.hashes = [hashes[doc_id] for doc_id in self.ids]
+            self._prepare()
+        return len(changed)
+
+    def _prepare(self):
+        """Derives the BM25 weights and the TF-IDF vectors from the counts."""
+        counts = self.counts.tocsr()
+        counts.sum_duplicates()
+        n_docs = counts.shape[0]
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        self.idf = np.log(
+            1 + (n_docs - document_frequency + 0.5) / (document_frequency + 0.5)
+        ).astype(np.float32)
+
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average_length = lengths.mean() if n_docs else 0
+        rows = np.repeat(np.arange(n_docs), np.diff(counts.indptr))
+        tf = counts.data
+        bm25 = (
+            self.idf[counts.indices]
+            * tf
+            * (K1 + 1)
+            / (tf + K1 * (1 - B + B * lengths[rows] / max(average_length, 1)))
+        )
+        # Column slices are the fast path of the queries
+        self.bm25 = sp.csr_matrix(
+            (bm25, counts.indices, counts.indptr), shape=counts.shape
+        ).tocsc()
+
+        tfidf = sp.csr_matrix(
+            (
+                (1 + np.log(tf)) * self.idf[counts.indices],
+                counts.indices,
+                counts.indptr,
+            ),
+            shape=counts.shape,
+        )
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        self.tfidf = sp.diags(1 / np.maximum(norms, 1e-12)) @ tfidf
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int, exclude: int = None) -> list:
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        k = min(k, int(np.isfinite(scores).sum()), int((scores > 0).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])].tolist()
+
+    def search(self, query: str, k: int = 20) -> list[tuple]:
+        """The `k` best matching documents, as `(id, score)` pairs."""
+        if not self.ids:
+            return []
+        columns = [self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary]
+        scores = np.asarray(self.bm25[:, columns].sum(axis=1)).ravel()
+        if self.embeddings is not None and self._encoder_available():
+            # Reciprocal rank fusion of the keyword and semantic rankings
+            dense = self.embeddings @ self._encode([query])[0]
+            fused = np.zeros(len(self.ids), dtype=np.float32)
+            for ranking in [np.argsort(-scores), np.argsort(-dense)]:
+                fused[ranking] += 1 / (60 + np.arange(1, len(ranking) + 1))
+            scores = fused
+        return [(self.ids[i], float(scores[i])) for i in self._top_k(scores, k)]
+
+    def similar(self, doc_id: str, k: int = 5, among=None) -> list[tuple]:
+        """The `k` documents closest to `doc_id`, as `(id, similarity)` pairs.
+
+        `among` restricts the candidates to a collection of ids.
+        """
+        position = self.positions.get(doc_id)
+        if position is None:
+            return []
+        if self.embeddings is not None:
+            scores = self.embeddings @ self.embeddings[position]
+        else:
+            scores = (self.tfidf @ self.tfidf[position].T).toarray().ravel()
+        scores = scores.astype(np.float64)
+        if among is not None:
+            candidates = np.full(len(scores), -np.inf)
+            rows = [self.positions[i] for i in among if i in self.positions]
+            candidates[rows] = scores[rows]
+            scores = candidates
+        return [
+            (self.ids[i], float(scores[i]))
+            for i in self._top_k(scores, k, exclude=position)
+        ]
+
+    def neighbours(self, k: int = 10, block_size: int = 1024) -> np.ndarray:
+        """The positions of the `k` closest documents of every document.
+
+        The similarities are computed by blocks of rows to bound the memory.
+        The positions of the neighbours without any similarity are -1.
+        """
+        n_docs = len(self.ids)
+        k = min(k, max(n_docs - 1, 0))
+        result = np.full((n_docs, k), -1, dtype=np.int64)
+        if k == 0:
+            return result
+        for start in range(0, n_docs, block_size):
+            stop = min(start + block_size, n_docs)
+            if self.embeddings is not None:
+                scores = self.embeddings[start:stop] @ self.embeddings.T
+            else:
+                scores = (self.tfidf[start:stop] @ self.tfidf.T).toarray()
+            rows = np.arange(stop - start)
+            scores[rows, rows + start] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            result[start:stop] = np.where(
+                np.take_along_axis(scores, top, axis=1) > 0, top, -1
+            )
+        return result
+
+    def _encoder_available(self) -> bool:
+        return self.embedding_model is not None and SentenceTransformer is not None
+
+
+def incident_documents(repository: pd.DataFrame) -> dict:
+    """The text indexed for each incident: its title and its description."""
+    descriptions, _ = load_extra_data()
+    return {
+        incident_id: f"{title}\n{descriptions.get(incident_id) or ''}"
+        for incident_id, title in repository.title.fillna("").items()
+    }
+
+
+# The index of the previous snapshot is kept while the sessions move to the new one
+@timed
+@shared_cache(ttl=TTL, show_spinner="Indexing the incidents...", max_entries=2)
+@cache_miss
+def get_search_index(_repository: pd.DataFrame, repository_version: str) -> SearchIndex:
+    """The index of the repository's incidents, updated from the one on disk.
+
+    The optional `embedding_model` of the `[search]` secrets section
+    turns on the embeddings.
+    """
+    embedding_model = st.secrets.get("search", {}).get("embedding_model")
+    index = SearchIndex.load(SEARCH_INDEX_DIR, embedding_model)
+    if index.update(incident_documents(_repository)):
+        index.save()
+    return index
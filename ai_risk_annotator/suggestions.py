@@ -0,0 +1,278 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from form import Harms, Stakeholders, taxonomy_version
+from llm_client import LLMClient
+
+SUGGESTIONS_DB = "suggestions.db"
+HARM_TYPES = ["Actual", "Potential"]
+
+suggestion_template = """You are an outstanding AI expert, specialized in AI incidents.
+You are tasked with annotating an AI incident following a precise harm taxonomy.
+
+The harm categories are:
+{categories}
+The specific harms of each category are:
+{subcategories}
+The impacted stakeholders can be: {stakeholders}.
+
+Here is the description of the incident:
+{description}
+
+List the harms incurred in this incident. Answer with JSON only, in this format:
+{{"harms": [{{"category": "...", "subcategory": "...", "type": "Actual or Potential", "stakeholders": ["..."]}}]}}
+Only use the names of the taxonomy above.
+"""
+
+
+def suggestion_prompt(description: str, harms: Harms, stakeholders: Stakeholders):
+    return suggestion_template.format(
+        categories=harms.description(),
+        subcategories="".join(
+            f"- {category}: {', '.join(harms.values(category))}\n"
+            for category in harms.harm_categories
+        ),
+        stakeholders=", ".join(stakeholders.values()),
+        description=description,
+    )
+
+
+def parse_suggestion(text: str, harms: Harms, stakeholders: Stakeholders) -> list:
+    """The harms of the model's answer, empty if it is not valid JSON."""
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        answer = json.loads(match.group(0)) if match else {}
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(answer, dict) or not isinstance(answer.get("harms"), list):
+        return []
+    return within_taxonomy(answer["harms"], harms, stakeholders)
+
+
+def within_taxonomy(suggested: list, harms: Harms, stakeholders: Stakeholders) -> list:
+    """The suggested harms that belong to the taxonomy, with their valid stakeholders.
+
+    Returns a list of dicts with the `category`, `subcategory`, `type`
+    and `stakeholders` of each harm.
+    """
+    valid_stakeholders = set(stakeholders.values())
+    valid_harms = []
+    for harm in suggested:
+        if not isinstance(harm, dict):
+            continue
+        category = harm.get("category")
+        if category not in harms.harm_categories:
+            continue
+        if harm.get("subcategory") not in harms.values(category):
+            continue
+        harm_type = str(harm.get("type") or "").capitalize()
+        valid_harms.append(
+            dict(
+                category=category,
+                subcategory=harm["subcategory"],
+                type=harm_type if harm_type in HARM_TYPES else None,
+                stakeholders=[
+                    s for s in harm.get("stakeholders") or [] if s in valid_stakeholders
+                ],
+            )
+        )
+    return valid_harms
+
+
+class Suggestion:
+    """The pre-filled answers of the annotator form for one incident."""
+
+    def __init__(self, incident_id: str, model: str, harms: list) -> None:
+        self.incident_id = incident_id
+        self.model = model
+        self.harms = harms
+
+    def categories(self) -> list:
+        return list(dict.fromkeys(harm["category"] for harm in self.harms))
+
+    def subcategories(self, category: str) -> list:
+        return list(
+            dict.fromkeys(
+                harm["subcategory"]
+                for harm in self.harms
+                if harm["category"] == category
+            )
+        )
+
+    def harm_type(self, category: str) -> str:
+        types = [
+            harm["type"]
+            for harm in self.harms
+            if harm["category"] == category and harm["type"]
+        ]
+        # Actual if any of the harms of the category is actual
+        if not types:
+            return None
+        return "Actual" if "Actual" in types else "Potential"
+
+    def stakeholders(self, category: str, subcategory: str) -> list:
+        return list(
+            dict.fromkeys(
+                stakeholder
+                for harm in self.harms
+                if harm["category"] == category and harm["subcategory"] == subcategory
+                for stakeholder in harm["stakeholders"]
+            )
+        )
+
+
+class SuggestionStore:
+    """The models' suggestions of annotations, and how the annotators received them, in SQLite."""
+
+    def __init__(self, database: str = SUGGESTIONS_DB) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            database, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS suggestions (
+                incident_ID TEXT PRIMARY KEY,
+                model TEXT,
+                taxonomy_version TEXT,
+                created_at REAL,
+                harms TEXT
+            )
+            """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS acceptance (
+                incident_ID TEXT,
+                annotator TEXT,
+                question TEXT,
+                suggested TEXT,
+                answered TEXT,
+                accepted INTEGER,
+                created_at REAL
+            )
+            """)
+
+    def get(self, incident_id: str) -> Suggestion:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT model, harms FROM suggestions WHERE incident_ID = ?",
+                (incident_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return Suggestion(incident_id, row[0], json.loads(row[1]))
+
+    def put(self, incident_id: str, model: str, taxonomy_version: str, harms: list):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO suggestions VALUES (?, ?, ?, ?, ?)",
+                (incident_id, model, taxonomy_version, time.time(), json.dumps(harms)),
+            )
+
+    def suggested_incidents(self, model: str, taxonomy_version: str) -> set:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT incident_ID FROM suggestions WHERE model = ? AND taxonomy_version = ?",
+                (model, taxonomy_version),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def iter_suggestions(self, chunk_rows: int):
+        """All the suggestions, `chunk_rows` at a time, in the order of the incidents."""
+        last_incident = ""
+        while True:
+            with self._lock:
+                df = pd.read_sql_query(
+                    "SELECT * FROM suggestions WHERE incident_ID > ? "
+                    "ORDER BY incident_ID LIMIT ?",
+                    self._db,
+                    params=(last_incident, chunk_rows),
+                )
+            if df.empty:
+                return
+            yield df
+            last_incident = df.incident_ID.iloc[-1]
+
+    def record_acceptance(self, incident_id: str, annotator: str, answers: dict):
+        """`answers` maps each question to its `(suggested, answered)` values."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO acceptance VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        incident_id,
+                        annotator,
+                        question,
+                        json.dumps(suggested),
+                        json.dumps(answered),
+                        int(_as_set(suggested) == _as_set(answered)),
+                        now,
+                    )
+                    for question, (suggested, answered) in answers.items()
+                ],
+            )
+
+    def acceptance(self) -> pd.DataFrame:
+        """The share of the suggestions kept unchanged, per kind of question."""
+        with self._lock:
+            df = pd.read_sql_query(
+                "SELECT question, accepted FROM acceptance", self._db
+            )
+        df["question"] = df.question.str.split(":").str[0]
+        return (
+            df.groupby("question")
+            .accepted.agg(["count", "mean"])
+            .rename(columns={"count": "suggestions", "mean": "accepted"})
+            .reset_index()
+        )
+
+
+def _as_set(value) -> set:
+    return set(value) if isinstance(value, list) else {value}
+
+
+def precompute_suggestions(
+    client: LLMClient,
+    model: str,
+    store: SuggestionStore,
+    descriptions: dict,
+    harms: Harms,
+    stakeholders: Stakeholders,
+    on_result=None,
+    use_cache: bool = True,
+) -> int:
+    """Asks the model to annotate the incidents and stores its valid answers.
+
+    `descriptions` maps the incidents to their text. Returns the number
+    of incidents with a stored suggestion.
+    """
+    incident_ids = list(descriptions)
+    answers = client.generate_many(
+        model,
+        [
+            suggestion_prompt(descriptions[incident_id], harms, stakeholders)
+            for incident_id in incident_ids
+        ],
+        on_result=on_result,
+        use_cache=use_cache,
+    )
+    version = taxonomy_version(harms.version, stakeholders.version)
+    n_stored = 0
+    for incident_id, answer in zip(incident_ids, answers):
+        if isinstance(answer, Exception):
+            continue
+        suggested = parse_suggestion(answer, harms, stakeholders)
+        if suggested:
+            store.put(incident_id, model, version, suggested)
+            n_stored += 1
+    return n_stored
+
+
+@st.cache_resource
+def get_suggestion_store() -> SuggestionStore:
+    return SuggestionStore()
@@ -0,0 +1,190 @@
+from chunking import (
+    estimate_tokens,
+    group_by_budget,
+    split_into_chunks,
+    truncate_to_tokens,
+)
+from llm_client import LLMBusyError, LLMClient
+from profiling import span
+
+# Bounds the reduce rounds, in case the combined notes do not get shorter
+MAX_REDUCE_ROUNDS = 4
+NOTES_SEPARATOR = "\n\n---\n\n"
+
+
+class MapReduceSummarizer:
+    """Summarizes all the articles of many incidents, whatever their length.
+
+    - Map: the articles are split into chunks of at most `chunk_tokens`,
+      and every chunk is summarized into notes by `map_template`.
+    - Reduce: the notes of an incident are combined by `reduce_template`,
+      in several rounds if they exceed `reduce_tokens`. A note above the
+      budget alone is split first, and the notes still above it after the
+      last round are truncated, so that the final prompt fits.
+
+    The calls of a round are sent together to `LLMClient.generate_many`, so
+    they run in parallel and their latency is bounded by the chunk size.
+    `final_prompts` stops before the last call, so that the final summaries
+    can be streamed. An incident made of a single chunk is summarized
+    directly from its article by `summary_template`.
+    The templates have a single `{0}` placeholder for the text.
+    """
+
+    def __init__(
+        self,
+        client: LLMClient,
+        model: str,
+        summary_template: str,
+        map_template: str,
+        reduce_template: str,
+        chunk_tokens: int = 1500,
+        reduce_tokens: int = 3000,
+        use_cache: bool = True,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.summary_template = summary_template
+        self.map_template = map_template
+        self.reduce_template = reduce_template
+        self.chunk_tokens = chunk_tokens
+        self.reduce_tokens = reduce_tokens
+        self.use_cache = use_cache
+        # Incident index -> exceptions of its failed map or reduce calls
+        self.errors = {}
+
+    def _generate(self, prompts_by_incident: dict, on_result=None) -> dict:
+        """Runs the prompts of all the incidents in one batch.
+
+        Returns the answers of each incident's prompts, in order, with the
+        exceptions of the failed calls in place of their answers.
+        """
+        owners = [i for i, prompts in prompts_by_incident.items() for _ in prompts]
+        prompts = [p for prompts in prompts_by_incident.values() for p in prompts]
+        answers = {i: [] for i in prompts_by_incident}
+        for owner, answer in zip(
+            owners,
+            self.client.generate_many(
+                self.model, prompts, on_result=on_result, use_cache=self.use_cache
+            ),
+        ):
+            answers[owner].append(answer)
+        return answers
+
+    def _fit(self, notes: list) -> list:
+        """The notes, with the ones above the reduce budget split in chunks."""
+        return [
+            chunk
+            for note in notes
+            for chunk in (
+                split_into_chunks(note, self.reduce_tokens)
+                if estimate_tokens(note) > self.reduce_tokens
+                else [note]
+            )
+        ]
+
+    def final_prompts(self, incidents_articles: list, on_result=None) -> list:
+        """One prompt per incident, None for the incidents without any content.
+
+        `on_result(index, text)` is called after each map or reduce call,
+        e.g. to show the progress.
+        """
+        chunks = {
+            i: [
+                chunk
+                for article in articles
+                for chunk in split_into_chunks(article, self.chunk_tokens)
+            ]
+            for i, articles in enumerate(incidents_articles)
+        }
+        prompts = [None] * len(incidents_articles)
+        for i, incident_chunks in chunks.items():
+            if len(incident_chunks) == 1:
+                prompts[i] = self.summary_template.format(incident_chunks[0])
+
+        with span("summarize.map"):
+            notes = {}
+            for i, answers in self._generate(
+                {
+                    i: [self.map_template.format(chunk) for chunk in incident_chunks]
+                    for i, incident_chunks in chunks.items()
+                    if len(incident_chunks) > 1
+                },
+                on_result,
+            ).items():
+                notes[i] = [a for a in answers if not isinstance(a, Exception)]
+                failed = [a for a in answers if isinstance(a, Exception)]
+                if failed:
+                    self.errors.setdefault(i, []).extend(failed)
+
+        with span("summarize.reduce"):
+            # The errors of each incident's last reduce round, i.e. of its
+            # notes left unreduced, so that a retried failure counts once
+            reduce_errors = {}
+            # The incidents whose reduce calls failed for good
+            stopped = set()
+            # Combines the notes until they fit in a single reduce call
+            for _ in range(MAX_REDUCE_ROUNDS):
+                oversized = {}
+                for i, incident_notes in notes.items():
+                    if i in stopped:
+                        continue
+                    notes[i] = self._fit(incident_notes)
+                    groups = group_by_budget(notes[i], self.reduce_tokens)
+                    if len(groups) > 1:
+                        oversized[i] = groups
+                if not oversized:
+                    break
+                results = self._generate(
+                    {
+                        i: [
+                            self.reduce_template.format("\n\n".join(group))
+                            for group in groups
+                        ]
+                        for i, groups in oversized.items()
+                    },
+                    on_result,
+                )
+                for i, groups in oversized.items():
+                    notes[i], reduce_errors[i] = [], []
+                    for group, answer in zip(groups, results[i]):
+                        if not isinstance(answer, Exception):
+                            notes[i].append(answer)
+                            continue
+                        # The notes of a failed call are kept as they are
+                        notes[i].extend(group)
+                        reduce_errors[i].append(answer)
+                        # Only a busy server is worth another try, the
+                        # other errors would come back with the same notes
+                        if not isinstance(answer, LLMBusyError):
+                            stopped.add(i)
+            for i, errors in reduce_errors.items():
+                if errors:
+                    self.errors.setdefault(i, []).extend(errors)
+
+        for i, incident_notes in notes.items():
+            if not incident_notes:
+                continue
+            # Notes still above the budget after the last round, or after a
+            # failure, are shortened so that the final prompt fits the context
+            text = NOTES_SEPARATOR.join(incident_notes)
+            if estimate_tokens(text) > self.reduce_tokens:
+                separators = estimate_tokens(NOTES_SEPARATOR) * (
+                    len(incident_notes) - 1
+                )
+                share = max((self.reduce_tokens - separators) // len(incident_notes), 1)
+                text = NOTES_SEPARATOR.join(
+                    truncate_to_tokens(note, share) for note in incident_notes
+                )
+            prompts[i] = self.reduce_template.format(text)
+        return prompts
+
+    def count_calls(self, incidents_articles: list) -> int:
+        """The number of map calls, an estimate of the work before the reduce rounds."""
+        n_chunks = [
+            sum(
+                len(split_into_chunks(article, self.chunk_tokens))
+                for article in articles
+            )
+            for articles in incidents_articles
+        ]
+        return sum(n for n in n_chunks if n > 1)
@@ -0,0 +1,221 @@
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+TAXONOMY_DB = "taxonomy.db"
+
+
+def taxonomy_labels(kind: str, content: dict) -> dict:
+    """The labels of each annotation field in a stored taxonomy."""
+    if kind == "stakeholders":
+        return {"stakeholders": list(content["stakeholders"])}
+    return {
+        "harm_category": list(content["harm_categories"]),
+        "harm_subcategory": list(
+            dict.fromkeys(
+                harm for harms in content["harm_categories"].values() for harm in harms
+            )
+        ),
+    }
+
+
+def label_descriptions(kind: str, content: dict) -> dict:
+    if kind == "stakeholders":
+        return content["stakeholders"]
+    return content["harm_descriptions"]
+
+
+def diff_taxonomies(kind: str, old: dict, new: dict) -> pd.DataFrame:
+    """The labels of `old` missing from `new`, with the likely new label.
+
+    A label is likely renamed when a new label has the same description.
+    """
+    old_labels, new_labels = taxonomy_labels(kind, old), taxonomy_labels(kind, new)
+    new_by_description = {
+        description.strip(): label
+        for label, description in label_descriptions(kind, new).items()
+        if isinstance(description, str) and description.strip()
+    }
+    old_descriptions = label_descriptions(kind, old)
+    rows = []
+    for field, labels in old_labels.items():
+        for label in labels:
+            if label in new_labels[field]:
+                continue
+            description = old_descriptions.get(label)
+            suggested = (
+                new_by_description.get(description.strip())
+                if isinstance(description, str)
+                else None
+            )
+            rows.append(
+                dict(
+                    field=field,
+                    old=label,
+                    new=suggested if suggested in new_labels[field] else None,
+                )
+            )
+    return pd.DataFrame(rows, columns=["field", "old", "new"])
+
+
+def remap_labels(values: pd.Series, mapping: dict) -> pd.Series:
+    """The values translated with `mapping`, the others unchanged.
+
+    The distinct values are mapped once, as categories, and the result is
+    taken from their codes, so the cost hardly depends on the mapping size.
+    """
+    codes, uniques = pd.factorize(values)
+    if not mapping or not any(label in mapping for label in uniques):
+        return values
+    categories = np.array(
+        [mapping.get(label, label) for label in uniques] + [np.nan], dtype=object
+    )
+    # The missing values have the code -1, i.e. the trailing NaN
+    return pd.Series(categories[codes], index=values.index, name=values.name)
+
+
+def _follow(renamings: dict, label: str) -> str:
+    seen, label = {label}, renamings[label]
+    while label in renamings and renamings[label] not in seen:
+        seen.add(label)
+        label = renamings[label]
+    return label
+
+
+class TaxonomyStore:
+    """The versions of the taxonomy seen so far, and the mappings of their
+    labels to the newer ones, in SQLite."""
+
+    def __init__(self, database: str = TAXONOMY_DB) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            database, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS versions (
+                version TEXT PRIMARY KEY,
+                kind TEXT,
+                created_at REAL,
+                content TEXT
+            )
+            """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS mappings (
+                field TEXT,
+                old TEXT,
+                new TEXT,
+                from_version TEXT,
+                to_version TEXT,
+                created_at REAL,
+                PRIMARY KEY (field, old)
+            )
+            """)
+        # The resolved mappings, read again when they change
+        self._mappings = None
+
+    def record(self, snapshot) -> bool:
+        """Stores a `Harms` or `Stakeholders` snapshot, returns whether it is a new version."""
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO versions VALUES (?, ?, ?, ?)",
+                (
+                    snapshot.version,
+                    snapshot.kind,
+                    time.time(),
+                    json.dumps(snapshot.to_dict()),
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def versions(self, kind: str) -> pd.DataFrame:
+        """The versions of a kind of taxonomy, the oldest first."""
+        with self._lock:
+            df = pd.read_sql_query(
+                "SELECT version, created_at FROM versions WHERE kind = ? "
+                "ORDER BY created_at",
+                self._db,
+                params=(kind,),
+            )
+        df["created_at"] = pd.to_datetime(df.created_at, unit="s")
+        return df
+
+    def content(self, version: str) -> dict:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content FROM versions WHERE version = ?", (version,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_mappings(self, df_mappings: pd.DataFrame, from_version, to_version):
+        """Stores the `field`, `old` and `new` labels of the rows with a new label."""
+        df_mappings = df_mappings.dropna(subset=["new"])
+        df_mappings = df_mappings[df_mappings.new != df_mappings.old]
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO mappings VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (field, old, new, from_version, to_version, now)
+                    for field, old, new in zip(
+                        df_mappings.field, df_mappings.old, df_mappings.new
+                    )
+                ],
+            )
+            self._mappings = None
+        return len(df_mappings)
+
+    def delete_mapping(self, field: str, old: str):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM mappings WHERE field = ? AND old = ?", (field, old)
+            )
+            self._mappings = None
+
+    def mapping_table(self) -> pd.DataFrame:
+        with self._lock:
+            df = pd.read_sql_query(
+                "SELECT * FROM mappings ORDER BY created_at", self._db
+            )
+        df["created_at"] = pd.to_datetime(df.created_at, unit="s")
+        return df
+
+    def mappings(self) -> dict:
+        """Per field, the final label of each old label.
+
+        The successive renamings are followed, e.g. A -> B then B -> C
+        maps A to C, and a cycle stops where it would loop.
+        """
+        with self._lock:
+            if self._mappings is None:
+                direct = {}
+                for field, old, new in self._db.execute(
+                    "SELECT field, old, new FROM mappings"
+                ):
+                    direct.setdefault(field, {})[old] = new
+                self._mappings = {
+                    field: {old: _follow(renamings, old) for old in renamings}
+                    for field, renamings in direct.items()
+                }
+            return self._mappings
+
+    def migrate(self, df_annotations: pd.DataFrame) -> pd.DataFrame:
+        """The annotations with the labels of the older taxonomies translated."""
+        mappings = self.mappings()
+        fields = [field for field in mappings if field in df_annotations.columns]
+        if not fields:
+            return df_annotations
+        df_annotations = df_annotations.copy()
+        for field in fields:
+            df_annotations[field] = remap_labels(df_annotations[field], mappings[field])
+        return df_annotations
+
+
+@st.cache_resource
+def get_taxonomy_store() -> TaxonomyStore:
+    return TaxonomyStore()
@@ -1,18 +1,32 @@
+import hashlib
 import hmac
+import os
 import pickle
 import re
+import threading
 
 import html2text
 import pandas as pd
 import requests
 import streamlit as st
 from bs4 import BeautifulSoup
+from concurrency import shared_cache
+from local_sheets import LocalSheetsConnection
 from markdownify import markdownify
+from profiling import begin_rerun, cache_miss, timed
+from streamlit_gsheets import GSheetsConnection
+from taxonomy_versions import get_taxonomy_store
 
 TTL = 30 * 60 * 24
+# Seconds before giving up on a web page, so that a hanging fetch
+# does not block the sessions waiting for it
+REQUEST_TIMEOUT = 30
+# Incidents whose pages stay cached in the per-incident loaders
+MAX_CACHED_INCIDENTS = 1000
 
 
 def create_side_menu():
+    begin_rerun()
     st.markdown(
         """
     <style>
@@ -32,6 +46,11 @@ def create_side_menu():
 
         if "debug_mode" in st.secrets and st.secrets["debug_mode"]:
             st.page_link("pages/automatic.py", label="LLM", icon="🦜")
+            st.page_link("pages/scheduler.py", label="Scheduler", icon="🗂️")
+            st.page_link("pages/adjudication.py", label="Adjudication", icon="⚖️")
+            st.page_link("pages/taxonomy.py", label="Taxonomy", icon="🏷️")
+            st.page_link("pages/export.py", label="Export", icon="📦")
+            st.page_link("pages/profiling.py", label="Profiling", icon="⏱️")
 
 
 def switch_page(page_name: str):
@@ -93,6 +112,20 @@ def check_password():
     return False
 
 
+def debug_page_only():
+    """Stops the script of a hidden page outside of debug mode."""
+    if not ("debug_mode" in st.secrets and st.secrets["debug_mode"]):
+        st.stop()
+
+
+# The Google Sheets connection, or its local stand-in
+# when the `sheets_backend` secret is set to "local"
+def get_connection():
+    if st.secrets.get("sheets_backend", "gsheets") == "local":
+        return st.connection("gsheets", type=LocalSheetsConnection)
+    return st.connection("gsheets", type=GSheetsConnection)
+
+
 columns = [
     "datetime",
     "annotator",
@@ -105,10 +138,70 @@ columns = [
     "timestamp",
 ]
 
+# The adjudicated labels, one row per kept label as in the Annotations sheet
+gold_columns = [
+    "datetime",
+    "adjudicator",
+    "incident_ID",
+    "stakeholders",
+    "harm_category",
+    "harm_subcategory",
+    "harm_type",
+    "notes",
+    "timestamp",
+]
+
+
+def snapshot_version(df: pd.DataFrame) -> str:
+    """Returns a short content hash identifying a snapshot of a table.
+
+    Loaders store it in `df.attrs["version"]` so that downstream caches
+    can be keyed by the snapshot rather than by hashing the whole frame.
+    """
+    if "version" not in df.attrs:
+        digest = hashlib.sha1(
+            pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes()
+        )
+        df.attrs["version"] = digest.hexdigest()[:16]
+    return df.attrs["version"]
+
+
+# Append the new annotations to the Annotations worksheet.
+# The sheet can only be rewritten as a whole, hence the read beforehand.
+@timed
+def append_annotations(conn, df_update: pd.DataFrame) -> pd.DataFrame:
+    df = (
+        conn.read(
+            worksheet="Annotations",
+            ttl=0,
+            usecols=columns,
+            date_formatstr="%Y-%m-%d",
+        )
+        .dropna(how="all", axis=0)
+        .dropna(how="all", axis=1)
+    )
+
+    df = pd.concat([df, df_update], ignore_index=True)
+    conn.update(worksheet="Annotations", data=df)
+    return df
+
+
+def write_atomic(path: str, text: str):
+    """Writes a file in one step: readers and crashes leave either the old
+    or the new content, never a truncated one."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
 
 # Load the incidents descriptions and related links
 # scrapped from the AIAAIC website as they are not in the sheet
-@st.cache_data(ttl=TTL)
+@timed
+@shared_cache(ttl=TTL)
+@cache_miss
 def load_extra_data():
     with open("descriptions.pickle", "rb") as f:
         descriptions = pickle.load(f)
@@ -118,6 +211,7 @@ def load_extra_data():
     return descriptions, links
 
 
+@timed
 def download_public_sheet_as_csv(csv_url, filename="downloaded_sheet.csv"):
     """Downloads a public Google Sheet as a CSV file.
 
@@ -141,7 +235,9 @@ def download_public_sheet_as_csv(csv_url, filename="downloaded_sheet.csv"):
 # It used to be downloaded from the online repo
 # but due to frequent changes in the sheet format
 # I ended up using an offline (potentially not up to date) version
-@st.cache_data(ttl=TTL)
+@timed
+@shared_cache(ttl=TTL)
+@cache_miss
 def read_incidents_repository_from_file():
     download_public_sheet_as_csv(
         "https://docs.google.com/spreadsheets/d/1Bn55B4xz21-_Rgdr8BBb2lt0n_4rzLGxFADMlVW0PYI/export?format=csv&gid=888071280"
@@ -157,10 +253,13 @@ def read_incidents_repository_from_file():
     ]
 
     df.columns = ["title", "links"]
+    snapshot_version(df)
     return df
 
 
-@st.cache_data(ttl=TTL)
+@timed
+@shared_cache(ttl=TTL)
+@cache_miss
 def download_incidents_repository():
     AIAAIC_SHEET_ID = "1Bn55B4xz21-_Rgdr8BBb2lt0n_4rzLGxFADMlVW0PYI"
     AIAAIC_SHEET_NAME = "Repository"
@@ -177,12 +276,23 @@ def download_incidents_repository():
     ]
 
     df.columns = ["title", "links"]
+    snapshot_version(df)
     return df
 
 
-@st.cache_data(ttl=TTL, show_spinner="Fetching more information about the incident...")
+# Several annotators often open the same incident at once: the shared cache
+# coalesces their concurrent fetches of the same page into a single request
+@timed
+@shared_cache(
+    ttl=TTL,
+    show_spinner="Fetching more information about the incident...",
+    max_entries=MAX_CACHED_INCIDENTS,
+)
+@cache_miss
 def scrap_incident_description(link):
-    soup = BeautifulSoup(requests.get(link).text, "html.parser")
+    soup = BeautifulSoup(
+        requests.get(link, timeout=REQUEST_TIMEOUT).text, "html.parser"
+    )
 
     # This is dangeriously hard-coded.
     description = soup.find_all(
@@ -201,6 +311,22 @@ def scrap_incident_description(link):
     return description
 
 
+def prefetch_incident_descriptions(links: list):
+    """Fetches the descriptions in the background, so that they are
+    already cached when the annotator opens the incidents."""
+
+    def fetch(link):
+        try:
+            scrap_incident_description(link)
+        except Exception:
+            # The page will fetch it again, and show the error
+            pass
+
+    for link in links:
+        if not scrap_incident_description.freshness(link)["cached"]:
+            threading.Thread(target=fetch, args=(link,), daemon=True).start()
+
+
 # deprecated
 def get_deepest_text(tag):
     if tag.string:
@@ -216,7 +342,11 @@ def get_deepest_text(tag):
 
 
 # deprecated
-@st.cache_data(ttl=TTL, show_spinner="Fetching the list of links on the incident...")
+@shared_cache(
+    ttl=TTL,
+    show_spinner="Fetching the list of links on the incident...",
+    max_entries=MAX_CACHED_INCIDENTS,
+)
 def get_list_of_media_links(page_url):
     soup = BeautifulSoup(requests.get(page_url).text, "html.parser")
     section = soup.find(string=re.compile(", commentar"))
@@ -232,9 +362,11 @@ def get_list_of_media_links(page_url):
 
 
 # The list of annotators (or the initials thereof)
-@st.cache_data(
+@timed
+@shared_cache(
     ttl=TTL, show_spinner="Reading the annotators' list from Google Sheets..."
 )
+@cache_miss
 def get_annotators(_conn):
     df_annotators = (
         _conn.read(
@@ -248,7 +380,7 @@ def get_annotators(_conn):
     return df_annotators["Annotators"].to_list()
 
 
-@st.cache_data(
+@shared_cache(
     ttl=TTL, show_spinner="Reading the annotators' list from Google Sheets..."
 )
 def get_stakeholders(_conn):
@@ -280,7 +412,8 @@ stakeholders = {
 }
 
 
-@st.cache_data(
+# deprecated, use form.Harms
+@shared_cache(
     ttl=TTL, show_spinner="Reading the AI harm taxonomy from Google Sheets..."
 )
 def get_harm_descriptions(_conn):
@@ -303,9 +436,11 @@ def get_harm_descriptions(_conn):
     }, df_harm_descriptions.set_index("Harm").squeeze()
 
 
-@st.cache_data(
+@timed
+@shared_cache(
     ttl=TTL, show_spinner="Reading the incidents short-list from Google Sheets..."
 )
+@cache_miss
 def get_incidents_batch(_conn):
     df_shortlist = (
         _conn.read(worksheet="Batches", ttl=0)
@@ -316,9 +451,68 @@ def get_incidents_batch(_conn):
     return df_shortlist.to_list()
 
 
-@st.cache_data(
-    ttl=TTL, show_spinner="Reading the old annotations from Google Sheets..."
+@timed
+@shared_cache(ttl=TTL, show_spinner="Reading the gold labels from Google Sheets...")
+@cache_miss
+def get_gold_labels(_conn) -> pd.DataFrame:
+    try:
+        df_gold = _conn.read(worksheet="Gold", ttl=0, usecols=gold_columns)
+    except Exception:
+        # The Gold worksheet is created by hand before the first adjudication
+        return pd.DataFrame(columns=gold_columns)
+    return df_gold.dropna(how="all", axis=0)
+
+
+# The gold labels of an incident replace its previous ones. As for the
+# annotations, the sheet is read beforehand as it is rewritten as a whole.
+@timed
+def write_gold_labels(conn, incident_id: str, df_labels: pd.DataFrame):
+    df_gold = conn.read(worksheet="Gold", ttl=0, usecols=gold_columns).dropna(
+        how="all", axis=0
+    )
+    df_gold = pd.concat(
+        [df_gold[df_gold.incident_ID != incident_id], df_labels[gold_columns]],
+        ignore_index=True,
+    )
+    conn.update(worksheet="Gold", data=df_gold)
+    get_gold_labels.clear()
+
+
+# The per-annotator queues written by the scheduler page
+@timed
+@shared_cache(
+    ttl=TTL, show_spinner="Reading the annotators' queues from Google Sheets..."
 )
+@cache_miss
+def get_annotator_queues(_conn) -> dict:
+    try:
+        df_queues = _conn.read(worksheet="Queues", ttl=0)
+    except Exception:
+        # The Queues worksheet is only created by the first run of the scheduler,
+        # no queue is cached until then rather than reading it at every rerun
+        return {}
+    df_queues = df_queues.dropna(how="all", axis=0).dropna(how="all", axis=1)
+    if df_queues.empty:
+        return {}
+    return (
+        df_queues.sort_values("position")
+        .groupby("annotator")["incident_ID"]
+        .apply(list)
+        .to_dict()
+    )
+
+
+@timed
+def write_annotator_queues(conn, df_queues: pd.DataFrame):
+    conn.update(
+        worksheet="Queues", data=df_queues[["annotator", "incident_ID", "position"]]
+    )
+    get_annotator_queues.clear()
+
+
+@timed
+@shared_cache(ttl=TTL, show_spinner="Reading the old annotations from Google Sheets...")
+@cache_miss
 def get_annotated_incidents(_conn):
     df_annotations = (
         (
@@ -334,9 +528,33 @@ def get_annotated_incidents(_conn):
     return df_annotations
 
 
-@st.cache_data(ttl=TTL, show_spinner="Fetching the list of links on the incident...")
+@timed
+@shared_cache(ttl=TTL, show_spinner="Reading the annotations from Google Sheets...")
+@cache_miss
+def get_annotations(_conn) -> pd.DataFrame:
+    df_annotations = (
+        _conn.read(worksheet="Annotations", ttl=0, usecols=columns)
+        .dropna(how="all", axis=0)
+        .dropna(how="all", axis=1)
+    )
+    # The labels renamed or merged since the annotations were made are
+    # translated to the current ones, the sheet keeps the original ones
+    df_annotations = get_taxonomy_store().migrate(df_annotations)
+    snapshot_version(df_annotations)
+    return df_annotations
+
+
+@timed
+@shared_cache(
+    ttl=TTL,
+    show_spinner="Fetching the list of links on the incident...",
+    max_entries=MAX_CACHED_INCIDENTS,
+)
+@cache_miss
 def get_list_of_links(page_url):
-    soup = BeautifulSoup(requests.get(page_url).text, "html.parser")
+    soup = BeautifulSoup(
+        requests.get(page_url, timeout=REQUEST_TIMEOUT).text, "html.parser"
+    )
     section = soup.find(string=re.compile(", commentar"))
 
     if not section:
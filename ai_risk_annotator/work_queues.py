@@ -0,0 +1,68 @@
+import threading
+from collections import deque
+
+import streamlit as st
+
+
+class WorkQueue:
+    """The incidents an annotator still has to annotate, in order.
+
+    The annotated incidents are removed lazily from the head of the
+    queue, so that getting the next incident is O(1) amortized.
+    """
+
+    def __init__(self, incidents: list, annotated) -> None:
+        self.incidents = tuple(incidents)
+        self.done = set(annotated)
+        self.pending = deque(self.incidents)
+        self._lock = threading.Lock()
+
+    def mark_done(self, incident_id: str):
+        with self._lock:
+            self.done.add(incident_id)
+
+    def next(self) -> str:
+        """The first incident not annotated yet, None when the queue is empty."""
+        with self._lock:
+            while self.pending and self.pending[0] in self.done:
+                self.pending.popleft()
+            return self.pending[0] if self.pending else None
+
+    def upcoming(self, after: str, n: int = 1) -> list:
+        """The `n` pending incidents following `after`, to be prefetched."""
+        with self._lock:
+            upcoming = []
+            for incident_id in self.pending:
+                if len(upcoming) == n:
+                    break
+                if incident_id != after and incident_id not in self.done:
+                    upcoming.append(incident_id)
+            return upcoming
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(i not in self.done for i in self.pending)
+
+
+class WorkQueues:
+    """The work queues of all the annotators, shared by their sessions."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._queues = {}
+
+    def get(self, annotator: str, incidents: list, annotated) -> WorkQueue:
+        """The queue of the annotator, rebuilt when its list of incidents changed."""
+        with self._lock:
+            queue = self._queues.get(annotator)
+            if queue is None or queue.incidents != tuple(incidents):
+                queue = self._queues[annotator] = WorkQueue(incidents, annotated)
+        # Annotations submitted from elsewhere, e.g. another session
+        with queue._lock:
+            queue.done.update(annotated)
+        return queue
+
+
+@st.cache_resource
+def get_work_queues() -> WorkQueues:
+    return WorkQueues()
@@ -0,0 +1,48 @@
+"""Compares two benchmark result files.
+
+Usage:
+
+    python benchmarks/compare.py OLD.json NEW.json [--threshold 0.1]
+
+Exits with status 1 when a benchmark regressed by more than the threshold
+(relative change of the median).
+"""
+
+import argparse
+import json
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{'benchmark':55s} {old['commit']:>10s} {new['commit']:>10s}   change")
+    regressions = []
+    for name, result in new["benchmarks"].items():
+        if name not in old["benchmarks"]:
+            print(f"{name:55s} {'-':>10s} {result['median_ms']:10.2f}")
+            continue
+        before = old["benchmarks"][name]["median_ms"]
+        after = result["median_ms"]
+        change = (after - before) / before if before else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  <-- regression"
+            regressions.append(name)
+        print(f"{name:55s} {before:10.2f} {after:10.2f}   {change:+7.1%}{flag}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
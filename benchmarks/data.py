@@ -0,0 +1,83 @@
+"""Synthetic Annotations table with the same columns as the Google Sheet."""
+
+import numpy as np
+import pandas as pd
+
+ANNOTATORS = ["DB", "CP", "GA", "JS", "MK", "AL", "RT", "SN"]
+STAKEHOLDERS = [
+    "Users",
+    "General public",
+    "Vulnerable groups",
+    "Workers",
+    "Artists/content creators",
+    "Government/public sector",
+    "Business",
+    "Investors",
+]
+TAXONOMY = {
+    "Autonomy": ["Loss of agency", "Manipulation", "Coercion"],
+    "Physical": ["Injury", "Loss of life", "Property damage"],
+    "Psychological": ["Distress", "Addiction", "Harassment"],
+    "Reputational": ["Defamation", "Embarrassment"],
+    "Financial & Business": ["Loss of income", "Fraud", "Market manipulation"],
+    "Human rights & Civil liberties": ["Discrimination", "Privacy loss", "Censorship"],
+    "Societal & Cultural": ["Misinformation", "Polarisation", "Loss of trust"],
+    "Political & Economic": ["Election interference", "Job loss"],
+    "Environmental": ["Pollution", "Energy consumption"],
+}
+
+
+def synthetic_annotations(
+    n_rows: int, annotators_per_incident: int = 3, seed: int = 0
+) -> pd.DataFrame:
+    """Generates `n_rows` annotation rows.
+
+    Rows are grouped in submissions (one annotator, one incident, one
+    timestamp) of 1 to 5 rows. Every incident is annotated once by each
+    member of the same panel of annotators, as in a batch with full overlap,
+    which is what the agreement code of the results page expects.
+    """
+    rng = np.random.default_rng(seed)
+    panel = ANNOTATORS[:annotators_per_incident]
+    n_submissions = max(1, n_rows // 3 + 1)
+    n_incidents = -(-n_submissions // len(panel))
+    n_submissions = n_incidents * len(panel)
+
+    rows_per_submission = rng.integers(1, 6, size=n_submissions)
+    incidents = np.repeat(np.arange(1, n_incidents + 1), len(panel))
+    annotators = np.tile(np.arange(len(panel)), n_incidents)
+    timestamps = 1_720_000_000 + np.sort(
+        rng.integers(0, 90 * 24 * 3600, size=n_submissions)
+    )
+
+    submission = np.repeat(np.arange(n_submissions), rows_per_submission)
+    n_total = len(submission)
+
+    categories = list(TAXONOMY)
+    category = rng.integers(0, len(categories), size=n_total)
+    subcategory_position = rng.integers(0, 3, size=n_total)
+    subcategories = [
+        TAXONOMY[categories[c]][p % len(TAXONOMY[categories[c]])]
+        for c, p in zip(category, subcategory_position)
+    ]
+    notes = np.where(rng.random(n_total) < 0.05, "Unclear harm definition", None)
+
+    df = pd.DataFrame(
+        {
+            "datetime": pd.to_datetime(timestamps[submission], unit="s").normalize(),
+            "annotator": np.array(panel)[annotators[submission]],
+            "incident_ID": pd.Series(incidents[submission]).map("AIAAIC{:05d}".format),
+            "stakeholders": np.array(STAKEHOLDERS)[
+                rng.integers(0, len(STAKEHOLDERS), size=n_total)
+            ],
+            "harm_category": np.array(categories)[category],
+            "harm_subcategory": subcategories,
+            "harm_type": np.where(rng.random(n_total) < 0.7, "Actual", "Potential"),
+            "notes": notes,
+            "timestamp": timestamps[submission],
+        }
+    )
+    # Truncate on a submission boundary so that every incident stays complete
+    last_submission = submission[min(n_rows, n_total) - 1]
+    n_incidents_kept = last_submission // len(panel) + 1
+    return df[submission < n_incidents_kept * len(panel)].reset_index(drop=True)
@@ -0,0 +1,125 @@
+"""Load test of the annotation submissions against the local sheets backend.
+
+Usage (from the repository root):
+
+    python benchmarks/load_test.py [--annotators 30] [--submissions 5]
+        [--latency 0.3] [--jitter 0.2] [--error-rate 0.0]
+
+Each simulated annotator submits its rows through `utils.append_annotations`,
+the same read-modify-write path as the annotator page, with the injected
+latency on every sheet call. Concurrent submissions overwrite each other,
+so the final row count is compared with the submitted one to measure
+the lost updates.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "ai_risk_annotator"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import utils  # noqa: E402
+from data import synthetic_annotations  # noqa: E402
+from local_sheets import LocalSheetsConnection  # noqa: E402
+
+
+def simulate_annotator(conn, annotator, n_submissions, stats, barrier):
+    barrier.wait()
+    for i in range(n_submissions):
+        # Unlike hash(), which is salted per process, the same in every run
+        seed = zlib.crc32(f"{annotator}-{i}".encode())
+        df_update = synthetic_annotations(3, seed=seed)
+        df_update["annotator"] = annotator
+        df_update["incident_ID"] = f"LOAD{i:04d}"
+        df_update["datetime"] = df_update["datetime"].dt.strftime("%Y-%m-%d")
+        start = time.perf_counter()
+        try:
+            utils.append_annotations(conn, df_update[utils.columns])
+        except Exception as e:
+            stats["errors"].append(repr(e))
+        else:
+            stats["submitted_rows"].append(len(df_update))
+            stats["latencies"].append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--annotators", type=int, default=30)
+    parser.add_argument("--submissions", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--initial-rows", type=int, default=5000)
+    parser.add_argument(
+        "--output", type=Path, help="Where to write the results as JSON"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = LocalSheetsConnection(
+            "gsheets",
+            database=str(Path(tmp) / "load_test.db"),
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+        )
+        initial = synthetic_annotations(args.initial_rows)[utils.columns]
+        initial["datetime"] = initial["datetime"].dt.strftime("%Y-%m-%d")
+        conn._instance.execute("DROP TABLE IF EXISTS Annotations")
+        initial.to_sql("Annotations", conn._instance, index=False)
+
+        stats = {"submitted_rows": [], "latencies": [], "errors": []}
+        barrier = threading.Barrier(args.annotators)
+        threads = [
+            threading.Thread(
+                target=simulate_annotator,
+                args=(conn, f"A{n:02d}", args.submissions, stats, barrier),
+            )
+            for n in range(args.annotators)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        # Read without the injected latency and errors
+        final_rows = len(pd.read_sql_query("SELECT * FROM Annotations", conn._instance))
+
+    submitted_rows = sum(stats["submitted_rows"])
+    stored_rows = final_rows - len(initial)
+    latencies = sorted(stats["latencies"]) or [float("nan")]
+    results = {
+        "annotators": args.annotators,
+        "submissions_per_annotator": args.submissions,
+        "latency_s": args.latency,
+        "jitter_s": args.jitter,
+        "error_rate": args.error_rate,
+        "duration_s": duration,
+        "successful_submissions": len(stats["latencies"]),
+        "failed_submissions": len(stats["errors"]),
+        "throughput_submissions_per_s": len(stats["latencies"]) / duration,
+        "submit_p50_s": statistics.median(latencies),
+        "submit_p95_s": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "submitted_rows": submitted_rows,
+        "stored_rows": stored_rows,
+        "lost_update_rate": 1 - stored_rows / submitted_rows if submitted_rows else 0.0,
+        "error_samples": stats["errors"][:3],
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Records an AIAAIC incident page and its media articles as benchmark fixtures.
+
+Usage (needs network access):
+
+    python benchmarks/record_fixtures.py https://www.aiaaic.org/aiaaic-repository/... [--max-articles 5]
+
+The links of the incident page are rewritten to point to the local
+fixture server, so that the benchmarks never leave the machine.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "ai_risk_annotator"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import utils  # noqa: E402
+from run import uncached  # noqa: E402
+from servers import FIXTURES_DIR  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("incident_page")
+    parser.add_argument("--max-articles", type=int, default=5)
+    args = parser.parse_args()
+
+    html = requests.get(args.incident_page, timeout=30).text
+    links = uncached(utils.get_list_of_links)(args.incident_page)
+
+    media_dir = FIXTURES_DIR / "media"
+    media_dir.mkdir(parents=True, exist_ok=True)
+    recorded = 0
+    for link in links:
+        if recorded == args.max_articles:
+            break
+        try:
+            response = requests.get(link, timeout=30)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Skipping {link}: {e}")
+            continue
+        recorded += 1
+        (media_dir / f"article_{recorded}.html").write_text(response.text)
+        html = html.replace(
+            link, f"http://127.0.0.1:{{port}}/media/article_{recorded}.html"
+        )
+        print(f"Recorded {link}")
+
+    (FIXTURES_DIR / "incident.html").write_text(html)
+    print(f"Recorded {args.incident_page} with {recorded} media articles")
+
+
+if __name__ == "__main__":
+    main()
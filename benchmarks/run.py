@@ -0,0 +1,381 @@
+"""Offline benchmarks of the scraping, extraction and analytics code.
+
+Usage (from the repository root):
+
+    python benchmarks/run.py [--sizes 10000 100000 1000000] [--repeat 5]
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+The scraping and extraction benchmarks fetch the pages of
+`benchmarks/fixtures` from a local server. The shipped pages are hand-made,
+synthetic stand-ins with the markup of an AIAAIC incident page and of news
+articles, not recordings of real pages; `benchmarks/record_fixtures.py`
+replaces them with recorded ones. The LLM benchmarks talk to
+the Ollama stub of `benchmarks/servers.py`. The streamlit caches are
+bypassed so that every repetition measures the actual work.
+Results are written to `benchmarks/results/<timestamp>-<commit>.json`, which
+git ignores, or to the path given with `--output`.
+"""
+
+import argparse
+import datetime
+import inspect
+import itertools
+import json
+import os
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "ai_risk_annotator"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import analytics  # noqa: E402
+from adjudication import DisagreementTable  # noqa: E402
+from latest_annotations import LatestAnnotations  # noqa: E402
+from taxonomy_versions import remap_labels  # noqa: E402
+import pandas as pd  # noqa: E402
+import llm  # noqa: E402
+import utils  # noqa: E402
+from data import synthetic_annotations  # noqa: E402
+from servers import serve  # noqa: E402
+
+RESULTS_DIR = Path(__file__).parent / "results"
+# Seconds taken by the stub to answer, as a stand-in for the model's work
+STUB_GENERATION_LATENCY = 0.05
+
+
+def uncached(func):
+    """The undecorated function, bypassing streamlit's cache and the profiling."""
+    return inspect.unwrap(func)
+
+
+def measure(func, repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        func()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": durations[0],
+        "median_ms": statistics.median(durations),
+        "mean_ms": statistics.fmean(durations),
+        "p95_ms": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+    }
+
+
+def scraping_cases(base_url: str) -> dict:
+    incident_page = f"{base_url}/incident.html"
+    links = uncached(utils.get_list_of_links)(incident_page)
+    return {
+        "scrap_incident_description": lambda: uncached(
+            utils.scrap_incident_description
+        )(incident_page),
+        "get_list_of_links": lambda: uncached(utils.get_list_of_links)(incident_page),
+        f"extract_content[{len(links)} articles]": lambda: uncached(
+            llm.extract_content
+        )(links),
+    }
+
+
+def llm_cases(base_url: str) -> dict:
+    import ollama
+
+    client = ollama.Client(host=base_url)
+    return {
+        "ollama_generate[stub]": lambda: client.generate(
+            model="llama3.1:latest", prompt="Summarize the incident"
+        ),
+        "ollama_chat_stream[stub]": lambda: list(
+            client.chat(
+                model="llama3.1:latest",
+                messages=[{"role": "user", "content": "Summarize the incident"}],
+                stream=True,
+            )
+        ),
+    }
+
+
+def llm_batch_cases(base_url: str, cache_dir: str) -> dict:
+    """A run of several summaries, against a stub that takes some time to answer."""
+    import ollama
+    from llm_backends import OllamaBackend, OpenAICompatibleBackend
+    from llm_cache import ResponseCache
+    from llm_client import LLMClient
+
+    client = ollama.Client(host=base_url)
+    prompts = [f"Summarize the incident {n}" for n in range(8)]
+    clients = {
+        "ollama": LLMClient(OllamaBackend(host=base_url), max_concurrency=4),
+        "openai": LLMClient(
+            OpenAICompatibleBackend(base_url=f"{base_url}/v1"), max_concurrency=4
+        ),
+        "openai,batch 4": LLMClient(
+            OpenAICompatibleBackend(base_url=f"{base_url}/v1", batch_size=4),
+            max_concurrency=4,
+        ),
+        # Answered from the response cache after the warmup run
+        "ollama,cached": LLMClient(
+            OllamaBackend(host=base_url),
+            max_concurrency=4,
+            cache=ResponseCache(str(Path(cache_dir) / "llm_cache.db")),
+        ),
+    }
+    cases = {
+        "ollama_generate_sequential[8 prompts,slow stub]": lambda: [
+            client.generate(model="llama3.1:latest", prompt=prompt)
+            for prompt in prompts
+        ]
+    }
+    for name, llm_client in clients.items():
+        cases[f"llm_client_generate_many[{name},8 prompts,slow stub]"] = (
+            lambda llm_client=llm_client: llm_client.generate_many(
+                "llama3.1:latest", prompts
+            )
+        )
+    return cases
+
+
+def search_cases(index_dir: str) -> dict:
+    """Indexing and querying the incidents' descriptions shipped with the repository."""
+    from search_index import SearchIndex
+
+    with open(ROOT / "descriptions.pickle", "rb") as f:
+        documents = {k: v or "" for k, v in pickle.load(f).items()}
+    index = SearchIndex(index_dir)
+    index.update(documents)
+    index.save()
+    some_incident = next(iter(documents))
+    return {
+        f"search_index_build[{len(documents)} incidents]": lambda: SearchIndex(
+            index_dir
+        ).update(documents),
+        "search_index_load": lambda: SearchIndex.load(index_dir),
+        "search_index_search[top 30]": lambda: index.search(
+            "facial recognition police wrongful arrest", k=30
+        ),
+        "search_index_similar[top 5]": lambda: index.similar(some_incident, k=5),
+    }
+
+
+def scheduler_cases(index_dir: str) -> dict:
+    """Scoring the shipped incidents with synthetic annotations of two thirds of them."""
+    from scheduler import BatchScheduler
+    from search_index import SearchIndex
+
+    index = SearchIndex.load(index_dir)
+    df = synthetic_annotations(3 * len(index.ids))
+    # The synthetic incidents are mapped onto the indexed ones
+    synthetic_ids = df.incident_ID.unique()
+    df.incident_ID = df.incident_ID.map(
+        dict(zip(synthetic_ids, index.ids[: len(synthetic_ids) * 2 // 3]))
+    )
+    df = df.dropna(subset=["incident_ID"])
+    scheduler = BatchScheduler(index)
+    scheduler.update(df)
+    # One more submission, as after an annotator's answer
+    df_more = pd.concat([df, df.iloc[:3].assign(annotator="NEW")], ignore_index=True)
+
+    def update_one_submission():
+        scheduler.update(df)
+        scheduler.update(df_more)
+
+    return {
+        f"scheduler_build[{len(index.ids)} incidents]": lambda: BatchScheduler(index),
+        f"scheduler_full_update[{len(df)} rows]": lambda: BatchScheduler(index).update(
+            df
+        ),
+        "scheduler_incremental_update[x2]": update_one_submission,
+        "scheduler_queues[8 annotators x 50]": lambda: scheduler.queues(
+            list(df.annotator.unique()) + ["NEW"], 50
+        ),
+    }
+
+
+def dedup_cases() -> dict:
+    """Near-duplicate detection over the shipped descriptions, with copies of a fifth of them."""
+    from dedup import canonical_articles
+
+    with open(ROOT / "descriptions.pickle", "rb") as f:
+        texts = [v for v in pickle.load(f).values() if v]
+    # Five articles per incident, and the copy of the first one,
+    # as only the articles of the same incident are compared
+    incidents_articles = [
+        texts[i : i + 5] + [f"{texts[i]} (Reuters)"] for i in range(0, len(texts), 5)
+    ]
+    n_articles = sum(map(len, incidents_articles))
+    return {
+        f"canonical_articles[{n_articles} articles]": lambda: canonical_articles(
+            incidents_articles
+        ),
+    }
+
+
+def analytics_cases(n_rows: int) -> dict:
+    df = synthetic_annotations(n_rows)
+    sankey_vars = ["incident_ID", "annotator", "stakeholders", "harm_subcategory"]
+    df_sankey = analytics.sankey_counts(df, sankey_vars)
+    cases = {
+        f"agreement_alphas[{n_rows}]": lambda: analytics.agreement_alphas(df),
+        f"sankey_counts[{n_rows}]": lambda: analytics.sankey_counts(df, sankey_vars),
+        f"gen_sankey[{n_rows}]": lambda: analytics.gen_sankey(
+            df_sankey, sankey_vars, "counts", None
+        ),
+    }
+    df_more = pd.concat(
+        [df, df.iloc[:3].assign(annotator="NEW", timestamp=2_000_000_000)],
+        ignore_index=True,
+    )
+    # As read by utils.get_annotations
+    utils.snapshot_version(df)
+    utils.snapshot_version(df_more)
+    latest_annotations = LatestAnnotations()
+    latest_annotations.update(df)
+    df_latest = latest_annotations.frame()
+    df_latest_more = analytics.latest_submissions(df_more)
+
+    def new_snapshot():
+        latest_annotations.update(df_more)
+        latest_annotations.update(df)
+
+    def unchanged_snapshot():
+        # A new version of the same rows, as after a refresh without new
+        # submissions: the rows are hashed, the version does not short-cut it
+        df.attrs["version"] = next(versions)
+        latest_annotations.update(df)
+
+    versions = itertools.count()
+    cases[f"latest_submissions_on_read[{n_rows}]"] = (
+        lambda: analytics.latest_submissions(df)
+    )
+    cases[f"latest_annotations_rerun[{n_rows}]"] = unchanged_snapshot
+    cases[f"latest_annotations_new_snapshot[{n_rows},x2]"] = new_snapshot
+    cases[f"latest_annotations_apply[{n_rows}]"] = lambda: latest_annotations.apply(
+        df_more.iloc[-3:]
+    )
+
+    disagreement_table = DisagreementTable()
+    disagreement_table.update(df_latest)
+    # Each call adds or removes the new submission, i.e. one real update
+    snapshots = itertools.cycle([df_latest_more, df_latest])
+
+    cases[f"disagreement_full_update[{n_rows}]"] = lambda: DisagreementTable().update(
+        df_latest
+    )
+    cases[f"disagreement_incremental_update[{n_rows}]"] = (
+        lambda: disagreement_table.update(next(snapshots))
+    )
+    # A fifth of the subcategories renamed, and two of them merged
+    subcategories = df.harm_subcategory.dropna().unique()
+    mapping = {label: f"{label} (v2)" for label in subcategories[::5]}
+    mapping[subcategories[1]] = mapping[subcategories[0]]
+    cases[f"remap_labels[{n_rows}]"] = lambda: remap_labels(
+        df.harm_subcategory, mapping
+    )
+    cases[f"replace_labels[{n_rows}]"] = lambda: df.harm_subcategory.replace(mapping)
+    for column in ["annotator", "stakeholders", "harm_subcategory"]:
+        cases[f"counts_figure[{column},{n_rows}]"] = (
+            lambda column=column: analytics.counts_figure(df, column)
+        )
+    return cases
+
+
+def export_cases(n_rows: int, export_dir: str) -> dict:
+    """Streaming the synthetic annotations to partitioned JSONL and Parquet files."""
+    from export import FORMATS, export_datasets, frame_chunks
+
+    df = synthetic_annotations(n_rows)
+    df["datetime"] = df.datetime.dt.strftime("%Y-%m-%d")
+    return {
+        f"export_annotations[{fmt},{n_rows}]": (
+            lambda fmt=fmt: export_datasets(
+                {"annotations": frame_chunks(df)}, fmt, export_dir
+            )
+        )
+        for fmt in FORMATS
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--only", nargs="+", help="Only run the benchmarks containing these strings"
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the results")
+    args = parser.parse_args()
+
+    results = {}
+
+    def run(cases: dict, repeat: int):
+        for name, func in cases.items():
+            if args.only and not any(s in name for s in args.only):
+                continue
+            results[name] = measure(func, repeat)
+            print(
+                f"{name:55s} median {results[name]['median_ms']:10.2f} ms"
+                f"  p95 {results[name]['p95_ms']:10.2f} ms",
+                flush=True,
+            )
+
+    with serve() as base_url:
+        run(scraping_cases(base_url), args.repeat)
+        run(llm_cases(base_url), args.repeat)
+    with serve(latency=STUB_GENERATION_LATENCY) as base_url:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            run(llm_batch_cases(base_url, cache_dir), args.repeat)
+    with tempfile.TemporaryDirectory() as index_dir:
+        run(search_cases(index_dir), args.repeat)
+        run(scheduler_cases(index_dir), args.repeat)
+    run(dedup_cases(), args.repeat)
+    for n_rows in args.sizes:
+        # The largest tables are slow enough for a few repetitions to do
+        run(analytics_cases(n_rows), args.repeat if n_rows <= 100_000 else 2)
+        with tempfile.TemporaryDirectory() as export_dir:
+            run(
+                export_cases(n_rows, export_dir),
+                args.repeat if n_rows <= 100_000 else 2,
+            )
+
+    commit = git_commit()
+    output = args.output or RESULTS_DIR / (
+        datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{commit}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "commit": commit,
+                "created_at": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "benchmarks": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
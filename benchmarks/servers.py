@@ -0,0 +1,184 @@
+"""Local HTTP servers standing in for the AIAAIC website, the media outlets and Ollama.
+
+The fixture server serves the files of `benchmarks/fixtures`, replacing
+`{port}` in the HTML so that the links of the incident page point back
+to it. The LLM stub implements the Ollama endpoints used by the app
+(`/api/tags`, `/api/generate`, `/api/chat`) and the OpenAI-compatible
+ones (`/v1/models`, `/v1/chat/completions`, `/v1/completions`, which
+answers a list of prompts in a single request). It answers after a
+configurable latency, so that the client overhead can be measured
+without a model.
+"""
+
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+STUB_MODELS = [
+    {
+        "name": "llama3.1:latest",
+        "model": "llama3.1:latest",
+        "modified_at": "2024-09-01T00:00:00Z",
+        "size": 4661224676,
+        "digest": "stub-llama3.1",
+        "details": {
+            "parent_model": "",
+            "format": "gguf",
+            "family": "llama",
+            "families": ["llama"],
+            "parameter_size": "8.0B",
+            "quantization_level": "Q4_0",
+        },
+    }
+]
+STUB_RESPONSE = (
+    "A welfare agency's fraud detection model wrongly flagged claimants, "
+    "suspending the benefits of ethnic minority families for months."
+)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = (FIXTURES_DIR / self.path.lstrip("/")).resolve()
+        if FIXTURES_DIR.resolve() not in path.parents or not path.is_file():
+            self.send_error(404)
+            return
+        body = path.read_text().replace("{port}", str(self.server.server_port))
+        self._send(body.encode("utf-8"), "text/html; charset=utf-8")
+
+    def _send(self, body: bytes, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OllamaStubHandler(FixtureHandler):
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": STUB_MODELS})
+        elif self.path == "/v1/models":
+            self._send_json(
+                {
+                    "object": "list",
+                    "data": [
+                        {"id": m["name"], "object": "model", "owned_by": "stub"}
+                        for m in STUB_MODELS
+                    ],
+                }
+            )
+        else:
+            super().do_GET()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        time.sleep(self.server.latency)
+        if self.path.startswith("/v1/"):
+            self._openai_reply(request)
+            return
+        if self.path == "/api/generate":
+            message = {"response": STUB_RESPONSE}
+        elif self.path == "/api/chat":
+            message = {"message": {"role": "assistant", "content": STUB_RESPONSE}}
+        else:
+            self.send_error(404)
+            return
+
+        reply = {"model": request["model"], "done": True, **message}
+        if not request.get("stream", True):
+            self._send_json(reply)
+            return
+
+        # Streamed replies are newline-delimited JSON, one word per chunk
+        def chunk(token, done):
+            if "response" in message:
+                content = {"response": token}
+            else:
+                content = {"message": {"role": "assistant", "content": token}}
+            return {"model": request["model"], "done": done, **content}
+
+        words = STUB_RESPONSE.split(" ")
+        chunks = [chunk(words[0], False)]
+        chunks += [chunk(" " + word, False) for word in words[1:]]
+        chunks.append(chunk("", True))
+        body = "".join(json.dumps(c) + "\n" for c in chunks)
+        self._send(body.encode("utf-8"), "application/x-ndjson")
+
+    def _openai_reply(self, request):
+        if self.path == "/v1/completions":
+            prompts = request["prompt"]
+            prompts = [prompts] if isinstance(prompts, str) else prompts
+            self._send_json(
+                {
+                    "id": "cmpl-stub",
+                    "object": "text_completion",
+                    "created": int(time.time()),
+                    "model": request["model"],
+                    "choices": [
+                        {"index": i, "text": STUB_RESPONSE, "finish_reason": "stop"}
+                        for i in range(len(prompts))
+                    ],
+                }
+            )
+            return
+        if self.path != "/v1/chat/completions":
+            self.send_error(404)
+            return
+
+        reply = {
+            "id": "chatcmpl-stub",
+            "created": int(time.time()),
+            "model": request["model"],
+        }
+        if not request.get("stream", False):
+            choice = {
+                "index": 0,
+                "message": {"role": "assistant", "content": STUB_RESPONSE},
+                "finish_reason": "stop",
+            }
+            self._send_json({**reply, "object": "chat.completion", "choices": [choice]})
+            return
+
+        # Streamed replies are server-sent events, one word per chunk
+        def chunk(delta, finish_reason=None):
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            return {**reply, "object": "chat.completion.chunk", "choices": [choice]}
+
+        words = STUB_RESPONSE.split(" ")
+        chunks = [chunk({"role": "assistant", "content": words[0]})]
+        chunks += [chunk({"content": " " + word}) for word in words[1:]]
+        chunks.append(chunk({}, "stop"))
+        body = (
+            "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+        )
+        self._send(body.encode("utf-8"), "text/event-stream")
+
+    def _send_json(self, data):
+        self._send(json.dumps(data).encode("utf-8"), "application/json")
+
+
+@contextlib.contextmanager
+def serve(handler=OllamaStubHandler, latency: float = 0.0):
+    """Serves the fixtures (and the Ollama stub) on a free local port.
+
+    Yields the base URL of the server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.latency = latency
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()